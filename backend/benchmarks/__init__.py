@@ -0,0 +1,27 @@
+"""Benchmarks for the restorang backend.
+
+Run them from the ``backend`` directory, e.g.::
+
+    python -m benchmarks.menu_roundtrips
+
+They never talk to the real Supabase project; every upstream call goes to
+the in-process PostgREST stand-in in ``benchmarks.postgrest_stub``.
+"""
+import os
+
+
+def setup():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "restorang.settings")
+    os.environ.setdefault("SUPABASE_URL", "http://stub.local")
+    os.environ.setdefault("SUPABASE_KEY", "stub-key")
+
+    import django
+    django.setup()
+
+    # one log line per request would drown the results
+    import logging
+    logging.getLogger("restorang.requests").setLevel(logging.WARNING)
+
+    # the Django test clients send requests for the host "testserver"
+    from django.conf import settings
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "testserver"]
@@ -0,0 +1,125 @@
+"""Requests/sec of the JSON endpoints under WSGI and under ASGI.
+
+Starts the PostgREST stand-in as a local HTTP server with a fixed latency
+per call, then drives the Django app in a child process per mode: through
+the WSGI handler from a pool of threads, and through the ASGI handler (with
+``RESTORANG_ASYNC_VIEWS``, so the async views use the async client) from as
+many asyncio tasks. The read-through cache is disabled so every request
+reaches the stub::
+
+    python -m benchmarks.asgi_vs_wsgi --concurrency 32 --duration 5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from .fixtures import synthetic_tables
+from .postgrest_stub import PostgrestStub, serve
+
+
+def _paths(restaurants, items):
+    for n in itertools.count():
+        rest_id = n % restaurants + 1
+        yield "/api/fetch-items-prices/?rest_id=%d" % rest_id
+        yield "/api/item-price-history/?item_id=%d" % (n % (restaurants * items) + 1)
+        yield "/api/restbytype/?type=bistro"
+
+
+def run_wsgi(args):
+    from django.test import Client
+
+    paths = _paths(args.restaurants, args.items)
+    lock = threading.Lock()
+    done = []
+    deadline = time.perf_counter() + args.duration
+
+    def worker():
+        client = Client()
+        count = 0
+        while time.perf_counter() < deadline:
+            with lock:
+                path = next(paths)
+            client.get(path)
+            count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done)
+
+
+def run_asgi(args):
+    from django.test import AsyncClient
+
+    paths = _paths(args.restaurants, args.items)
+
+    async def worker(deadline):
+        client = AsyncClient()
+        count = 0
+        while time.perf_counter() < deadline:
+            await client.get(next(paths))
+            count += 1
+        return count
+
+    async def main():
+        deadline = time.perf_counter() + args.duration
+        return sum(await asyncio.gather(*(worker(deadline) for _ in range(args.concurrency))))
+
+    return asyncio.run(main())
+
+
+def child(args):
+    from . import setup
+    setup()
+    runner = run_asgi if args.mode == "asgi" else run_wsgi
+    started = time.perf_counter()
+    requests = runner(args)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"mode": args.mode, "requests": requests, "rps": requests / elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per upstream call")
+    parser.add_argument("--restaurants", type=int, default=20)
+    parser.add_argument("--items", type=int, default=30)
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return child(args)
+
+    stub = PostgrestStub(synthetic_tables(args.restaurants, args.items, 10), latency=args.latency)
+    server = serve(stub)
+    results = []
+    for mode in ("wsgi", "asgi"):
+        env = dict(
+            os.environ,
+            SUPABASE_URL="http://127.0.0.1:%d" % server.server_port,
+            SUPABASE_KEY="stub-key",
+            RESTORANG_ASYNC_VIEWS="1" if mode == "asgi" else "",
+            RESTORANG_CACHE_TTL="0",
+        )
+        command = [sys.executable, "-m", "benchmarks.asgi_vs_wsgi", "--mode", mode] + sys.argv[1:]
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    server.shutdown()
+
+    print("%-5s  %9s  %9s" % ("mode", "requests", "req/s"))
+    for result in results:
+        print("%-5s  %9d  %9.1f" % (result["mode"], result["requests"], result["rps"]))
+
+
+if __name__ == "__main__":
+    main()
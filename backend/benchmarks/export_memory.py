@@ -0,0 +1,75 @@
+"""Peak memory of the streaming price export against the number of rows.
+
+The export view is driven through the Django test client with a
+repository whose pages are generated on the fly, so the numbers show the
+memory held by the export pipeline itself (paging, encoding, gzip) and
+not by a data source. The peak should stay flat as the row count grows::
+
+    python -m benchmarks.export_memory --rows 10000 100000 1000000
+"""
+import argparse
+import datetime
+import time
+import tracemalloc
+
+from . import setup
+
+
+def synthetic_repository(total):
+    from restorang_app.repository import Repository
+
+    start = datetime.date(2024, 1, 1)
+
+    class SyntheticPrices(Repository):
+        def prices_page(self, limit, after=None, **filters):
+            first = (after or 0) + 1
+            return [
+                {
+                    "price_id": price_id,
+                    "date": (start + datetime.timedelta(days=price_id % 700)).isoformat(),
+                    "value": round(1.5 + price_id % 2350 / 100, 2),
+                    "source": "menu",
+                    "item_id": price_id % 5000 + 1,
+                    "rest_id": price_id % 200 + 1,
+                    "user_id": None,
+                }
+                for price_id in range(first, min(first + limit, total + 1))
+            ]
+
+    return SyntheticPrices()
+
+
+def measure(rows, fmt, gzip):
+    from django.test import Client
+    from restorang_app import views
+
+    repository = synthetic_repository(rows)
+    views.get_repository = lambda: repository
+    headers = {"HTTP_ACCEPT_ENCODING": "gzip"} if gzip else {}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = Client().get("/api/export/prices/", {"format": fmt}, **headers)
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    setup()
+
+    print("%-7s  %4s  %9s  %10s  %8s  %9s" % ("format", "gzip", "rows", "bytes", "seconds", "peak KiB"))
+    for fmt in ("ndjson", "csv"):
+        for gzip in (False, True):
+            for rows in args.rows:
+                size, elapsed, peak = measure(rows, fmt, gzip)
+                print("%-7s  %4s  %9d  %10d  %8.2f  %9.0f" % (fmt, "yes" if gzip else "no", rows, size, elapsed, peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
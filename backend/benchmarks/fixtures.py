@@ -0,0 +1,72 @@
+"""Synthetic data for the PostgREST stand-in."""
+import datetime
+import random
+
+TYPES = ["restoran", "kafić", "pizzeria", "bistro", "slastičarnica"]
+QUARTERS = ["Centar", "Trešnjevka", "Maksimir", "Dubrava", "Novi Zagreb", "Špansko"]
+CATEGORIES = ["Pića", "Kava", "Pizza", "Tjestenina", "Deserti", "Glavna jela", "Salate", "Juhe"]
+
+
+def synthetic_tables(restaurants=10, items_per_restaurant=20, prices_per_item=5, seed=0):
+    rng = random.Random(seed)
+    start = datetime.date(2024, 1, 1)
+    # shared by every item; with millions of prices the copies add up
+    dates = [(start + datetime.timedelta(days=30 * p)).isoformat() for p in range(prices_per_item)]
+    tables = {
+        "category": [
+            {"category_id": i + 1, "name": name} for i, name in enumerate(CATEGORIES)
+        ],
+        "restaurant": [],
+        "item": [],
+        "price": [],
+    }
+    item_id = 0
+    price_id = 0
+    for r in range(1, restaurants + 1):
+        tables["restaurant"].append({
+            "rest_id": r,
+            "name": "Restoran %d" % r,
+            "type": rng.choice(TYPES),
+            "location": "Ilica %d, Zagreb" % r,
+            "quarter": rng.choice(QUARTERS),
+        })
+        for _ in range(items_per_restaurant):
+            item_id += 1
+            tables["item"].append({
+                "item_id": item_id,
+                "name": "Artikl %d" % item_id,
+                "type": "hrana",
+                "category_id": rng.randint(1, len(CATEGORIES)),
+                "rest_id": r,
+            })
+            value = rng.uniform(1.5, 25.0)
+            for p in range(prices_per_item):
+                price_id += 1
+                value = max(0.5, value * rng.uniform(0.97, 1.08))
+                tables["price"].append({
+                    "price_id": price_id,
+                    "date": dates[p],
+                    "value": round(value, 2),
+                    "source": rng.choice(["web", "menu", "korisnik"]),
+                    "item_id": item_id,
+                    "rest_id": r,
+                    "user_id": None,
+                })
+    return tables
+
+
+def tables_from_fixture(path):
+    """Stub tables from a Django fixture of the restorang models."""
+    import json
+    from django.apps import apps
+
+    tables = {}
+    for entry in json.load(open(path, encoding="utf-8")):
+        model = apps.get_model(entry["model"])
+        row = {model._meta.pk.name: entry["pk"]}
+        for name, value in entry["fields"].items():
+            if model._meta.get_field(name).get_internal_type() == "DecimalField":
+                value = float(value)
+            row[name] = value
+        tables.setdefault(model._meta.db_table, []).append(row)
+    return tables
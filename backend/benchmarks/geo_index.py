@@ -0,0 +1,92 @@
+"""Nearest-restaurant queries through the grid index against a full scan.
+
+Places synthetic restaurants at random around Zagreb and times k-nearest
+and radius queries through `restorang_app.geo.GeoIndex` and through a
+scan over every restaurant. Both must return the same restaurants::
+
+    python -m benchmarks.geo_index --restaurants 2000 5000 20000
+"""
+import argparse
+import random
+import time
+
+from . import setup
+from .fixtures import TYPES
+
+CENTER = (45.8150, 15.9819)
+SPREAD = (0.08, 0.15)  # degrees of latitude and longitude around CENTER
+QUERIES = [
+    ("k=10", dict(k=10)),
+    ("k=1", dict(k=1)),
+    ("k=10 bistro", dict(k=10, kind="bistro")),
+    ("k=50 r=2km", dict(k=50, radius=2000)),
+    ("r=1km", dict(radius=1000)),
+]
+
+
+def scan(rows, lat, lng, k=None, radius=None, kind=None):
+    from restorang_app.geo import distance
+
+    found = sorted(
+        (distance(lat, lng, latitude, longitude), row["rest_id"])
+        for row, latitude, longitude in rows
+        if not kind or row["type"] == kind
+    )
+    found = [rest_id for d, rest_id in found if radius is None or d <= radius]
+    return found[:k] if k else found
+
+
+def _time(function, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return (time.perf_counter() - started) / rounds * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--restaurants", type=int, nargs="+", default=[2000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=200, help="query points per size")
+    args = parser.parse_args()
+    setup()
+    from django.conf import settings
+    from restorang_app.geo import GeoIndex
+
+    rng = random.Random(0)
+    print("%8s  %-12s  %10s  %10s" % ("rows", "query", "scan us", "index us"))
+    for size in args.restaurants:
+        rows = [
+            (
+                {"rest_id": rest_id, "type": rng.choice(TYPES)},
+                CENTER[0] + rng.uniform(-SPREAD[0], SPREAD[0]),
+                CENTER[1] + rng.uniform(-SPREAD[1], SPREAD[1]),
+            )
+            for rest_id in range(1, size + 1)
+        ]
+        index = GeoIndex(settings.RESTORANG_GEO["CELL_DEGREES"])
+        for row, latitude, longitude in rows:
+            index.add(row, latitude, longitude)
+        points = [
+            (CENTER[0] + rng.uniform(-SPREAD[0], SPREAD[0]), CENTER[1] + rng.uniform(-SPREAD[1], SPREAD[1]))
+            for _ in range(args.queries)
+        ]
+
+        for name, query in QUERIES:
+            if "k" in query:
+                def lookup(lat, lng):
+                    return [entry[3]["rest_id"] for entry in index.nearest(lat, lng, **query)]
+            else:
+                def lookup(lat, lng):
+                    return [entry[3]["rest_id"] for entry in index.within(lat, lng, **query)]
+            scanned = indexed = 0.0
+            for lat, lng in points:
+                scan_us, expected = _time(lambda: scan(rows, lat, lng, **query), 1)
+                index_us, result = _time(lambda: lookup(lat, lng), 20)
+                assert result == expected, (name, lat, lng)
+                scanned += scan_us
+                indexed += index_us
+            print("%8d  %-12s  %10.1f  %10.1f" % (size, name, scanned / len(points), indexed / len(points)))
+
+
+if __name__ == "__main__":
+    main()
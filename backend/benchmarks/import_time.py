@@ -0,0 +1,124 @@
+"""Cold-start cost: wall time and ``python -X importtime`` totals per boot path.
+
+Every scenario runs in a fresh interpreter, ``--runs`` times, and reports
+the median wall time, the time spent importing (the top-level entries of
+``-X importtime``) and the slowest top-level imports:
+
+* ``settings`` - importing ``restorang.settings``
+* ``setup`` - ``django.setup()``, what every ``manage.py`` command and
+  test run pays
+* ``wsgi`` - the WSGI application and URL configuration, a worker boot
+* ``first-client`` - a worker boot plus building the Supabase client,
+  which the settings used to do on import
+
+``--baseline REF`` runs the same scenarios against the backend as of a
+git revision, e.g. the commit before the clients became lazy::
+
+    python -m benchmarks.import_time --baseline HEAD~1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+SCENARIOS = {
+    "settings": "import restorang.settings",
+    "setup": "import django; django.setup()",
+    "wsgi": "from restorang.wsgi import application; from django.urls import get_resolver; get_resolver().url_patterns",
+    "first-client": (
+        "from restorang.wsgi import application; from django.urls import get_resolver; get_resolver().url_patterns; "
+        "import restorang.settings; restorang.settings.supabase"
+    ),
+}
+
+
+def parse(stderr):
+    """Top-level imports from ``-X importtime`` output as ``{module: microseconds}``."""
+    found = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith(" " * 3) or not cumulative.strip().isdigit():
+            # nested below another import, or the header line
+            continue
+        found[name.strip()] = found.get(name.strip(), 0) + int(cumulative)
+    return found
+
+
+def run(code, cwd):
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "restorang.settings",
+        "SUPABASE_URL": os.environ.get("SUPABASE_URL", "http://stub.local"),
+        "SUPABASE_KEY": os.environ.get("SUPABASE_KEY", "stub-key"),
+        "PYTHONDONTWRITEBYTECODE": "",
+    }
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode:
+        raise SystemExit("%s failed in %s:\n%s" % (code, cwd, result.stderr[-2000:]))
+    return wall, parse(result.stderr)
+
+
+def measure(cwd, runs, top):
+    measured = {}
+    for name, code in SCENARIOS.items():
+        walls, imports = [], []
+        for _ in range(runs):
+            wall, modules = run(code, cwd)
+            walls.append(wall)
+            imports.append(modules)
+        total = statistics.median(sum(modules.values()) for modules in imports)
+        slowest = sorted(imports[-1].items(), key=lambda item: -item[1])[:top]
+        measured[name] = {
+            "wall_ms": round(statistics.median(walls) * 1e3, 1),
+            "import_ms": round(total / 1e3, 1),
+            "slowest": [(module, round(us / 1e3, 1)) for module, us in slowest],
+        }
+    return measured
+
+
+def report(label, measured):
+    print("\n%s" % label)
+    print("%-14s %9s %10s  %s" % ("scenario", "wall ms", "import ms", "slowest imports (ms)"))
+    for name, result in measured.items():
+        slowest = ", ".join("%s %.0f" % item for item in result["slowest"])
+        print("%-14s %9.1f %10.1f  %s" % (name, result["wall_ms"], result["import_ms"], slowest))
+
+
+def checkout(ref, directory):
+    archive = Path(directory) / "backend.tar"
+    with open(archive, "wb") as out:
+        # run from the backend directory, git archives just that directory
+        subprocess.run(["git", "archive", "--format=tar", ref], cwd=BACKEND, stdout=out, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(Path(directory) / "backend", filter="data")
+    return Path(directory) / "backend"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="interpreters per scenario")
+    parser.add_argument("--top", type=int, default=4, help="slowest imports to list")
+    parser.add_argument("--baseline", metavar="REF", help="also measure the backend at this git revision")
+    args = parser.parse_args()
+
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            report("baseline (%s)" % args.baseline, measure(checkout(args.baseline, directory), args.runs, args.top))
+    report("working tree", measure(BACKEND, args.runs, args.top))
+
+
+if __name__ == "__main__":
+    main()
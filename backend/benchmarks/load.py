@@ -0,0 +1,134 @@
+"""Load driver: latency percentiles and throughput per endpoint.
+
+Every endpoint in turn is driven by ``--concurrency`` clients for
+``--duration`` seconds, each request with ids drawn at random from the
+dataset, and the run reports p50/p95/p99 latency, requests per second and
+errors per endpoint. ``--output`` saves them for `benchmarks.results`.
+
+By default the app runs in-process (the WSGI handler through Django's test
+client, one thread per client) against the PostgREST stand-in seeded with
+the dataset. With ``--url`` the requests go to a running server instead;
+seed its stand-in with the same dataset arguments::
+
+    python -m benchmarks.load --concurrency 16 --duration 10 --output after.json
+
+    python -m benchmarks.postgrest_stub --restaurants 2000 --items 50 --prices 20 --latency 0.005
+    SUPABASE_URL=http://127.0.0.1:54321 gunicorn restorang.wsgi -w 4
+    python -m benchmarks.load --url http://127.0.0.1:8000
+"""
+import argparse
+import random
+import threading
+import time
+
+from . import results, setup, workload
+
+
+class HttpClient:
+    """The slice of Django's test client `workload.send` uses, over HTTP."""
+
+    def __init__(self, url):
+        import httpx
+
+        self._client = httpx.Client(base_url=url, timeout=60)
+
+    def get(self, path, data=None):
+        return self._client.get(path, params=data)
+
+    def post(self, path, data=None, content_type=None, headers=None):
+        if content_type:
+            return self._client.post(path, content=data, headers={**(headers or {}), "Content-Type": content_type})
+        return self._client.post(path, data=data, headers=headers)
+
+
+def drive(make_client, request, concurrency, duration, seed):
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        client = make_client()
+        rng = random.Random(seed * 1000 + number)
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok, _ = workload.send(client, request(rng))
+            except Exception:
+                ok = False
+            mine.append(time.perf_counter() - started)
+            failed += not ok
+        with lock:
+            samples.extend(mine)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = results.summarize(samples, time.perf_counter() - started)
+    summary["errors"] = sum(errors)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    workload.add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--url", help="drive a running server instead of the app in-process")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    stub = runner = None
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        setup()
+        from django.test import Client
+        from restorang_app.test_runner import UnmanagedModelTestRunner
+
+        runner = UnmanagedModelTestRunner(verbosity=0)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        stub = workload.install(args)
+        make_client = Client
+
+    try:
+        requests = workload.requests(args)
+        rng = random.Random(args.seed)
+        warm = make_client()
+        for request in requests.values():
+            workload.send(warm, request(rng))
+        if stub:
+            stub.latency, stub.jitter = args.latency, args.jitter
+
+        measured = {}
+        print("%-26s %9s %9s %9s %9s %9s %7s" % ("endpoint", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"))
+        for name, request in requests.items():
+            if stub:
+                stub.reset_counters()
+            summary = drive(make_client, request, args.concurrency, args.duration, args.seed)
+            if stub:
+                summary["upstream_calls"] = round(stub.requests / summary["count"], 2)
+            measured[name] = summary
+            print("%-26s %9d %9.1f %9.2f %9.2f %9.2f %7d" % (
+                name, summary["count"], summary["rps"], summary["p50_ms"], summary["p95_ms"], summary["p99_ms"],
+                summary["errors"]))
+    finally:
+        if runner:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+    if args.output:
+        results.save(args.output, "load", vars(args), measured)
+        print("saved to %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Upstream round-trips of the menu endpoint as the menu grows.
+
+Compares the old per-item lookups with ``menu.get_menu`` and checks that
+both produce the same payload. Price rows are read in pages of
+``repository.PAGE_SIZE``, so the batched loader only needs extra calls once the
+menu carries more than that many price rows::
+
+    python -m benchmarks.menu_roundtrips
+"""
+import time
+
+from . import setup
+from .fixtures import synthetic_tables
+from .postgrest_stub import PostgrestStub
+
+MENU_SIZES = [10, 50, 200, 400]
+LATENCY = 0.002  # seconds per upstream call
+
+
+def per_item_menu(rest_id, client):
+    items = client.table('item').select('*').eq('rest_id', rest_id).execute().data
+    result = []
+    for item in items:
+        category = client.table('category').select('name').eq('category_id', item['category_id']).execute()
+        prices = client.table('price').select('*').eq('item_id', item['item_id']).execute()
+        result.append({
+            **item,
+            "prices": prices.data or [],
+            "category_name": category.data[0]['name'] if category.data else None,
+        })
+    return result
+
+
+def measure(stub, target, loader):
+    from restorang_app import cache
+
+    cache.backend.clear()
+    stub.reset_counters()
+    started = time.perf_counter()
+    payload = loader(1, target)
+    return payload, stub.requests, (time.perf_counter() - started) * 1000
+
+
+def main():
+    setup()
+    from restorang_app import menu
+    from restorang_app.repository import SupabaseRepository
+
+    print("%6s  %14s  %14s  %10s  %10s" % ("items", "per-item calls", "batched calls", "per-item ms", "batched ms"))
+    for size in MENU_SIZES:
+        stub = PostgrestStub(synthetic_tables(restaurants=1, items_per_restaurant=size), latency=LATENCY)
+        client = stub.client()
+        old, old_calls, old_ms = measure(stub, client, per_item_menu)
+        new, new_calls, new_ms = measure(stub, SupabaseRepository(client), menu.get_menu)
+        assert old == new, "batched menu differs from the per-item menu"
+        print("%6d  %14d  %14d  %10.1f  %10.1f" % (size, old_calls, new_calls, old_ms, new_ms))
+
+
+if __name__ == "__main__":
+    main()
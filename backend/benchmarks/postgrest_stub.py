@@ -0,0 +1,475 @@
+"""In-process stand-in for the Supabase PostgREST API.
+
+The stub speaks enough of the PostgREST wire format (``select`` with simple
+embeds, ``eq``/``in``/``ilike``/... filters, ``order``, ``limit``/``offset``,
+inserts and updates) for the real ``supabase`` client to run against it,
+either in-process through an ``httpx.MockTransport`` or over HTTP with
+``serve()``. Every request is counted so benchmarks can report upstream
+round-trips, and can be delayed by ``latency`` seconds plus up to
+``jitter`` seconds more to stand in for the network.
+
+Lookups stay cheap on tables with millions of rows: ``eq``/``in`` filters
+go through hash indexes, and reads in primary key order (the keyset pages)
+start from a binary search on the key instead of scanning the table.
+
+Functions in ``listeners`` are called with every row written, as a
+Realtime ``postgres_changes`` payload (see ``benchmarks.realtime_stub``).
+
+Run it as a local server for the Django dev server::
+
+    python -m benchmarks.postgrest_stub --port 54321 --latency 0.02
+    SUPABASE_URL=http://127.0.0.1:54321 python manage.py runserver
+"""
+import argparse
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from supabase import create_client
+from supabase.lib.client_options import SyncClientOptions
+
+STUB_URL = "http://stub.local"
+STUB_KEY = "stub-key"
+
+PRIMARY_KEYS = {
+    "restaurant": "rest_id",
+    "item": "item_id",
+    "category": "category_id",
+    "price": "price_id",
+    "pricereport": "report_id",
+    "users": "user_id",
+}
+
+
+def _split_top_level(text, sep=","):
+    parts = []
+    depth = 0
+    current = ""
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _coerce(raw, sample):
+    if raw == "null":
+        return None
+    if isinstance(sample, bool):
+        return raw == "true"
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+def _like(pattern, flags=0):
+    regex = re.escape(pattern).replace("%", ".*").replace("_", ".")
+    return re.compile(regex, flags | re.DOTALL)
+
+
+class PostgrestStub:
+    def __init__(self, tables=None, latency=0.0, jitter=0.0):
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self._indexes = {}
+        self._key_ordered = {}
+        self.requests = 0
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def reset_counters(self):
+        self.requests = 0
+
+    # -- client helpers -------------------------------------------------
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def client(self):
+        options = SyncClientOptions(httpx_client=httpx.Client(transport=self.transport()))
+        return create_client(STUB_URL, STUB_KEY, options=options)
+
+    # -- request handling -----------------------------------------------
+
+    def handle(self, request):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        table = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+        params = list(request.url.params.multi_items())
+        prefer = request.headers.get("prefer", "")
+        with self._lock:
+            self.requests += 1
+            status, rows, headers = self.dispatch(request.method, table, params, prefer, request.content)
+        return httpx.Response(status, headers=headers, content=json.dumps(rows, default=str).encode())
+
+    def dispatch(self, method, table, params, prefer, body):
+        rows = self.tables.setdefault(table, [])
+        select = "*"
+        order = None
+        limit = None
+        offset = 0
+        on_conflict = None
+        filters = []
+        for key, value in params:
+            if key == "select":
+                select = value
+            elif key == "order":
+                order = value
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key == "on_conflict":
+                on_conflict = value
+            elif key == "columns":
+                continue
+            else:
+                filters.append((key, value))
+
+        if method == "POST":
+            payload = json.loads(body or b"[]")
+            if isinstance(payload, dict):
+                payload = [payload]
+            written, stale = self._insert(table, rows, payload, on_conflict, prefer)
+            if stale:
+                self._invalidate(table)
+            return 201, written, {}
+        if method == "PATCH":
+            changes = json.loads(body or b"{}")
+            matched = self._filter(table, rows, filters)
+            for row in matched:
+                old = dict(row)
+                row.update(changes)
+                self._notify(table, "UPDATE", row, old)
+            self._invalidate(table)
+            return 200, matched, {}
+        if method == "DELETE":
+            matched = self._filter(table, rows, filters)
+            self.tables[table] = [row for row in rows if not self._matches(row, filters)]
+            for row in matched:
+                self._notify(table, "DELETE", None, row)
+            self._invalidate(table)
+            return 200, matched, {}
+
+        primary_key = PRIMARY_KEYS.get(table)
+        if (
+            limit is not None and "count=" not in prefer
+            and order in (None, primary_key, "%s.asc" % primary_key)
+            and not any(expression.startswith(("eq.", "in.")) for _, expression in filters)
+            and self._in_key_order(table, rows)
+        ):
+            matched = self._key_range(table, rows, filters, offset + limit)
+            return 200, [self._project(table, row, select) for row in matched[offset:]], {}
+
+        matched = self._filter(table, rows, filters)
+        if order:
+            for term in reversed(order.split(",")):
+                column, _, direction = term.partition(".")
+                matched.sort(
+                    key=lambda row: (row.get(column) is None, row.get(column)),
+                    reverse=direction.startswith("desc"),
+                )
+        total = len(matched)
+        end = total if limit is None else offset + limit
+        matched = matched[offset:end]
+        headers = {}
+        if "count=" in prefer:
+            headers["content-range"] = "%d-%d/%d" % (offset, offset + len(matched) - 1, total)
+        return 200, [self._project(table, row, select) for row in matched], headers
+
+    def _insert(self, table, rows, payload, on_conflict, prefer):
+        """Insert (or merge) `payload`, keeping the table's indexes current.
+
+        Returns the written rows and whether the indexes went stale.
+        """
+        key = on_conflict or PRIMARY_KEYS.get(table)
+        columns = tuple(key.split(",")) if key else ()
+        merge = "resolution=merge-duplicates" in prefer
+        primary_key = PRIMARY_KEYS.get(table)
+        existing_rows = self._conflict_index(table, rows, columns) if merge and columns else {}
+        indexes = {column: index for column, index in self._indexes.get(table, {}).items() if isinstance(column, str)}
+        stale = False
+        next_id = None
+        written = []
+        for new in payload:
+            if primary_key and new.get(primary_key) is None and (primary_key not in new or "missing=default" in prefer):
+                # stands in for the serial default of the primary key
+                if next_id is None:
+                    if self._in_key_order(table, rows):
+                        next_id = (rows[-1][primary_key] if rows else 0) + 1
+                    else:
+                        next_id = max((row.get(primary_key) or 0 for row in rows), default=0) + 1
+                new = dict(new, **{primary_key: next_id})
+                next_id += 1
+            signature = tuple(str(new.get(c)) for c in columns)
+            existing = existing_rows.get(signature)
+            if existing is not None:
+                changes = {k: v for k, v in new.items() if k != primary_key or v is not None}
+                stale = stale or any(
+                    column in indexes and str(existing.get(column)) != str(value) for column, value in changes.items()
+                )
+                old = dict(existing)
+                existing.update(changes)
+                self._notify(table, "UPDATE", existing, old)
+                written.append(existing)
+            else:
+                row = dict(new)
+                if self._key_ordered.get(table) and rows and (
+                    row.get(primary_key) is None or row[primary_key] <= rows[-1][primary_key]
+                ):
+                    self._key_ordered.pop(table, None)
+                for column, index in indexes.items():
+                    index.setdefault(str(row.get(column)), []).append(len(rows))
+                rows.append(row)
+                self._notify(table, "INSERT", row, None)
+                written.append(row)
+                if merge and columns:
+                    existing_rows[signature] = row
+        if "return=minimal" in prefer:
+            return [], stale
+        return written, stale
+
+    def _notify(self, table, kind, record, old_record):
+        if not self.listeners:
+            return
+        # what the change feed sends, with full old rows (REPLICA IDENTITY FULL)
+        payload = json.loads(json.dumps({"data": {
+            "schema": "public",
+            "table": table,
+            "type": kind,
+            "commit_timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "record": record or {},
+            "old_record": old_record or {},
+        }}, default=str))
+        for listener in self.listeners:
+            listener(payload)
+
+    def _conflict_index(self, table, rows, columns):
+        indexes = self._indexes.setdefault(table, {})
+        if columns not in indexes:
+            indexes[columns] = {tuple(str(row.get(c)) for c in columns): row for row in rows}
+        return indexes[columns]
+
+    def _invalidate(self, table):
+        self._indexes.pop(table, None)
+        self._key_ordered.pop(table, None)
+
+    # -- filters --------------------------------------------------------
+
+    def _matches(self, row, filters):
+        return all(self._predicate(column, expression)(row) for column, expression in filters)
+
+    def _filter(self, table, rows, filters):
+        predicates = [self._predicate(column, expression) for column, expression in filters]
+        candidates = self._candidates(table, rows, filters)
+        return [row for row in candidates if all(test(row) for test in predicates)]
+
+    def _candidates(self, table, rows, filters):
+        # narrow the scan with a hash index on the first eq/in filtered column
+        for column, expression in filters:
+            op, _, raw = expression.partition(".")
+            if op == "eq":
+                keys = [raw]
+            elif op == "in":
+                keys = [part.strip('"') for part in _split_top_level(raw.strip("()"))]
+            else:
+                continue
+            index = self._index(table, rows, column)
+            positions = sorted(p for key in keys for p in index.get(key, ()))
+            return [rows[p] for p in positions]
+        return rows
+
+    def _in_key_order(self, table, rows):
+        if table not in self._key_ordered:
+            key = PRIMARY_KEYS.get(table)
+            values = [row.get(key) for row in rows] if key else [None]
+            self._key_ordered[table] = None not in values and all(a < b for a, b in zip(values, values[1:]))
+        return self._key_ordered[table]
+
+    def _key_range(self, table, rows, filters, count):
+        # the first `count` matching rows from the lower bound of the key
+        key = PRIMARY_KEYS[table]
+        start = 0
+        for column, expression in filters:
+            op, _, raw = expression.partition(".")
+            if column == key and op in ("gt", "gte") and rows:
+                find = bisect.bisect_right if op == "gt" else bisect.bisect_left
+                start = max(start, find(rows, _coerce(raw, rows[0][key]), key=lambda row: row[key]))
+        predicates = [self._predicate(column, expression) for column, expression in filters]
+        matched = []
+        for position in range(start, len(rows)):
+            row = rows[position]
+            if all(test(row) for test in predicates):
+                matched.append(row)
+                if len(matched) == count:
+                    break
+        return matched
+
+    def _index(self, table, rows, column):
+        indexes = self._indexes.setdefault(table, {})
+        if column not in indexes:
+            index = {}
+            for position, row in enumerate(rows):
+                index.setdefault(str(row.get(column)), []).append(position)
+            indexes[column] = index
+        return indexes[column]
+
+    def _predicate(self, column, expression):
+        if column in ("or", "and"):
+            return self._group(column, expression[1:-1])
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        op, _, raw = expression.partition(".")
+        test = self._operator(op, raw)
+        if negate:
+            return lambda row: not test(row.get(column))
+        return lambda row: test(row.get(column))
+
+    def _group(self, kind, body):
+        # or=(a.eq.1,and(b.lt.2,c.eq.3))
+        tests = []
+        for term in _split_top_level(body):
+            if term.startswith(("or(", "and(")):
+                name, _, rest = term.partition("(")
+                tests.append(self._group(name, rest[:-1]))
+            else:
+                column, _, expression = term.partition(".")
+                tests.append(self._predicate(column, expression))
+        combine = any if kind == "or" else all
+        return lambda row: combine(test(row) for test in tests)
+
+    def _operator(self, op, raw):
+        if op == "is":
+            if raw == "null":
+                return lambda value: value is None
+            return lambda value: str(value).lower() == raw
+        if op == "in":
+            options = {part.strip('"') for part in _split_top_level(raw.strip("()"))}
+            return lambda value: value is not None and str(value) in options
+        if op in ("like", "ilike"):
+            pattern = _like(raw.replace("*", "%"), re.IGNORECASE if op == "ilike" else 0)
+            return lambda value: value is not None and pattern.fullmatch(str(value)) is not None
+        compare = {
+            "eq": lambda a, b: a == b,
+            "neq": lambda a, b: a != b,
+            "gt": lambda a, b: a > b,
+            "gte": lambda a, b: a >= b,
+            "lt": lambda a, b: a < b,
+            "lte": lambda a, b: a <= b,
+        }.get(op)
+        if compare is None:
+            raise ValueError("unsupported operator: %s" % op)
+        return lambda value: value is not None and compare(value, _coerce(raw, value))
+
+    # -- projection -----------------------------------------------------
+
+    def _project(self, table, row, select):
+        fields = [part.strip() for part in _split_top_level(select)]
+        if fields == ["*"]:
+            return dict(row)
+        result = {}
+        for field in fields:
+            if field == "*":
+                result.update(row)
+            elif "(" in field:
+                name, _, inner = field.partition("(")
+                result[name] = self._embed(table, row, name, inner[:-1])
+            else:
+                result[field] = row.get(field)
+        return result
+
+    def _embed(self, table, row, related, select):
+        parent_key = PRIMARY_KEYS.get(table)
+        related_key = PRIMARY_KEYS.get(related)
+        related_rows = self.tables.get(related, [])
+        if related_key and related_key in row:
+            match = next((r for r in related_rows if r.get(related_key) == row[related_key]), None)
+            return self._project(related, match, select) if match else None
+        return [
+            self._project(related, r, select)
+            for r in related_rows
+            if r.get(parent_key) == row.get(parent_key)
+        ]
+
+
+def serve(stub, host="127.0.0.1", port=0):
+    """Serve `stub` over HTTP from a background thread; returns the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _respond(self):
+            length = int(self.headers.get("content-length") or 0)
+            request = httpx.Request(
+                self.command,
+                "http://%s:%d%s" % (host, server.server_port, self.path),
+                headers=dict(self.headers),
+                content=self.rfile.read(length) if length else b"",
+            )
+            response = stub.handle(request)
+            self.send_response(response.status_code)
+            for name, value in response.headers.items():
+                if name.lower() != "content-length":
+                    self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response.content)))
+            self.end_headers()
+            self.wfile.write(response.content)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    from .fixtures import synthetic_tables
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds more, at random")
+    parser.add_argument("--restaurants", type=int, default=20)
+    parser.add_argument("--items", type=int, default=30, help="items per restaurant")
+    parser.add_argument("--prices", type=int, default=10, help="prices per item")
+    args = parser.parse_args()
+
+    stub = PostgrestStub(
+        synthetic_tables(args.restaurants, args.items, args.prices), latency=args.latency, jitter=args.jitter
+    )
+    server = serve(stub, port=args.port)
+    print("PostgREST stand-in on http://127.0.0.1:%d" % server.server_port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
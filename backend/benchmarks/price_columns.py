@@ -0,0 +1,206 @@
+"""Analytics on the price columns against the same analytics on a dict of
+rows.
+
+Generates synthetic prices (a random walk per item, one price every
+~20 days), keeps them once as ``{price_id: row}`` - the rows as the
+repository returns them - and once as `restorang_app.price_columns`, and
+prints the memory each holds per million prices and the time per call of
+`restorang_app.analytics` against pure-Python versions working on the
+dict. Both must give the same results::
+
+    python -m benchmarks.price_columns --restaurants 1000 --items 50 --prices 20
+"""
+import argparse
+import datetime
+import math
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+from . import setup
+
+CATEGORIES = 12
+
+
+def generate(restaurants, items, prices, seed=0):
+    """``(items, rows)``: item rows, and a generator of price rows."""
+    rng = random.Random(seed)
+    start = datetime.date(2023, 1, 1)
+    item_rows = [
+        {"item_id": (rest_id - 1) * items + number + 1, "rest_id": rest_id, "category_id": rng.randint(1, CATEGORIES)}
+        for rest_id in range(1, restaurants + 1) for number in range(items)
+    ]
+
+    def rows():
+        # the same prices on every call
+        rng = random.Random(seed + 1)
+        price_id = 0
+        for item in item_rows:
+            value = rng.uniform(2, 40)
+            date = start + datetime.timedelta(days=rng.randrange(20))
+            for _ in range(prices):
+                price_id += 1
+                yield {
+                    "price_id": price_id, "item_id": item["item_id"], "rest_id": item["rest_id"],
+                    "date": date.isoformat(), "value": round(value, 2), "source": "web",
+                }
+                value *= rng.uniform(0.97, 1.06)
+                date += datetime.timedelta(days=rng.randint(10, 30))
+
+    return item_rows, rows
+
+
+def _retained(function):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+# -- the same analytics on the dict of rows ------------------------------
+
+def _cents(row):
+    return int(round(row["value"] * 100))
+
+
+def _current(rows, item_category):
+    latest = {}
+    for row in rows.values():
+        if item_category.get(row["item_id"]) is None:
+            continue
+        key = (row["item_id"], row["rest_id"])
+        found = latest.get(key)
+        if found is None or (row["date"], row["price_id"]) > (found["date"], found["price_id"]):
+            latest[key] = row
+    return latest.values()
+
+
+def category_prices(rows, item_category, names):
+    values = defaultdict(list)
+    for row in _current(rows, item_category):
+        values[item_category[row["item_id"]]].append(_cents(row))
+    result = []
+    for category_id, cents in values.items():
+        cents.sort()
+        count = len(cents)
+        result.append({
+            "category_id": category_id, "name": names.get(category_id), "items": count,
+            "avg": round(sum(cents) / count / 100, 2),
+            "median": round((cents[(count - 1) // 2] + cents[count // 2]) / 2 / 100, 2),
+            "min": round(cents[0] / 100, 2), "max": round(cents[-1] / 100, 2),
+        })
+    result.sort(key=lambda entry: (-entry["items"], str(entry["name"])))
+    return result
+
+
+def price_index(rows, item_category, limit=100):
+    current = [row for row in _current(rows, item_category) if _cents(row) > 0]
+    totals = defaultdict(lambda: [0, 0])
+    for row in current:
+        total = totals[item_category[row["item_id"]]]
+        total[0] += _cents(row)
+        total[1] += 1
+    ratios = defaultdict(list)
+    for row in current:
+        total, count = totals[item_category[row["item_id"]]]
+        ratios[row["rest_id"]].append(math.log(_cents(row) / (total / count)))
+    result = sorted(
+        (math.exp(sum(logs) / len(logs)) * 100, rest_id, len(logs)) for rest_id, logs in ratios.items()
+    )
+    return [{"rest_id": rest_id, "index": round(index, 2), "items": count} for index, rest_id, count in result[:limit]]
+
+
+def inflation(rows, rest_ids=None):
+    last = {}
+    for row in rows.values():
+        if rest_ids is not None and row["rest_id"] not in rest_ids or _cents(row) <= 0:
+            continue
+        year, month = int(row["date"][:4]), int(row["date"][5:7])
+        key = (row["item_id"], row["rest_id"], (year - 1970) * 12 + month - 1)
+        found = last.get(key)
+        if found is None or (row["date"], row["price_id"]) > (found["date"], found["price_id"]):
+            last[key] = row
+    if not last:
+        return []
+    logs = defaultdict(list)
+    for (item_id, rest_id, period), row in last.items():
+        before = last.get((item_id, rest_id, period - 1))
+        if before is not None:
+            logs[period].append(math.log(_cents(row) / _cents(before)))
+    periods = [key[2] for key in last]
+    result, index = [], 100.0
+    for period in range(min(periods), max(periods) + 1):
+        change = math.exp(sum(logs[period]) / len(logs[period])) if logs[period] else 1.0
+        index *= change
+        result.append({
+            "period": datetime.date(1970 + period // 12, period % 12 + 1, 1).isoformat(),
+            "change_pct": round((change - 1) * 100, 2) if logs[period] else None,
+            "index": round(index, 2), "items": len(logs[period]),
+        })
+    return result
+
+
+def _same(left, right):
+    if isinstance(left, list):
+        return len(left) == len(right) and all(_same(a, b) for a, b in zip(left, right))
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(_same(left[key], right[key]) for key in left)
+    if isinstance(left, float) and isinstance(right, float):
+        # sums in another order may differ in the last digit
+        return math.isclose(left, right, abs_tol=0.011)
+    return left == right
+
+
+def _time(function, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return (time.perf_counter() - started) / rounds * 1e3, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=50, help="items per restaurant")
+    parser.add_argument("--prices", type=int, default=20, help="prices per item")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    setup()
+    from restorang_app import analytics, price_columns
+
+    items, rows = generate(args.restaurants, args.items, args.prices)
+    item_category = {item["item_id"]: item["category_id"] for item in items}
+    names = {category_id: "Kategorija %d" % category_id for category_id in range(1, CATEGORIES + 1)}
+
+    store, store_bytes = _retained(lambda: price_columns.PriceColumns.from_rows(rows(), items, names))
+    by_id, dict_bytes = _retained(lambda: {row["price_id"]: row for row in rows()})
+    started = time.perf_counter()
+    price_columns.PriceColumns.from_rows(by_id.values(), items, names)
+    built = time.perf_counter() - started
+    price_columns._store, price_columns._built_at = store, time.monotonic()
+    millions = len(store) / 1e6
+    print("%d prices; columns built in %.2f s" % (len(store), built))
+    print("%-8s  %12s" % ("store", "MiB per 1M"))
+    print("%-8s  %12.1f" % ("dict", dict_bytes / millions / 2 ** 20))
+    print("%-8s  %12.1f  (arrays %.1f)" % ("columns", store_bytes / millions / 2 ** 20, store.nbytes / millions / 2 ** 20))
+
+    rest_ids = list(range(1, 11))
+    cases = [
+        ("category prices", lambda: category_prices(by_id, item_category, names), analytics.category_prices),
+        ("price index", lambda: price_index(by_id, item_category), analytics.price_index),
+        ("inflation", lambda: inflation(by_id), analytics.inflation),
+        ("inflation 10 rest", lambda: inflation(by_id, set(rest_ids)), lambda: analytics.inflation(rest_ids=rest_ids)),
+    ]
+    print("%-18s  %10s  %10s  %8s" % ("query", "dict ms", "columns ms", "speedup"))
+    for name, slow, fast in cases:
+        slow_ms, expected = _time(slow, args.rounds)
+        fast_ms, result = _time(fast, args.rounds * 5)
+        assert _same(result, expected), name
+        print("%-18s  %10.1f  %10.2f  %7.0fx" % (name, slow_ms, fast_ms, slow_ms / fast_ms))
+
+
+if __name__ == "__main__":
+    main()
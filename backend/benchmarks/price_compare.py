@@ -0,0 +1,81 @@
+"""Basket ranking with `restorang_app.compare.rank` against plain Python.
+
+Prices every product of a basket at a random share of the restaurants and
+ranks them both ways: the cheapest restaurants per product and the basket
+totals per restaurant. Both must agree::
+
+    python -m benchmarks.price_compare --products 10 100 1000 --restaurants 300
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from . import setup
+
+
+def plain(quantities, entries, limit):
+    cheapest = {}
+    for number, (product, item_id, rest_id, value) in enumerate(entries):
+        key = (product, rest_id)
+        if key not in cheapest or (value, item_id) < cheapest[key][:2]:
+            cheapest[key] = (value, item_id, number)
+    offers = [[] for _ in quantities]
+    totals = {}
+    for (product, rest_id), (value, _, number) in cheapest.items():
+        offers[product].append((value, rest_id, number))
+        total = totals.setdefault(rest_id, [0, 0.0])
+        total[0] += 1
+        total[1] += value * quantities[product]
+    ranked = [[number for _, _, number in sorted(found)[:limit]] for found in offers]
+    best = sorted(totals, key=lambda rest_id: (-totals[rest_id][0], totals[rest_id][1], rest_id))[:limit]
+    return ranked, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--restaurants", type=int, default=300)
+    parser.add_argument("--coverage", type=float, default=0.3, help="share of restaurants pricing each product")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    setup()
+    from restorang_app.compare import rank
+
+    rng = random.Random(0)
+    print("%8s  %10s  %10s  %10s" % ("products", "prices", "plain ms", "numpy ms"))
+    for size in args.products:
+        entries = []
+        item_id = 0
+        for product in range(size):
+            for rest_id in range(1, args.restaurants + 1):
+                if rng.random() < args.coverage:
+                    item_id += 1
+                    entries.append((product, item_id, rest_id, round(rng.uniform(1, 30), 2)))
+        quantities = [rng.randint(1, 3) for _ in range(size)]
+
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            expected = plain(quantities, entries, args.limit)
+        plain_ms = (time.perf_counter() - started) / args.rounds * 1e3
+
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            # building the arrays is part of the cost per request
+            columns = [
+                np.fromiter((entry[field] for entry in entries), dtype=float if field == 3 else np.int64,
+                            count=len(entries))
+                for field in range(4)
+            ]
+            offers, baskets = rank(quantities, *columns, args.limit)
+        numpy_ms = (time.perf_counter() - started) / args.rounds * 1e3
+
+        assert [found.tolist() for found in offers] == expected[0]
+        assert [int(rest_id) for rest_id, _, _ in baskets] == expected[1]
+        print("%8d  %10d  %10.2f  %10.2f" % (size, len(entries), plain_ms, numpy_ms))
+
+
+if __name__ == "__main__":
+    main()
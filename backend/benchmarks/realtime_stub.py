@@ -0,0 +1,120 @@
+"""Local stand-in for the Supabase Realtime change feed, and how fresh
+the restaurant page stays with and without it.
+
+`StubChangeSource` is a `restorang_app.changefeed.Subscriber` source that
+delivers the writes made to a `PostgrestStub` (by any client) as
+``postgres_changes`` payloads, after ``lag`` seconds of replication delay.
+
+Run as a benchmark, it prices items of one restaurant through a client
+of its own - a writer the app does not know about, like another process
+or the Supabase dashboard - and after every write reads the restaurant
+page. Without the feed the page keeps the old price until its caches
+expire; with it the new price is pushed to a price stream and the page
+shows it::
+
+    python -m benchmarks.realtime_stub --updates 50 --lag 0.005
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from . import results, setup, workload
+
+
+class StubChangeSource:
+    def __init__(self, stub, lag=0.0):
+        self.stub = stub
+        self.lag = lag
+
+    async def __call__(self, tables, on_change, on_subscribed):
+        loop = asyncio.get_running_loop()
+
+        def deliver(payload):
+            if payload["data"]["table"] in tables:
+                loop.call_soon_threadsafe(loop.call_later, self.lag, on_change, payload)
+
+        self.stub.listeners.append(deliver)
+        try:
+            on_subscribed()
+            await asyncio.Event().wait()
+        finally:
+            self.stub.listeners.remove(deliver)
+
+
+def run(client, stub, writer, rest_id, item_ids, writes, feed):
+    from restorang_app import changefeed
+
+    subscriber = changefeed.start(feed) if feed else None
+    while subscriber is not None and not subscriber.connected:
+        time.sleep(0.01)
+    stream = changefeed.subscribe(["rest:%d" % rest_id])
+    delivered = []
+    stale = 0
+    date = datetime.date(2030, 1, 1)
+    try:
+        for number in range(writes):
+            item_id = item_ids[number % len(item_ids)]
+            value = 100.0 + number
+            date += datetime.timedelta(days=1)
+            started = time.perf_counter()
+            writer.table("price").insert({
+                "item_id": item_id, "rest_id": rest_id, "date": date.isoformat(),
+                "value": value, "source": "web", "user_id": None,
+            }).execute()
+            if subscriber is not None:
+                deadline = started + 5
+                while time.perf_counter() < deadline:
+                    events = stream.get(deadline - time.perf_counter())
+                    if any(json.loads(event[3])["price"]["value"] == value for event in events):
+                        delivered.append(time.perf_counter() - started)
+                        break
+                subscriber.flush()
+            page = client.get("/api/restaurant-page/", {"rest_id": rest_id, "fields": "prices"}).json()
+            latest = page["prices"].get(str(item_id), {}).get("latest_value")
+            stale += latest != value
+    finally:
+        changefeed.unsubscribe(stream)
+        changefeed.stop(5)
+    return delivered, stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    workload.add_arguments(parser)
+    parser.set_defaults(restaurants=200, items=20, prices=10, latency=0.0, jitter=0.0)
+    parser.add_argument("--updates", type=int, default=50, help="prices written by the outside writer")
+    parser.add_argument("--lag", type=float, default=0.005, help="seconds from a write to its change event")
+    args = parser.parse_args()
+    setup()
+    from django.test import Client
+    from restorang_app.test_runner import UnmanagedModelTestRunner
+
+    runner = UnmanagedModelTestRunner(verbosity=0)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        stub = workload.install(args)
+        writer = stub.client()
+        client = Client()
+        rest_id = 1
+        item_ids = [item["item_id"] for item in stub.tables["item"] if item["rest_id"] == rest_id]
+        print("%d writes to restaurant %d, %.0f ms change feed lag" % (args.updates, rest_id, args.lag * 1e3))
+        print("%-5s %12s %9s %9s %9s" % ("feed", "stale reads", "pushed", "p50 ms", "p99 ms"))
+        for name, feed in (("off", None), ("on", StubChangeSource(stub, args.lag))):
+            # the page is cached before the writes start
+            client.get("/api/restaurant-page/", {"rest_id": rest_id, "fields": "prices"})
+            delivered, stale = run(client, stub, writer, rest_id, item_ids, args.updates, feed)
+            summary = results.summarize(delivered)
+            print("%-5s %12s %9d %9s %9s" % (
+                name, "%d/%d" % (stale, args.updates), len(delivered),
+                "%.2f" % summary["p50_ms"] if delivered else "-",
+                "%.2f" % summary["p99_ms"] if delivered else "-"))
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
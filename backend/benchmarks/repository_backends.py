@@ -0,0 +1,80 @@
+"""Runs the same reads through the repository backends.
+
+The sample fixture is loaded into a SQLite test database for the ORM
+backend and into the PostgREST stand-in for the Supabase backend; the
+replica backend is synced from the stand-in first. Each read must return
+the same rows; the script prints the time per call::
+
+    python -m benchmarks.repository_backends
+"""
+import os
+import time
+
+from . import setup
+from .fixtures import tables_from_fixture
+from .postgrest_stub import PostgrestStub
+
+ROUNDS = 200
+
+
+def _normalized(rows):
+    if isinstance(rows, dict):
+        return rows
+    return sorted(rows, key=repr)
+
+
+def main():
+    setup()
+    from django.core.management import call_command
+    from restorang_app import replica
+    from restorang_app.repository import OrmRepository, SupabaseRepository
+    from restorang_app.test_runner import UnmanagedModelTestRunner
+
+    fixture = os.path.join(os.path.dirname(__file__), "..", "restorang_app", "fixtures", "restorang_sample.json")
+    runner = UnmanagedModelTestRunner(verbosity=0)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        call_command("loaddata", fixture, verbosity=0)
+        orm = OrmRepository(using="default")
+        rest = SupabaseRepository(PostgrestStub(tables_from_fixture(fixture)).client())
+        replica.sync(rest)
+        local = replica.ReplicaRepository(rest)
+
+        reads = [
+            ("restaurants", ()),
+            ("restaurant", (2,)),
+            ("find_restaurants", ("name", "pizz")),
+            ("restaurant_types", ()),
+            ("items_for_restaurant", (1,)),
+            ("categories", ()),
+            ("category_names", ([1, 2, 3],)),
+            ("prices_for_items", ([1, 2, 4],)),
+            ("price_history", (4,)),
+            ("restaurants_page", (2,)),
+            ("restaurants_page", (2, {"rest_id": 1}, "name", "pizz")),
+            ("price_history_page", (4, 2)),
+            ("price_history_page", (4, 2, {"date": "2025-06-01", "price_id": 11})),
+            ("prices_page", (5,)),
+            ("prices_page", (5, 2, 2, None, "2025-01-01", None)),
+            ("price_values", (4, 2)),
+        ]
+        print("%-22s  %10s  %10s  %10s" % ("read", "orm us", "rest us", "replica us"))
+        for name, args in reads:
+            timings = []
+            results = []
+            for repository in (orm, rest, local):
+                started = time.perf_counter()
+                for _ in range(ROUNDS):
+                    result = getattr(repository, name)(*args)
+                timings.append((time.perf_counter() - started) / ROUNDS * 1e6)
+                results.append(_normalized(result))
+            assert results[0] == results[1] == results[2], "%s differs between backends" % name
+            print("%-22s  %10.1f  %10.1f  %10.1f" % (name, *timings))
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark results saved as JSON, and the comparison of two runs.
+
+`view_latency` and `load` write their results with ``--output``; compare
+a run against an earlier one (e.g. the one from the last deploy) with::
+
+    python -m benchmarks.results before.json after.json --threshold 0.15
+
+An endpoint regresses when a latency percentile grows, or its throughput
+drops, by more than the threshold. The exit status is 1 when anything
+regressed, so the comparison can gate a deploy.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_METRICS = ("rps",)
+
+
+def summarize(samples, elapsed=None):
+    """Latency percentiles (ms) of `samples` (seconds); throughput when `elapsed` is given."""
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = samples[0]
+    summary = {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+    if elapsed:
+        summary["rps"] = round(len(samples) / elapsed, 1)
+    return summary
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(path, benchmark, arguments, results):
+    document = {
+        "benchmark": benchmark,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": arguments,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(before, after, threshold):
+    """``(name, metric, before, after, change, regressed)`` for every shared measurement."""
+    rows = []
+    for name, new in after["results"].items():
+        old = before["results"].get(name)
+        if not old:
+            continue
+        for metric in LATENCY_METRICS + THROUGHPUT_METRICS:
+            if not old.get(metric) or new.get(metric) is None:
+                continue
+            change = new[metric] / old[metric] - 1
+            if metric in THROUGHPUT_METRICS:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            rows.append((name, metric, old[metric], new[metric], change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative change")
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before["benchmark"] != after["benchmark"]:
+        parser.error("%s is a %s run, %s a %s run" % (
+            args.before, before["benchmark"], args.after, after["benchmark"]))
+    if before["arguments"] != after["arguments"]:
+        print("warning: the runs were made with different arguments", file=sys.stderr)
+
+    rows = compare(before, after, args.threshold)
+    print("%-32s  %-8s  %10s  %10s  %8s" % ("endpoint", "metric", before["commit"] or "before", after["commit"] or "after", "change"))
+    for name, metric, old, new, change, regressed in rows:
+        print("%-32s  %-8s  %10.2f  %10.2f  %+7.1f%%%s" % (
+            name, metric, old, new, change * 100, "  REGRESSION" if regressed else ""))
+    regressions = sum(1 for row in rows if row[-1])
+    print("%d regression(s) beyond %.0f%%" % (regressions, args.threshold * 100))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
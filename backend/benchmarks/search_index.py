@@ -0,0 +1,83 @@
+"""Name search through the in-memory index against ``ilike`` upstream.
+
+Builds synthetic restaurants and items with Croatian names, serves them
+from the PostgREST stand-in (with a per-call latency standing in for the
+network) and times the same searches through
+``find_restaurants('name', term)`` / ``search_items_with_prices(term)``
+and through `restorang_app.search`. Every row ``ilike`` finds must also be
+found by the index::
+
+    python -m benchmarks.search_index --restaurants 2000 --items 20
+"""
+import argparse
+import random
+import time
+
+from . import setup
+from .fixtures import synthetic_tables
+from .postgrest_stub import PostgrestStub
+
+FIRST = ["Kod", "Bistro", "Konoba", "Pizzeria", "Gostionica", "Slastičarnica", "Kavana", "Pečenjarnica"]
+SECOND = ["Đure", "Žabe", "Čarde", "Šime", "Mate", "Ivane", "Luke", "Dalmacije", "Zagorja", "Maksimira"]
+DISHES = [
+    "Ćevapi", "Pljeskavica", "Štrukli", "Pašticada", "Punjene paprike", "Sarma", "Crni rižot",
+    "Pizza Margherita", "Pizza Capricciosa", "Palačinke", "Kremšnita", "Fritule", "Grah s kobasicom",
+    "Zagorska juha", "Čobanac", "Janjetina", "Teletina ispod peke", "Bijela kava", "Espresso",
+]
+TERMS = ["pizz", "cevap", "ćevapi", "štruk", "konoba", "đure", "kava", "juha", "žab", "rižot", "palacinke"]
+
+
+def _named(tables, seed=0):
+    rng = random.Random(seed)
+    for row in tables["restaurant"]:
+        row["name"] = "%s %s %d" % (rng.choice(FIRST), rng.choice(SECOND), row["rest_id"])
+    for row in tables["item"]:
+        row["name"] = rng.choice(DISHES)
+    return tables
+
+
+def _time(function, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return (time.perf_counter() - started) / rounds * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--restaurants", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=20, help="items per restaurant")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per upstream call")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    setup()
+    from restorang_app import search
+    from restorang_app.repository import SupabaseRepository
+
+    stub = PostgrestStub(_named(synthetic_tables(args.restaurants, args.items, 2)))
+    repository = SupabaseRepository(stub.client())
+
+    started = time.perf_counter()
+    index = search.build(repository)
+    print("index of %d restaurants, %d items, %d types built in %.2f s" % (
+        len(index.restaurants), len(index.items), len(index.types), time.perf_counter() - started))
+    stub.latency = args.latency
+
+    print("%-12s  %12s  %10s  %12s  %10s  %10s  %8s" % (
+        "term", "ilike rest", "index us", "ilike items", "index us", "top-10 us", "matches"))
+    for term in TERMS:
+        ilike_rest, upstream = _time(lambda: repository.find_restaurants("name", term), args.rounds)
+        index_rest, local = _time(lambda: index.restaurants.search(term), args.rounds * 200)
+        assert {row["rest_id"] for row in upstream} <= {row["rest_id"] for row in local}, term
+
+        ilike_items, upstream = _time(lambda: repository.client.table("item").select("item_id").ilike("name", "%" + term + "%").execute().data, args.rounds)
+        index_items, local = _time(lambda: index.items.search(term), args.rounds * 200)
+        assert {row["item_id"] for row in upstream} <= {row["item_id"] for row in local}, term
+        top_items, _ = _time(lambda: index.items.search(term, 10), args.rounds * 200)
+
+        print("%-12s  %10.0f us  %10.1f  %10.0f us  %10.1f  %10.1f  %8d" % (
+            term, ilike_rest, index_rest, ilike_items, index_items, top_items, len(local)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Upstream calls and latency when many callers run the same query at once.
+
+Starts the PostgREST stand-in as a local HTTP server with a fixed latency
+per call, then releases ``--callers`` threads (and, separately, as many
+asyncio tasks) at the same moment, each running the query behind the
+landing page, ``table('restaurant').select('*')``. Every round is run
+with request coalescing off and on (``SUPABASE_HTTP['COALESCE']``)::
+
+    python -m benchmarks.thundering_herd --callers 64 --latency 0.1
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from restorang.supabase_client import DEFAULTS, abuild_client, build_client
+
+from .fixtures import synthetic_tables
+from .postgrest_stub import STUB_KEY, PostgrestStub, serve
+
+
+def _query(client):
+    return client.table('restaurant').select('*')
+
+
+def run_threads(url, options, callers, rounds):
+    client = build_client(url, STUB_KEY, options)
+    # one call up front, so connection setup is not part of the herd
+    _query(client).execute()
+    timings = []
+    sizes = set()
+    for _ in range(rounds):
+        barrier = threading.Barrier(callers)
+
+        def caller():
+            barrier.wait()
+            started = time.perf_counter()
+            sizes.add(len(_query(client).execute().data))
+            timings.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return timings, sizes
+
+
+def run_tasks(url, options, callers, rounds):
+    async def main():
+        client = await abuild_client(url, STUB_KEY, options)
+        await _query(client).execute()
+        timings = []
+        sizes = set()
+
+        async def caller():
+            started = time.perf_counter()
+            sizes.add(len((await _query(client).execute()).data))
+            timings.append(time.perf_counter() - started)
+
+        for _ in range(rounds):
+            await asyncio.gather(*(caller() for _ in range(callers)))
+        return timings, sizes
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=64, help="concurrent callers per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per upstream call")
+    parser.add_argument("--restaurants", type=int, default=500)
+    args = parser.parse_args()
+
+    stub = PostgrestStub(synthetic_tables(args.restaurants, 1, 1), latency=args.latency)
+    server = serve(stub)
+    url = "http://127.0.0.1:%d" % server.server_port
+    # enough connections that, without coalescing, no caller waits for one
+    options = {**DEFAULTS, 'MAX_CONNECTIONS': args.callers, 'MAX_KEEPALIVE_CONNECTIONS': args.callers, 'HTTP2': False}
+
+    print("%d callers x %d rounds, %.0f ms per upstream call" % (args.callers, args.rounds, args.latency * 1e3))
+    print("%-8s %-9s %14s %8s %8s %8s" % ("mode", "coalesce", "upstream calls", "p50 ms", "p99 ms", "rows"))
+    for mode, run in (("threads", run_threads), ("asyncio", run_tasks)):
+        for coalesce in (False, True):
+            stub.reset_counters()
+            timings, sizes = run(url, {**options, 'COALESCE': coalesce}, args.callers, args.rounds)
+            calls = stub.requests - 1
+            timings.sort()
+            print("%-8s %-9s %14d %8.1f %8.1f %8s" % (
+                mode, "on" if coalesce else "off", calls,
+                statistics.median(timings) * 1e3, timings[int(len(timings) * 0.99) - 1] * 1e3,
+                ",".join(map(str, sorted(sizes))),
+            ))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Latency of every view in ``views.py`` against the PostgREST stand-in.
+
+Each endpoint is called ``--rounds`` times with the read-through and
+response caches cleared before every call (``cold``: every read reaches
+the stub) and ``--rounds`` times with them kept (``warm``). Prints the
+latency percentiles, upstream calls and response size per endpoint;
+``--output`` saves them for `benchmarks.results`::
+
+    python -m benchmarks.view_latency --output before.json
+    python -m benchmarks.view_latency --restaurants 200 --only fetch-items-prices restbyud
+"""
+import argparse
+import random
+import time
+
+from . import results, setup, workload
+
+
+def measure(client, stub, request, rng, rounds, clear):
+    from restorang_app import cache
+
+    samples = []
+    calls = 0
+    size = 0
+    errors = 0
+    for _ in range(rounds):
+        if clear:
+            cache.backend.clear()
+        stub.reset_counters()
+        started = time.perf_counter()
+        ok, size = workload.send(client, request(rng))
+        samples.append(time.perf_counter() - started)
+        calls += stub.requests
+        errors += not ok
+    summary = results.summarize(samples)
+    summary.update(upstream_calls=round(calls / rounds, 2), bytes=size, errors=errors)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    workload.add_arguments(parser)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+    setup()
+    from django.test import Client
+    from restorang_app.test_runner import UnmanagedModelTestRunner
+
+    runner = UnmanagedModelTestRunner(verbosity=0)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        started = time.perf_counter()
+        stub = workload.install(args)
+        print("%d restaurants, %d items, %d prices in %.1f s" % (
+            len(stub.tables["restaurant"]), len(stub.tables["item"]), len(stub.tables["price"]),
+            time.perf_counter() - started))
+        client = Client()
+        requests = workload.requests(args)
+        rng = random.Random(args.seed)
+        for request in requests.values():
+            # builds the search index and the stub's indexes outside the timings
+            workload.send(client, request(rng))
+        stub.latency, stub.jitter = args.latency, args.jitter
+
+        measured = {}
+        print("%-26s %-5s %9s %9s %9s %9s %7s %9s" % (
+            "endpoint", "cache", "p50 ms", "p95 ms", "p99 ms", "max ms", "calls", "bytes"))
+        for name, request in requests.items():
+            for mode in ("cold", "warm"):
+                summary = measure(client, stub, request, rng, args.rounds, clear=mode == "cold")
+                measured["%s:%s" % (name, mode)] = summary
+                print("%-26s %-5s %9.2f %9.2f %9.2f %9.2f %7.2f %9d%s" % (
+                    name, mode, summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["max_ms"],
+                    summary["upstream_calls"], summary["bytes"],
+                    "  (%d errors)" % summary["errors"] if summary["errors"] else ""))
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+    if args.output:
+        results.save(args.output, "view_latency", vars(args), measured)
+        print("saved to %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
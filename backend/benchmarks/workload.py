@@ -0,0 +1,146 @@
+"""The dataset and the requests shared by `view_latency` and `load`.
+
+The dataset is `synthetic_tables` at a size picked on the command line;
+the defaults (2000 restaurants x 50 items x 20 prices) give two million
+price rows. Every view in ``restorang_app/views.py`` has an entry in
+`requests`, with ids drawn at random from the dataset.
+"""
+import json
+
+from .fixtures import QUARTERS, TYPES, synthetic_tables
+from .postgrest_stub import PostgrestStub
+
+INGEST_TOKEN = "benchmark-token"
+INGEST_ROWS = 50
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("dataset")
+    group.add_argument("--restaurants", type=int, default=2000)
+    group.add_argument("--items", type=int, default=50, help="items per restaurant")
+    group.add_argument("--prices", type=int, default=20, help="prices per item")
+    group.add_argument("--latency", type=float, default=0.005, help="seconds per upstream call")
+    group.add_argument("--jitter", type=float, default=0.005, help="up to this many seconds more per call")
+    group.add_argument("--seed", type=int, default=0)
+    group.add_argument("--writes", action="store_true", help="include the endpoints that write prices")
+    group.add_argument("--only", nargs="+", metavar="ENDPOINT", help="run these endpoints only")
+
+
+def install(args):
+    """Serve the app's reads from a stub seeded as `args` ask; returns the stub.
+
+    Needs a database for the price statistics: run it between
+    ``setup_databases`` and ``teardown_databases`` of the test runner.
+    """
+    from django.conf import settings
+    from restorang_app import repository
+
+    tables = synthetic_tables(args.restaurants, args.items, args.prices, seed=args.seed)
+    stub = PostgrestStub(tables)
+    repository._repository = repository.SupabaseRepository(stub.client())
+    settings.RESTORANG_INGEST = {**settings.RESTORANG_INGEST, "TOKEN": INGEST_TOKEN}
+    return stub
+
+
+def _ingest_body(rng, args):
+    rest_id = rng.randint(1, args.restaurants)
+    first_item = (rest_id - 1) * args.items + 1
+    lines = []
+    for _ in range(INGEST_ROWS):
+        lines.append(
+            '{"date": "2026-%02d-%02d", "value": %.2f, "source": "benchmark", "item_id": %d, "rest_id": %d}' % (
+                rng.randint(1, 12), rng.randint(1, 28), rng.uniform(1.5, 25.0),
+                rng.randint(first_item, first_item + args.items - 1), rest_id,
+            )
+        )
+    return "\n".join(lines)
+
+
+def requests(args):
+    """``{endpoint: request(rng)}``; a request is ``(method, path, kwargs)`` for the Django test client."""
+    def rest_id(rng):
+        return rng.randint(1, args.restaurants)
+
+    def item_id(rng):
+        return rng.randint(1, args.restaurants * args.items)
+
+    def rest_of(item):
+        return (item - 1) // args.items + 1
+
+    def get(path, params=None):
+        return lambda rng: ("GET", path, {"data": params(rng) if params else None})
+
+    endpoints = {
+        "home": get("/api/"),
+        "home_search_items": lambda rng: (
+            "POST", "/api/", {"data": {"select-type": "option1", "select-arg": "Artikl %d" % item_id(rng)}}),
+        "home_search_restaurants": lambda rng: (
+            "POST", "/api/", {"data": {"select-type": "option2", "select-arg": "Restoran %d" % rest_id(rng)}}),
+        "restaurants": get("/api/restaurants/"),
+        "restidbyname": get("/api/restidbyname/", lambda rng: {"select-name": "Restoran %d" % rest_id(rng)}),
+        "restbyud": get("/api/restbyud/", lambda rng: {"rest_id": rest_id(rng)}),
+        "restbytype": get("/api/restbytype/", lambda rng: {"type": rng.choice(TYPES)}),
+        "resttypes": get("/api/resttypes/"),
+        "restbyquater": get("/api/restbyquater/", lambda rng: {"quarter": rng.choice(QUARTERS)}),
+        "restaurant-facets": get("/api/restaurant-facets/", lambda rng: {
+            "type": rng.choice(TYPES), "quarter": rng.choice(QUARTERS), "q": "Restoran %d" % rng.randint(1, 9)}),
+        "fetch-items-prices": get("/api/fetch-items-prices/", lambda rng: {"rest_id": rest_id(rng)}),
+        "item-price-history": get("/api/item-price-history/", lambda rng: {"item_id": item_id(rng)}),
+        "item-price-history-monthly": get(
+            "/api/item-price-history/", lambda rng: {"item_id": item_id(rng), "resolution": "month"}),
+        "autocomplete": get("/api/autocomplete/", lambda rng: {"q": "Artikl %d" % item_id(rng)}),
+        "nearby": get("/api/nearby/", lambda rng: {
+            "lat": round(rng.uniform(45.75, 45.87), 5), "lng": round(rng.uniform(15.85, 16.10), 5), "k": 10}),
+        "compare": get("/api/compare/", lambda rng: {"item": ["Artikl %d" % item_id(rng) for _ in range(5)]}),
+        "restaurant-page": get("/api/restaurant-page/", lambda rng: {"rest_id": rest_id(rng)}),
+        "price-stats": get(
+            "/api/price-stats/", lambda rng: (lambda item: {"item_id": item, "rest_id": rest_of(item)})(item_id(rng))),
+        "export-prices": get("/api/export/prices/", lambda rng: {"rest_id": rest_id(rng)}),
+        "cache-stats": get("/api/cache-stats/"),
+        "pool-stats": get("/api/pool-stats/"),
+        "report-stats": get("/api/report-stats/"),
+        "metrics": get("/metrics"),
+        "items-by-restaurant": get("/api/items-by-restaurant/"),
+        "price-history": get("/api/price-history/"),
+    }
+    if args.writes:
+        endpoints["ingest-prices"] = lambda rng: ("POST", "/api/ingest/prices/", {
+            "data": _ingest_body(rng, args),
+            "content_type": "application/x-ndjson",
+            "headers": {"Authorization": "Bearer %s" % INGEST_TOKEN},
+        })
+        endpoints["submit-report"] = lambda rng: (lambda item: ("POST", "/api/reports/", {
+            "data": {"item_id": item, "rest_id": rest_of(item), "price": round(rng.uniform(1.5, 25.0), 2), "user_id": 1},
+            "content_type": "application/json",
+        }))(item_id(rng))
+    if args.only:
+        unknown = set(args.only) - set(endpoints)
+        if unknown:
+            raise SystemExit("unknown endpoint(s): %s" % ", ".join(sorted(unknown)))
+        endpoints = {name: endpoints[name] for name in args.only}
+    return endpoints
+
+
+def _rows_failed(response, content):
+    # the write endpoints answer 200 with a report of the rows they wrote
+    if not response.headers.get("Content-Type", "").startswith("application/json"):
+        return False
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and bool(payload.get("failed"))
+
+
+def send(client, request):
+    """Make `request` with a Django test client (or `load.HttpClient`);
+    returns ``(ok, size)``. A request is not ok when its status is an
+    error or when it reports rows that failed to be written."""
+    method, path, kwargs = request
+    kwargs = {name: value for name, value in kwargs.items() if value is not None}
+    response = getattr(client, method.lower())(path, **kwargs)
+    if getattr(response, "streaming", False):
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        return response.status_code < 400, size
+    content = response.content
+    return response.status_code < 400 and not _rows_failed(response, content), len(content)
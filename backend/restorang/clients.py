@@ -0,0 +1,86 @@
+"""Data clients of the app, created on first use.
+
+The settings module used to import the Supabase library and build the
+client at import time, so every ``manage.py`` command, test run and
+worker boot paid for it (about a second) and failed without
+``SUPABASE_URL``. `get` builds a client the first time it is asked for
+and keeps it for the rest of the process.
+
+A forked child drops the clients it inherited and builds its own on
+first use, so preforked workers (``gunicorn --preload``) never share a
+client with the master. Tests inject a fake with `override`::
+
+    with clients.override("supabase", FakeClient()):
+        ...
+"""
+import contextlib
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+_factories = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def register(name, factory):
+    """Build client `name` with ``factory()`` when it is first used."""
+    with _lock:
+        _factories[name] = factory
+        _clients.pop(name, None)
+
+
+def get(name="supabase"):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _factories[name]()
+    return client
+
+
+@contextlib.contextmanager
+def override(name, client):
+    """Use `client` as client `name` inside the block."""
+    with _lock:
+        previous = _clients.get(name)
+        _clients[name] = client
+    try:
+        yield client
+    finally:
+        with _lock:
+            if previous is None:
+                _clients.pop(name, None)
+            else:
+                _clients[name] = previous
+
+
+def reset(*names):
+    """Drop the built clients (all of them without `names`); the next `get` rebuilds."""
+    with _lock:
+        for name in names or list(_clients):
+            _clients.pop(name, None)
+
+
+def _after_fork():
+    global _lock
+    # another thread may have held the lock when the process forked
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+def _supabase():
+    from django.conf import settings
+    from restorang.supabase_client import build_client
+
+    if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
+        raise ImproperlyConfigured("SUPABASE_URL and SUPABASE_KEY must be set to use the Supabase client")
+    return build_client(settings.SUPABASE_URL, settings.SUPABASE_KEY, settings.SUPABASE_HTTP)
+
+
+register("supabase", _supabase)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,10 +1,7 @@
 from pathlib import Path
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import environ
 import os
-import dj_database_url
-import psycopg2
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -17,10 +14,34 @@ environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
 # dbHost = os.environ.get("DATABASE_HOST")
 # dbUser = os.environ.get("DATABASE_USER")
 
-supabase: Client = create_client(
-    os.environ.get("SUPABASE_URL"),
-    os.environ.get("SUPABASE_KEY")
-)
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+# Connection pool, timeouts and retries of the Supabase HTTP client
+# (restorang/supabase_client.py); COALESCE shares one upstream call among
+# identical reads in flight at the same time.
+SUPABASE_HTTP = {
+    'MAX_CONNECTIONS': int(os.environ.get('SUPABASE_MAX_CONNECTIONS', 20)),
+    'MAX_KEEPALIVE_CONNECTIONS': int(os.environ.get('SUPABASE_MAX_KEEPALIVE_CONNECTIONS', 10)),
+    'KEEPALIVE_EXPIRY': 30.0,
+    'HTTP2': os.environ.get('SUPABASE_HTTP2', '1') == '1',
+    'CONNECT_TIMEOUT': 5.0,
+    'READ_TIMEOUT': float(os.environ.get('SUPABASE_READ_TIMEOUT', 30.0)),
+    'WRITE_TIMEOUT': 30.0,
+    'POOL_TIMEOUT': 5.0,
+    'RETRIES': int(os.environ.get('SUPABASE_RETRIES', 3)),
+    'RETRY_BACKOFF': 0.2,
+    'COALESCE': os.environ.get('SUPABASE_COALESCE', '1') == '1',
+}
+
+
+def __getattr__(name):
+    # settings.supabase is built on first use (restorang/clients.py), so
+    # importing the settings does not import the Supabase library
+    if name == 'supabase':
+        from restorang import clients
+        return clients.get('supabase')
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 # Quick-start development settings - unsuitable for production
@@ -49,6 +70,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'restorang_app.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,6 +114,30 @@ DATABASES = {
     }
 }
 
+# Direct connection to the Supabase Postgres database for the ORM data
+# backend. Use the connection pooler URL (port 6543); connections are kept
+# open between requests and checked before reuse.
+if os.environ.get("DATABASE_URL"):
+    import dj_database_url
+
+    DATABASES['supabase'] = dj_database_url.parse(
+        os.environ["DATABASE_URL"],
+        conn_max_age=600,
+        conn_health_checks=True,
+        ssl_require=True,
+    )
+    # the transaction-mode pooler cannot keep server-side cursors open
+    DATABASES['supabase']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Local copy of the restaurant, item, category and price tables
+# (restorang_app/replica.py); migrations never touch it.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.environ.get('RESTORANG_REPLICA_PATH', BASE_DIR / 'replica.sqlite3'),
+    'OPTIONS': {'timeout': 20},
+}
+DATABASE_ROUTERS = ['restorang_app.replica.ReplicaRouter']
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.postgresql',
@@ -142,3 +188,201 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Read-through cache for restaurant, category and item lookups
+# (restorang_app/cache.py). BACKEND is "local" for a per-process
+# cachetools TTL/LRU cache or "django" to use CACHES[ALIAS].
+
+RESTORANG_CACHE = {
+    'BACKEND': os.environ.get('RESTORANG_CACHE_BACKEND', 'local'),
+    'ALIAS': 'default',
+    'TTL': int(os.environ.get('RESTORANG_CACHE_TTL', 300)),
+    'MAXSIZE': 1024,
+}
+
+
+# Cached restaurant list fragment of home.html. It is re-rendered when the
+# restaurant table is written or the geo index is rebuilt, or after
+# TIMEOUT seconds.
+RESTORANG_TEMPLATE_CACHE = {
+    'TIMEOUT': int(os.environ.get('RESTORANG_TEMPLATE_CACHE_TIMEOUT', 300)),
+}
+
+
+# Server-side cache of whole JSON responses (restorang_app/http_cache.py),
+# stored in the RESTORANG_CACHE backend. ETag/304 and Cache-Control are
+# sent either way.
+RESTORANG_HTTP_CACHE = {
+    'RESPONSES': os.environ.get('RESTORANG_RESPONSE_CACHE', '1') == '1',
+}
+
+
+# In-memory search index (restorang_app/search.py), rebuilt from the
+# upstream tables every REFRESH seconds.
+RESTORANG_SEARCH = {
+    'REFRESH': int(os.environ.get('RESTORANG_SEARCH_REFRESH', 300)),
+}
+
+
+# Facet index (restorang_app/facets.py) behind /api/restaurant-facets/,
+# rebuilt every REFRESH seconds.
+RESTORANG_FACETS = {
+    'REFRESH': int(os.environ.get('RESTORANG_FACETS_REFRESH', 300)),
+}
+
+
+# Price columns (restorang_app/price_columns.py) behind /api/analytics/:
+# every price held as NumPy arrays, rebuilt every REFRESH seconds.
+RESTORANG_ANALYTICS = {
+    'REFRESH': int(os.environ.get('RESTORANG_ANALYTICS_REFRESH', 900)),
+}
+
+
+# Restaurant coordinates (restorang_app/geo.py): geocoded by
+# manage.py geocode_restaurants through GEOCODER_URL, indexed in a grid of
+# CELL_DEGREES cells that is rebuilt every REFRESH seconds. /api/nearby/
+# returns at most MAX_K nearest or MAX_RESULTS within a radius of at most
+# MAX_RADIUS metres.
+RESTORANG_GEO = {
+    'API_KEY': os.environ.get('GOOGLE_MAPS_API_KEY'),
+    'GEOCODER_URL': 'https://maps.googleapis.com/maps/api/geocode/json',
+    'REGION': 'hr',
+    'CELL_DEGREES': 0.01,
+    'REFRESH': int(os.environ.get('RESTORANG_GEO_REFRESH', 300)),
+    'MAX_K': 100,
+    'MAX_RESULTS': 500,
+    'MAX_RADIUS': 50000,
+}
+
+
+# Price comparison (restorang_app/compare.py): products per request, and
+# the default and largest number of restaurants returned.
+RESTORANG_COMPARE = {
+    'MAX_ITEMS': 200,
+    'LIMIT': 10,
+    'MAX_LIMIT': 100,
+}
+
+# Restaurant page endpoint (restorang_app/restaurant_page.py): sparkline
+# bucket size and the default and largest number of points per item.
+RESTORANG_RESTAURANT_PAGE = {
+    'RESOLUTION': 'month',
+    'POINTS': 12,
+    'MAX_POINTS': 120,
+}
+
+
+# Bulk price ingestion (restorang_app/ingest.py): rows per upsert request,
+# and the bearer token /api/ingest/prices/ requires (disabled when unset).
+RESTORANG_INGEST = {
+    'BATCH_SIZE': int(os.environ.get('RESTORANG_INGEST_BATCH_SIZE', 500)),
+    'TOKEN': os.environ.get('RESTORANG_INGEST_TOKEN'),
+}
+
+# Price report submissions (restorang_app/reports.py): reports are queued in
+# the local database and written upstream in batches of BATCH_SIZE by
+# WORKERS threads per process (0: run manage.py run_report_workers
+# instead). Submissions are refused once MAX_DEPTH reports wait. A failed
+# write is retried after RETRY_DELAY seconds, doubled per attempt, up to
+# MAX_ATTEMPTS times. Approved reports become prices every
+# PROMOTE_INTERVAL seconds (0 turns this off); AUTO_APPROVE approves the
+# submitted reports right away.
+RESTORANG_REPORTS = {
+    'WORKERS': int(os.environ.get('RESTORANG_REPORT_WORKERS', 2)),
+    'BATCH_SIZE': int(os.environ.get('RESTORANG_REPORT_BATCH_SIZE', 100)),
+    'MAX_DEPTH': int(os.environ.get('RESTORANG_REPORT_MAX_DEPTH', 10000)),
+    'MAX_ATTEMPTS': 8,
+    'RETRY_DELAY': 2.0,
+    'CLAIM_TIMEOUT': 60,
+    'POLL_INTERVAL': 1.0,
+    'PROMOTE_INTERVAL': int(os.environ.get('RESTORANG_REPORT_PROMOTE_INTERVAL', 60)),
+    'AUTO_APPROVE': os.environ.get('RESTORANG_REPORT_AUTO_APPROVE', '') == '1',
+}
+
+
+# Change feed (restorang_app/changefeed.py): when ENABLED, every process
+# serving requests follows the upstream changes of TABLES through Supabase
+# Realtime and applies them to its caches and indexes, reconnecting after
+# RECONNECT_DELAY seconds, doubled up to MAX_RECONNECT_DELAY. Changes to
+# rows the process wrote itself in the last ECHO_WINDOW seconds are
+# skipped. /api/price-updates/ streams price changes of up to MAX_TOPICS
+# restaurants and items, with a heartbeat every HEARTBEAT seconds, for at
+# most MAX_STREAM_SECONDS per connection; a stream more than QUEUE_SIZE
+# events behind is reset, the last BACKLOG events are kept for browsers
+# that reconnect.
+RESTORANG_REALTIME = {
+    'ENABLED': os.environ.get('RESTORANG_REALTIME', '') == '1',
+    'TABLES': ('price', 'restaurant', 'item', 'category'),
+    'RECONNECT_DELAY': 1.0,
+    'MAX_RECONNECT_DELAY': 60.0,
+    'ECHO_WINDOW': 10.0,
+    'HEARTBEAT': 15,
+    'MAX_STREAM_SECONDS': int(os.environ.get('RESTORANG_REALTIME_MAX_STREAM_SECONDS', 300)),
+    'MAX_TOPICS': 200,
+    'QUEUE_SIZE': 1000,
+    'BACKLOG': 1000,
+}
+
+
+# Read replica (restorang_app/replica.py) behind RESTORANG_DATA_BACKEND
+# "replica": synced every SYNC_INTERVAL seconds by manage.py sync_replica
+# --loop, or with SYNC_IN_PROCESS by a thread of every process serving
+# requests (for a single process), and read while at most MAX_STALENESS
+# seconds behind. Restaurants, items and categories are compared whole on
+# every sync; prices dated up to PRICE_OVERLAP_DAYS before the newest one
+# are re-read on every sync and the whole price table is compared every
+# FULL_REFRESH seconds. Without the change feed on the price table, the
+# replica counts as behind since that last whole comparison.
+RESTORANG_REPLICA = {
+    'SYNC_INTERVAL': int(os.environ.get('RESTORANG_REPLICA_SYNC_INTERVAL', 30)),
+    'SYNC_IN_PROCESS': os.environ.get('RESTORANG_REPLICA_SYNC_IN_PROCESS', '') == '1',
+    'MAX_STALENESS': int(os.environ.get('RESTORANG_REPLICA_MAX_STALENESS', 300)),
+    'PRICE_OVERLAP_DAYS': 7,
+    'FULL_REFRESH': 3600,
+}
+
+
+# Where the views read their data (restorang_app/repository.py):
+# "supabase" for the PostgREST API, "orm" for the models over
+# DATABASES[RESTORANG_ORM_DATABASE], "replica" for the local copy of
+# RESTORANG_REPLICA.
+
+RESTORANG_DATA_BACKEND = os.environ.get('RESTORANG_DATA_BACKEND', 'supabase')
+
+# Turn this on when running under ASGI: the async views then read through
+# the async Supabase client (restorang_app/repository.py) and price streams
+# wait on the event loop. Under WSGI they read through the sync repository.
+RESTORANG_ASYNC_VIEWS = os.environ.get('RESTORANG_ASYNC_VIEWS', '') == '1'
+RESTORANG_ORM_DATABASE = 'supabase' if 'supabase' in DATABASES else 'default'
+
+# Page size of the list endpoints (restorang_app/pagination.py); clients
+# may ask for up to RESTORANG_MAX_PAGE_SIZE rows with ?limit=.
+RESTORANG_PAGE_SIZE = int(os.environ.get('RESTORANG_PAGE_SIZE', 100))
+RESTORANG_MAX_PAGE_SIZE = 1000
+
+# Request instrumentation (restorang_app/instrumentation.py): a request
+# making more than UPSTREAM_CALL_WARNING upstream calls is logged as a
+# warning (0 turns this off). Metrics are served at /metrics.
+RESTORANG_METRICS = {
+    'UPSTREAM_CALL_WARNING': int(os.environ.get('RESTORANG_UPSTREAM_CALL_WARNING', 10)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'restorang_app.instrumentation.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'restorang': {'handlers': ['console'], 'level': os.environ.get('RESTORANG_LOG_LEVEL', 'INFO')},
+        'restorang_app': {'handlers': ['console'], 'level': os.environ.get('RESTORANG_LOG_LEVEL', 'INFO')},
+    },
+}
+
+# The upstream tables are unmanaged; the test runner creates them in the
+# SQLite test database so the ORM backend can be tested with fixtures.
+TEST_RUNNER = 'restorang_app.test_runner.UnmanagedModelTestRunner'
@@ -0,0 +1,441 @@
+"""Factory for the Supabase clients used by the app.
+
+The clients share a tuned ``httpx`` transport instead of the library
+defaults: bounded connection pool with keep-alive, optional HTTP/2,
+separate connect/read/write/pool timeouts and bounded retries with
+exponential backoff (``tenacity``). Options come from
+``settings.SUPABASE_HTTP``.
+
+The clients are created on first use through `restorang.clients`.
+
+Identical reads in flight at the same time share one upstream call
+(``COALESCE``): the first caller makes it, the others wait for its
+response and get their own copy of it. Reads are keyed by method, URL
+(table, columns, filters, ordering, paging) and headers, so only calls
+that would return the same rows are shared; writes are never shared.
+
+The transport owns the connection pool and rebuilds it when it notices it
+is running in a new process, so a client created in the gunicorn master
+never shares sockets with the forked workers.
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import weakref
+
+import httpx
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+DEFAULTS = {
+    'MAX_CONNECTIONS': 20,
+    'MAX_KEEPALIVE_CONNECTIONS': 10,
+    'KEEPALIVE_EXPIRY': 30.0,
+    'HTTP2': True,
+    'CONNECT_TIMEOUT': 5.0,
+    'READ_TIMEOUT': 30.0,
+    'WRITE_TIMEOUT': 30.0,
+    'POOL_TIMEOUT': 5.0,
+    'RETRIES': 3,
+    'RETRY_BACKOFF': 0.2,
+    'COALESCE': True,
+}
+
+RETRY_STATUS = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+COALESCED_METHODS = {'GET', 'HEAD'}
+REPLAYED_EXTENSIONS = ('http_version', 'reason_phrase')
+
+_call_timeout = contextvars.ContextVar('supabase_call_timeout', default=None)
+
+
+@contextlib.contextmanager
+def call_timeout(seconds):
+    """Override the timeout of every upstream call made inside the block."""
+    token = _call_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _call_timeout.reset(token)
+
+
+def _options(options):
+    return {**DEFAULTS, **(options or {})}
+
+
+def _timeout(options):
+    return httpx.Timeout(
+        connect=options['CONNECT_TIMEOUT'],
+        read=options['READ_TIMEOUT'],
+        write=options['WRITE_TIMEOUT'],
+        pool=options['POOL_TIMEOUT'],
+    )
+
+
+def _limits(options):
+    return httpx.Limits(
+        max_connections=options['MAX_CONNECTIONS'],
+        max_keepalive_connections=options['MAX_KEEPALIVE_CONNECTIONS'],
+        keepalive_expiry=options['KEEPALIVE_EXPIRY'],
+    )
+
+
+def _should_retry(request):
+    def check(response):
+        return request.method in IDEMPOTENT_METHODS and response.status_code in RETRY_STATUS
+    return check
+
+
+def _retryable_errors(request):
+    # a request that may have reached the server is only repeated if it is
+    # idempotent; connection failures happen before anything was sent
+    if request.method in IDEMPOTENT_METHODS:
+        return retry_if_exception_type(httpx.TransportError)
+    return retry_if_exception_type((httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def _apply_call_timeout(request):
+    seconds = _call_timeout.get()
+    if seconds is not None:
+        request.extensions = {**request.extensions, 'timeout': httpx.Timeout(seconds).as_dict()}
+
+
+_observers = []
+
+
+def observe(callback):
+    """Call ``callback(request, response, seconds)`` after every upstream call.
+
+    `response` is None when the call failed; its body has been read, so
+    ``response.num_bytes_downloaded`` is the size on the wire.
+    """
+    _observers.append(callback)
+
+
+def _notify(request, response, seconds):
+    for callback in _observers:
+        callback(request, response, seconds)
+
+
+_coalesce_observers = []
+
+
+def observe_coalesced(callback):
+    """Call ``callback(request)`` for every call answered by a shared one."""
+    _coalesce_observers.append(callback)
+
+
+def _coalesce_key(request):
+    if request.method not in COALESCED_METHODS:
+        return None
+    return request.method, str(request.url), tuple(request.headers.raw)
+
+
+def _snapshot(response, raw):
+    # the raw (still encoded) body, so every caller decodes its own copy
+    extensions = {name: response.extensions[name] for name in REPLAYED_EXTENSIONS if name in response.extensions}
+    return response.status_code, response.headers.raw, raw, extensions
+
+
+def _replay(snapshot, request):
+    status, headers, raw, extensions = snapshot
+    return httpx.Response(status, headers=headers, stream=httpx.ByteStream(raw), extensions=extensions, request=request)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving meanwhile get its result."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flights)
+
+    def do(self, key, call):
+        """``(result, shared)``; `shared` is true when another caller made the call."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = call()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for the tasks of one event loop."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, call):
+        while True:
+            future = self._flights.get(key)
+            if future is None:
+                break
+            try:
+                # shielded: a waiter giving up does not cancel the call
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the caller making the call was cancelled; try again
+
+        future = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved by the waiters, if any
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._flights[key]
+        return result, False
+
+
+class _PoolStats:
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    def snapshot(self, pool, flights=None):
+        connections = list(getattr(pool, 'connections', []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'max_connections': self.options['MAX_CONNECTIONS'],
+                'max_keepalive_connections': self.options['MAX_KEEPALIVE_CONNECTIONS'],
+                'connections': len(connections),
+                'active_connections': len(connections) - idle,
+                'idle_connections': idle,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'retries': self.retries,
+                'coalesced': self.coalesced,
+                'shared_in_flight': len(flights) if flights is not None else 0,
+            }
+
+
+class PooledTransport(httpx.BaseTransport):
+    """Per-process connection pool with bounded retries."""
+
+    def __init__(self, options=None):
+        self.options = _options(options)
+        self.stats = _PoolStats(self.options)
+        self._pid = None
+        self._inner = None
+        self._flights = None
+        self._lock = threading.Lock()
+
+    def _transport(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._inner = httpx.HTTPTransport(http2=self.options['HTTP2'], limits=_limits(self.options))
+                    # calls in flight in the parent are not this process's
+                    self._flights = SingleFlight()
+                    self._pid = os.getpid()
+        return self._inner
+
+    def _send(self, request):
+        return self._transport().handle_request(request)
+
+    def _before_retry(self, state):
+        with self.stats.lock:
+            self.stats.retries += 1
+        if not state.outcome.failed:
+            state.outcome.result().close()
+
+    def _call(self, request, shared=False):
+        retrying = Retrying(
+            stop=stop_after_attempt(max(1, self.options['RETRIES'])),
+            wait=wait_exponential_jitter(initial=self.options['RETRY_BACKOFF']),
+            retry=_retryable_errors(request) | retry_if_result(_should_retry(request)),
+            retry_error_callback=lambda state: state.outcome.result(),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+        with self.stats.lock:
+            self.stats.in_flight += 1
+            self.stats.requests += 1
+        started = time.perf_counter()
+        response = snapshot = None
+        try:
+            response = retrying(self._send, request)
+            if shared:
+                try:
+                    snapshot = _snapshot(response, b"".join(response.iter_raw()))
+                finally:
+                    response.close()
+                response = _replay(snapshot, request)
+            if _observers:
+                response.read()
+            return snapshot if shared else response
+        finally:
+            with self.stats.lock:
+                self.stats.in_flight -= 1
+            if _observers:
+                _notify(request, response, time.perf_counter() - started)
+
+    def handle_request(self, request):
+        _apply_call_timeout(request)
+        key = _coalesce_key(request) if self.options['COALESCE'] else None
+        if key is None:
+            return self._call(request)
+        self._transport()
+        snapshot, shared = self._flights.do(key, lambda: self._call(request, shared=True))
+        if shared:
+            with self.stats.lock:
+                self.stats.coalesced += 1
+            for callback in _coalesce_observers:
+                callback(request)
+        return _replay(snapshot, request)
+
+    def pool_stats(self):
+        current = self._pid == os.getpid()
+        inner = self._inner if current else None
+        return self.stats.snapshot(getattr(inner, '_pool', None), self._flights if current else None)
+
+    def close(self):
+        if self._inner is not None and self._pid == os.getpid():
+            self._inner.close()
+
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of `PooledTransport`; lives in one event loop."""
+
+    def __init__(self, options=None):
+        self.options = _options(options)
+        self.stats = _PoolStats(self.options)
+        self._inner = httpx.AsyncHTTPTransport(http2=self.options['HTTP2'], limits=_limits(self.options))
+        self._flights = AsyncSingleFlight()
+
+    async def _send(self, request):
+        return await self._inner.handle_async_request(request)
+
+    async def _before_retry(self, state):
+        self.stats.retries += 1
+        if not state.outcome.failed:
+            await state.outcome.result().aclose()
+
+    async def _call(self, request, shared=False):
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(max(1, self.options['RETRIES'])),
+            wait=wait_exponential_jitter(initial=self.options['RETRY_BACKOFF']),
+            retry=_retryable_errors(request) | retry_if_result(_should_retry(request)),
+            retry_error_callback=lambda state: state.outcome.result(),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+        self.stats.in_flight += 1
+        self.stats.requests += 1
+        started = time.perf_counter()
+        response = snapshot = None
+        try:
+            response = await retrying(self._send, request)
+            if shared:
+                try:
+                    snapshot = _snapshot(response, b"".join([chunk async for chunk in response.aiter_raw()]))
+                finally:
+                    await response.aclose()
+                response = _replay(snapshot, request)
+            if _observers:
+                await response.aread()
+            return snapshot if shared else response
+        finally:
+            self.stats.in_flight -= 1
+            if _observers:
+                _notify(request, response, time.perf_counter() - started)
+
+    async def handle_async_request(self, request):
+        _apply_call_timeout(request)
+        key = _coalesce_key(request) if self.options['COALESCE'] else None
+        if key is None:
+            return await self._call(request)
+        snapshot, shared = await self._flights.do(key, lambda: self._call(request, shared=True))
+        if shared:
+            self.stats.coalesced += 1
+            for callback in _coalesce_observers:
+                callback(request)
+        return _replay(snapshot, request)
+
+    def pool_stats(self):
+        return self.stats.snapshot(getattr(self._inner, '_pool', None), self._flights)
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+_transports = weakref.WeakSet()
+
+
+def pool_stats():
+    """Pool metrics of every transport created by this process."""
+    return [transport.pool_stats() for transport in _transports]
+
+
+def build_client(url, key, options=None):
+    # the supabase package takes most of a second to import; it is only
+    # imported once a client is actually needed
+    from supabase import create_client
+    from supabase.lib.client_options import SyncClientOptions
+
+    options = _options(options)
+    transport = PooledTransport(options)
+    _transports.add(transport)
+    http_client = httpx.Client(transport=transport, timeout=_timeout(options), follow_redirects=True)
+    return create_client(url, key, options=SyncClientOptions(httpx_client=http_client))
+
+
+async def abuild_client(url, key, options=None):
+    from supabase import AsyncClientOptions, acreate_client
+
+    options = _options(options)
+    transport = AsyncPooledTransport(options)
+    _transports.add(transport)
+    http_client = httpx.AsyncClient(transport=transport, timeout=_timeout(options), follow_redirects=True)
+    return await acreate_client(url, key, options=AsyncClientOptions(httpx_client=http_client))
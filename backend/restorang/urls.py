@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from restorang_app import views
+
 urlpatterns = [
     path("api/", include("restorang_app.urls")),
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,238 @@
+"""Price analytics over the whole price table, on the columns of
+price_columns.py.
+
+- `category_prices`: the current price of every item (its latest price),
+  summarized per category - average, median, min and max.
+- `price_index`: how expensive each restaurant is, 100 being the market.
+  Items belong to one restaurant, so an item is compared with the average
+  current price of its category; the index is the geometric mean of
+  those ratios over the restaurant's items, times 100.
+- `inflation`: period-over-period price change. Every item's last price
+  in a period is compared with its last price in the period before; the
+  change of a period is the geometric mean of those ratios (a Jevons
+  index) and the chained changes give an index starting at 100.
+
+Every step is a sort, a group boundary or a `bincount` on NumPy arrays;
+no Python loop runs over the prices.
+"""
+import datetime
+
+import numpy as np
+
+from . import price_columns
+from .price_columns import NO_CATEGORY
+
+PERIODS = ('month', 'quarter', 'year')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _ids(params, name, label):
+    values = params.getlist(name)
+    if not values:
+        return None
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        raise QueryError("%s must be a %s ID" % (name, label))
+
+
+def _dates(params, *names):
+    result = {}
+    for name in names:
+        try:
+            result[name] = datetime.date.fromisoformat(params[name]) if params.get(name) else None
+        except ValueError:
+            raise QueryError("%s must be a date (YYYY-MM-DD)" % name)
+    return result
+
+
+def _number(params, name, default):
+    try:
+        value = int(params.get(name) or default)
+    except ValueError:
+        raise QueryError("%s must be a number" % name)
+    if value < 1:
+        raise QueryError("%s must be positive" % name)
+    return value
+
+
+def category_query(params):
+    """`category_prices` arguments from the query string; raises `QueryError`."""
+    return {
+        "category_ids": _ids(params, 'category', 'category'),
+        "rest_ids": _ids(params, 'rest_id', 'restaurant'),
+        "as_of": _dates(params, 'as_of')['as_of'],
+    }
+
+
+def index_query(params):
+    """`price_index` arguments from the query string; raises `QueryError`."""
+    return {
+        "rest_ids": _ids(params, 'rest_id', 'restaurant'),
+        "as_of": _dates(params, 'as_of')['as_of'],
+        "min_items": _number(params, 'min_items', 1),
+        "limit": _number(params, 'limit', 100),
+    }
+
+
+def inflation_query(params):
+    """`inflation` arguments from the query string; raises `QueryError`."""
+    period = params.get('period') or 'month'
+    if period not in PERIODS:
+        raise QueryError("period must be one of %s" % ", ".join(PERIODS))
+    dates = _dates(params, 'from', 'to')
+    return {
+        "period": period,
+        "category_ids": _ids(params, 'category', 'category'),
+        "rest_ids": _ids(params, 'rest_id', 'restaurant'),
+        "item_ids": _ids(params, 'item_id', 'item'),
+        "date_from": dates['from'],
+        "date_to": dates['to'],
+    }
+
+
+def _day(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def _amount(cents):
+    return round(float(cents) / 100, 2)
+
+
+def _select(store, item_ids=None, rest_ids=None, category_ids=None, date_from=None, date_to=None):
+    """Positions of the prices matching the filters."""
+    rows = store.rows_for(item_ids, rest_ids)
+    if rows is None:
+        rows = np.arange(len(store))
+    if category_ids is not None:
+        rows = rows[np.isin(store.category_id[rows], category_ids)]
+    if date_from is not None:
+        rows = rows[store.day[rows] >= _day(date_from)]
+    if date_to is not None:
+        rows = rows[store.day[rows] <= _day(date_to)]
+    return rows
+
+
+def _last(store, rows, groups):
+    """``(rows, groups)``: of `rows`, the latest price (by date, then
+    price_id) per value of `groups`, in the order of `groups`."""
+    if not len(rows):
+        return rows, groups
+    order = np.argsort(groups, kind='stable')
+    rows, groups = rows[order], groups[order]
+    starts = np.flatnonzero(np.append(True, groups[1:] != groups[:-1]))
+    # the store is in price_id order, so a position breaks ties of a date
+    latest = np.maximum.reduceat(store.day[rows].astype(np.int64) << 32 | rows, starts)
+    return latest & 0xFFFFFFFF, groups[starts]
+
+
+def _current(store, as_of=None, rest_ids=None):
+    """Positions of the current price of every item with a category."""
+    rows = _select(store, rest_ids=rest_ids, date_to=as_of)
+    rows = rows[store.category_id[rows] != NO_CATEGORY]
+    return _last(store, rows, store.item_id[rows])[0]
+
+
+def category_prices(category_ids=None, rest_ids=None, as_of=None):
+    """Current price summary per category, most items first."""
+    store = price_columns.get_store()
+    with store.lock:
+        rows = _current(store, as_of, rest_ids)
+        if category_ids is not None:
+            rows = rows[np.isin(store.category_id[rows], category_ids)]
+        category = store.category_id[rows]
+        values = store.cents[rows]
+        order = np.lexsort((values, category))
+        category, values = category[order], values[order]
+        keys, starts, counts = np.unique(category, return_index=True, return_counts=True)
+        totals = np.add.reduceat(values, starts) if len(values) else np.empty(0, dtype=np.int64)
+        # the values are sorted within each category
+        medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+        names = store.category_names
+        result = [{
+            "category_id": int(key),
+            "name": names.get(int(key)),
+            "items": int(count),
+            "avg": _amount(total / count),
+            "median": _amount(median),
+            "min": _amount(values[start]),
+            "max": _amount(values[start + count - 1]),
+        } for key, start, count, total, median in zip(keys, starts, counts, totals, medians)]
+    result.sort(key=lambda entry: (-entry["items"], str(entry["name"])))
+    return result
+
+
+def price_index(rest_ids=None, as_of=None, min_items=1, limit=100):
+    """Restaurants with their price index, cheapest first, and how many
+    priced items it is based on. The market is every restaurant, also
+    when `rest_ids` selects the ones returned."""
+    store = price_columns.get_store()
+    with store.lock:
+        rows = _current(store, as_of)
+        rows = rows[store.cents[rows] > 0]
+        category = store.category_id[rows]
+        values = store.cents[rows].astype(float)
+        _, inverse = np.unique(category, return_inverse=True)
+        market = np.bincount(inverse, weights=values) / np.bincount(inverse)
+        ratios = np.log(values / market[inverse])
+        restaurants, inverse, counts = np.unique(store.rest_id[rows], return_inverse=True, return_counts=True)
+        index = np.exp(np.bincount(inverse, weights=ratios) / counts) * 100
+    keep = counts >= min_items
+    if rest_ids is not None:
+        keep &= np.isin(restaurants, rest_ids)
+    restaurants, index, counts = restaurants[keep], index[keep], counts[keep]
+    order = np.lexsort((restaurants, index))[:limit]
+    return [
+        {"rest_id": int(restaurants[i]), "index": round(float(index[i]), 2), "items": int(counts[i])}
+        for i in order
+    ]
+
+
+def _periods(day, period):
+    dates = day.astype('datetime64[D]')
+    if period == 'year':
+        return dates.astype('datetime64[Y]').astype(np.int64)
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    return months // 3 if period == 'quarter' else months
+
+
+def _period_start(number, period):
+    if period == 'year':
+        return datetime.date(1970 + number, 1, 1)
+    months = number * 3 if period == 'quarter' else number
+    return datetime.date(1970 + months // 12, months % 12 + 1, 1)
+
+
+def inflation(period='month', category_ids=None, rest_ids=None, item_ids=None, date_from=None, date_to=None):
+    """Per period from the first to the last with prices: its start date,
+    the change from the period before in percent (None when no item was
+    priced in both), the chained index and how many items were compared."""
+    store = price_columns.get_store()
+    with store.lock:
+        rows = _select(store, item_ids, rest_ids, category_ids, date_from, date_to)
+        rows = rows[store.cents[rows] > 0]
+        periods = _periods(store.day[rows], period)
+        first = periods.min() if len(periods) else 0
+        # the last price per item and period, in item then period order
+        rows, groups = _last(store, rows, store.item_id[rows].astype(np.int64) << 24 | (periods - first))
+        item, periods = groups >> 24, groups & 0xFFFFFF
+        values = store.cents[rows].astype(float)
+    if not len(rows):
+        return []
+    # an item priced in two adjacent periods gives one price relative
+    adjacent = (item[1:] == item[:-1]) & (periods[1:] == periods[:-1] + 1)
+    relatives = np.log(values[1:][adjacent] / values[:-1][adjacent])
+    slot = periods[1:][adjacent]
+    length = periods.max() + 1
+    compared = np.bincount(slot, minlength=length)
+    change = np.exp(np.bincount(slot, weights=relatives, minlength=length) / np.maximum(compared, 1))
+    index = 100 * np.cumprod(change)
+    return [{
+        "period": _period_start(int(first + number), period).isoformat(),
+        "change_pct": round(float(change[number] - 1) * 100, 2) if compared[number] else None,
+        "index": round(float(index[number]), 2),
+        "items": int(compared[number]),
+    } for number in range(length)]
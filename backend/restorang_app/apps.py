@@ -3,3 +3,17 @@ from django.apps import AppConfig
 
 class RestorangAppConfig(AppConfig):
     name = 'restorang_app'
+
+    def ready(self):
+        # connect the signal receivers
+        from . import cache, changefeed, facets, geo, price_columns, price_stats, replica, reports, rollups, search  # noqa: F401
+        from restorang import supabase_client
+        from . import instrumentation
+        supabase_client.observe(instrumentation.record_call)
+        supabase_client.observe_coalesced(instrumentation.record_coalesced)
+        from django.conf import settings
+        from django.core.signals import request_started
+        if settings.RESTORANG_REALTIME['ENABLED']:
+            request_started.connect(changefeed.start_on_request, dispatch_uid="restorang_changefeed")
+        if settings.RESTORANG_DATA_BACKEND == 'replica' and settings.RESTORANG_REPLICA['SYNC_IN_PROCESS']:
+            request_started.connect(replica.start_on_request, dispatch_uid="restorang_replica")
@@ -0,0 +1,265 @@
+"""Read-through cache for slow-changing Supabase lookups.
+
+Cached entries are tagged with the tables they were read from. Every table
+has a version number that is bumped when the table is written, so stale
+entries are never read again and simply age out of the backend.
+
+Two backends are available, picked by ``settings.RESTORANG_CACHE``:
+
+* ``local`` - a per-process ``cachetools.TTLCache`` (TTL plus LRU eviction)
+* ``django`` - one of Django's configured caches, shared between workers
+"""
+import hashlib
+import threading
+import time
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.dispatch import receiver
+
+from .signals import table_changed
+
+_MISSING = object()
+
+
+class LocalBackend:
+    # writes made by other processes are never seen
+    shared = False
+
+    def __init__(self, maxsize, ttl):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key, _MISSING)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+
+    def version(self, table):
+        return self._versions.get(table, 0)
+
+    # in memory, so the async views call these without leaving the loop
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+    async def aversion(self, table):
+        return self.version(table)
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def info(self):
+        return {"size": len(self._entries), "maxsize": self._entries.maxsize}
+
+
+class DjangoBackend:
+    def __init__(self, alias, ttl):
+        self._cache = caches[alias]
+        self._ttl = ttl
+        # the local-memory and dummy caches live in one process too
+        self.shared = not isinstance(self._cache, (LocMemCache, DummyCache))
+
+    def get(self, key):
+        return self._cache.get(key, _MISSING)
+
+    def set(self, key, value):
+        self._cache.set(key, value, self._ttl)
+
+    def version(self, table):
+        return self._cache.get("restorang:version:" + table, 0)
+
+    async def aget(self, key):
+        return await self._cache.aget(key, _MISSING)
+
+    async def aset(self, key, value):
+        await self._cache.aset(key, value, self._ttl)
+
+    async def aversion(self, table):
+        return await self._cache.aget("restorang:version:" + table, 0)
+
+    def changed_at(self, table):
+        key = "restorang:changed:" + table
+        # a table not written since the cache was filled counts from now
+        self._cache.add(key, time.time(), None)
+        return self._cache.get(key) or time.time()
+
+    async def achanged_at(self, table):
+        key = "restorang:changed:" + table
+        await self._cache.aadd(key, time.time(), None)
+        return await self._cache.aget(key) or time.time()
+
+    def bump(self, table):
+        key = "restorang:version:" + table
+        self._cache.add(key, 0, None)
+        try:
+            self._cache.incr(key)
+        except ValueError:
+            self._cache.set(key, 1, None)
+        self._cache.set("restorang:changed:" + table, time.time(), None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def info(self):
+        return {}
+
+
+def _build_backend():
+    options = getattr(settings, "RESTORANG_CACHE", {})
+    ttl = options.get("TTL", 300)
+    if options.get("BACKEND", "local") == "django":
+        return DjangoBackend(options.get("ALIAS", "default"), ttl)
+    return LocalBackend(options.get("MAXSIZE", 1024), ttl)
+
+
+backend = _build_backend()
+
+_counters = {"hits": 0, "misses": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def version(*tables):
+    """A string that changes whenever one of `tables` is written."""
+    return ",".join("%s@%s" % (table, backend.version(table)) for table in tables)
+
+
+def tracks_writes(*tables):
+    """Whether every write to `tables` - made by any process, or upstream
+    and seen on the change feed - reaches `changed_at`."""
+    realtime = settings.RESTORANG_REALTIME
+    return backend.shared and realtime['ENABLED'] and set(tables) <= set(realtime['TABLES'])
+
+
+def changed_at(*tables):
+    """When one of `tables` was last written, as a timestamp, or None when
+    that is not known (`tracks_writes`); a table not written since the
+    shared cache started counts from its first lookup."""
+    if not tracks_writes(*tables):
+        return None
+    return max(backend.changed_at(table) for table in tables)
+
+
+async def achanged_at(*tables):
+    if not tracks_writes(*tables):
+        return None
+    return max([await backend.achanged_at(table) for table in tables])
+
+
+async def aversion(*tables):
+    """`version` without blocking the event loop on a shared backend."""
+    return ",".join(["%s@%s" % (table, await backend.aversion(table)) for table in tables])
+
+
+def _make_key(versions, key):
+    digest = hashlib.sha1(("%s|%s" % (versions, key)).encode()).hexdigest()
+    return "restorang:entry:" + digest
+
+
+def _lookup(tables, key):
+    if isinstance(tables, str):
+        tables = (tables,)
+    cache_key = _make_key(version(*tables), key)
+    value = backend.get(cache_key)
+    _count("misses" if value is _MISSING else "hits")
+    return cache_key, value
+
+
+async def _alookup(tables, key):
+    if isinstance(tables, str):
+        tables = (tables,)
+    cache_key = _make_key(await aversion(*tables), key)
+    value = await backend.aget(cache_key)
+    _count("misses" if value is _MISSING else "hits")
+    return cache_key, value
+
+
+def cached(tables, key, fetch):
+    """Return ``fetch()`` for `key`, reading it from the cache when possible.
+
+    `tables` lists every table the result depends on; writing any of them
+    invalidates the entry. Cached values are shared between requests and
+    must not be modified by the caller.
+    """
+    cache_key, value = _lookup(tables, key)
+    if value is _MISSING:
+        value = fetch()
+        backend.set(cache_key, value)
+    return value
+
+
+async def acached(tables, key, fetch):
+    """Async version of `cached`; `fetch` returns an awaitable."""
+    cache_key, value = await _alookup(tables, key)
+    if value is _MISSING:
+        value = await fetch()
+        await backend.aset(cache_key, value)
+    return value
+
+
+def lookup(tables, key):
+    """``(cache_key, value)`` for `key`, value None on a miss.
+
+    For callers that decide after fetching whether to keep the value; pass
+    the returned `cache_key` to `store` so that a table written meanwhile
+    still invalidates it.
+    """
+    cache_key, value = _lookup(tables, key)
+    return cache_key, None if value is _MISSING else value
+
+
+async def alookup(tables, key):
+    cache_key, value = await _alookup(tables, key)
+    return cache_key, None if value is _MISSING else value
+
+
+def store(cache_key, value):
+    backend.set(cache_key, value)
+
+
+async def astore(cache_key, value):
+    await backend.aset(cache_key, value)
+
+
+def invalidate(*tables):
+    for table in tables:
+        backend.bump(table)
+
+
+def stats():
+    with _counters_lock:
+        hits = _counters["hits"]
+        misses = _counters["misses"]
+    lookups = hits + misses
+    return {
+        "backend": type(backend).__name__,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+        **backend.info(),
+    }
+
+
+@receiver(table_changed)
+def _invalidate_on_write(sender, **kwargs):
+    invalidate(sender._meta.db_table)
@@ -0,0 +1,468 @@
+"""Upstream row changes, applied to this process and pushed to browsers.
+
+A subscriber thread (`start`) follows the Postgres changes of
+``RESTORANG_REALTIME['TABLES']`` through Supabase Realtime and hands each
+change to `apply`, which sends `table_changed` for it as if the write had
+been made through the repository here: the cached reads of the table are
+invalidated and the price stats, rollups and the search, geo and facet
+indexes take the changed row in, instead of waiting for a TTL or the next
+rebuild. A change to a row this process wrote itself within
+``ECHO_WINDOW`` seconds is skipped, it was applied when it was written
+(the feed lags the response to the write, so the write is seen first).
+Changes missed while the subscription was down can not be replayed, so
+the cached reads of the followed tables are invalidated on every
+(re)subscribe.
+
+Every price write - made here or seen on the feed - is published to the
+`Stream`s of the browsers that follow its restaurant or item
+(/api/price-updates/, server-sent events). The last ``BACKLOG`` events
+are kept, so a browser reconnecting with ``Last-Event-ID`` gets the ones
+it missed; one that missed more, or was connected to another process, is
+sent a ``reset`` event and reloads the page data instead.
+
+Deletes carry only the primary key unless the table has ``REPLICA
+IDENTITY FULL``; a price delete without its item and restaurant
+invalidates the cached reads but leaves the price stats and rollups to
+their next rebuild.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from . import cache, instrumentation
+from .models import Category, Item, Price, Restaurant
+from .repository import PRICE_NATURAL_KEY
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+MODELS = {model._meta.db_table: model for model in (Price, Restaurant, Item, Category)}
+# columns identifying a row in both a local write and its change event;
+# upserted prices are written without their price_id
+ECHO_KEYS = {Price: PRICE_NATURAL_KEY}
+# columns the price receivers need to place a change
+PRICE_COLUMNS = ('item_id', 'rest_id')
+ACTIONS = {'INSERT': 'insert', 'UPDATE': 'update', 'DELETE': 'delete'}
+# milliseconds a browser waits before reconnecting a closed stream
+RECONNECT_MS = 3000
+
+
+class QueryError(ValueError):
+    pass
+
+
+# -- echoes of local writes ------------------------------------------------
+
+def _echo_key(model, row):
+    columns = ECHO_KEYS.get(model, (model._meta.pk.attname,))
+    values = tuple(row.get(column) for column in columns)
+    if None in values:
+        return None
+    return (model._meta.db_table,) + tuple(str(value) for value in values)
+
+
+_written = {}
+_written_order = collections.deque()
+_written_lock = threading.Lock()
+
+
+def _remember(model, rows):
+    window = settings.RESTORANG_REALTIME['ECHO_WINDOW']
+    now = time.monotonic()
+    with _written_lock:
+        for row in rows:
+            key = _echo_key(model, row)
+            if key is not None:
+                _written[key] = now
+                _written_order.append((now, key))
+        while _written_order and now - _written_order[0][0] > window:
+            written_at, key = _written_order.popleft()
+            if _written.get(key) == written_at:
+                del _written[key]
+
+
+def _is_echo(model, row):
+    key = _echo_key(model, row)
+    with _written_lock:
+        written_at = _written.get(key)
+    return written_at is not None and time.monotonic() - written_at <= settings.RESTORANG_REALTIME['ECHO_WINDOW']
+
+
+# -- applying changes ------------------------------------------------------
+
+def apply(payload):
+    """Apply one Realtime postgres_changes payload; returns the outcome."""
+    data = payload.get('data', payload)
+    model = MODELS.get(data.get('table'))
+    action = ACTIONS.get(data.get('type'))
+    if model is None or action is None:
+        return "ignored"
+    row = (data.get('old_record') if action == "delete" else data.get('record')) or {}
+    table = model._meta.db_table
+    if _is_echo(model, row):
+        outcome = "echo"
+    elif model is Price and any(row.get(column) is None for column in PRICE_COLUMNS):
+        cache.invalidate(table)
+        outcome = "partial"
+    else:
+        table_changed.send(sender=model, action=action, rows=[row], origin="realtime")
+        outcome = "applied"
+    instrumentation.REALTIME_CHANGES.inc(table=table, outcome=outcome)
+    return outcome
+
+
+def _apply_logged(payload):
+    try:
+        apply(payload)
+    except Exception:
+        logger.exception("Error applying an upstream change")
+        close_old_connections()
+
+
+def _subscribed(tables):
+    logger.info("Following upstream changes of %s", ", ".join(tables))
+    # whatever changed while the feed was down is unknown
+    cache.invalidate(*tables)
+
+
+async def realtime_source(tables, on_change, on_subscribed):
+    """Follow `tables` on the Supabase Realtime channel until cancelled or
+    the subscription fails."""
+    from realtime import AsyncRealtimeClient
+
+    client = AsyncRealtimeClient(settings.SUPABASE_URL.rstrip('/') + '/realtime/v1', settings.SUPABASE_KEY)
+    failed = asyncio.Event()
+
+    def on_state(state, error):
+        if state == "SUBSCRIBED":
+            on_subscribed()
+        else:
+            logger.warning("Change feed subscription %s: %s", state, error)
+            failed.set()
+
+    await client.connect()
+    try:
+        channel = client.channel('restorang-changes')
+        for table in tables:
+            channel.on_postgres_changes('*', on_change, table=table, schema='public')
+        await channel.subscribe(on_state)
+        while not failed.is_set():
+            if not client.is_connected:
+                raise ConnectionError("Realtime connection lost")
+            try:
+                await asyncio.wait_for(failed.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+        raise ConnectionError("Realtime subscription ended")
+    finally:
+        await client.close()
+
+
+class Subscriber:
+    """A thread running `source` and applying its changes in order.
+
+    `source` is an async callable ``(tables, on_change, on_subscribed)``
+    that runs until cancelled; when it returns or raises it is restarted
+    after a delay doubling up to ``MAX_RECONNECT_DELAY`` seconds.
+    """
+
+    def __init__(self, source=realtime_source, tables=None):
+        self.source = source
+        self.tables = tuple(tables or settings.RESTORANG_REALTIME['TABLES'])
+        self.connected = False
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="changefeed-apply")
+        self._thread = None
+        self._loop = None
+        self._task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="changefeed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._loop is not None and self._task is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                # the loop already ended
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def flush(self):
+        """Wait until the changes received so far are applied."""
+        self._executor.submit(lambda: None).result()
+
+    def _on_change(self, payload):
+        self._executor.submit(_apply_logged, payload)
+
+    def _on_subscribed(self):
+        self.connected = True
+        self._executor.submit(_subscribed, self.tables)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except asyncio.CancelledError:
+            pass
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self._stopped.is_set():
+            return
+        options = settings.RESTORANG_REALTIME
+        delay = options['RECONNECT_DELAY']
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                await self.source(self.tables, self._on_change, self._on_subscribed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change feed failed, reconnecting in %.0f s", delay)
+            self.connected = False
+            if time.monotonic() - started > options['MAX_RECONNECT_DELAY']:
+                # it ran for a while, start over with a short delay
+                delay = options['RECONNECT_DELAY']
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, options['MAX_RECONNECT_DELAY'])
+
+
+_subscriber = None
+_lock = threading.Lock()
+
+
+def start(source=None):
+    """The subscriber of this process, started on the first call."""
+    global _subscriber
+    if _subscriber is None:
+        with _lock:
+            if _subscriber is None:
+                _subscriber = Subscriber(source or realtime_source).start()
+    return _subscriber
+
+
+def stop(timeout=None):
+    global _subscriber
+    with _lock:
+        subscriber, _subscriber = _subscriber, None
+    if subscriber is not None:
+        subscriber.stop(timeout)
+
+
+def start_on_request(sender, **kwargs):
+    # connected to request_started when RESTORANG_REALTIME['ENABLED'], so
+    # only processes serving requests subscribe
+    start()
+
+
+# -- price streams ---------------------------------------------------------
+
+class Stream:
+    """The events for one browser connection, waiting to be sent."""
+
+    def __init__(self, topics, size):
+        self.topics = frozenset(topics)
+        self.size = size
+        # the browser fell too far behind and has to reload
+        self.lost = False
+        self._events = collections.deque()
+        self._ready = threading.Condition()
+        self._waiter = None
+
+    def put(self, event):
+        with self._ready:
+            if len(self._events) >= self.size:
+                self._events.clear()
+                self.lost = True
+            elif not self.lost:
+                self._events.append(event)
+            self._ready.notify_all()
+            waiter = self._waiter
+        if waiter is not None:
+            loop, ready = waiter
+            loop.call_soon_threadsafe(ready.set)
+
+    def _take(self):
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def get(self, timeout):
+        """The events waiting, after up to `timeout` seconds for one."""
+        with self._ready:
+            if not self._events and not self.lost:
+                self._ready.wait(timeout)
+            return self._take()
+
+    async def aget(self, timeout):
+        ready = asyncio.Event()
+        with self._ready:
+            if self._events or self.lost:
+                return self._take()
+            self._waiter = (asyncio.get_running_loop(), ready)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._ready:
+            self._waiter = None
+            return self._take()
+
+
+# event ids are "<epoch>-<number>"; the epoch tells a reconnecting browser
+# whether the number is from this process
+_epoch = uuid.uuid4().hex[:8]
+_ids = itertools.count(1)
+_backlog = collections.deque()
+_streams = set()
+_streams_lock = threading.Lock()
+
+instrumentation.PRICE_STREAMS.collect = lambda: {(): len(_streams)}
+
+
+def topics(params):
+    """The topics asked for in the query string; raises `QueryError`."""
+    found = []
+    for name, prefix in (('rest_id', 'rest'), ('item_id', 'item')):
+        for value in params.getlist(name):
+            try:
+                found.append('%s:%d' % (prefix, int(value)))
+            except ValueError:
+                raise QueryError("%s must be a number" % name)
+    if not found:
+        raise QueryError("rest_id or item_id is required")
+    limit = settings.RESTORANG_REALTIME['MAX_TOPICS']
+    if len(found) > limit:
+        raise QueryError("at most %d restaurants and items can be followed" % limit)
+    return found
+
+
+def _price_topics(row):
+    return {'rest:%s' % row.get('rest_id'), 'item:%s' % row.get('item_id')}
+
+
+def publish(kind, data, topics):
+    """Send an event to the streams following any of `topics`."""
+    with _streams_lock:
+        event = ('%s-%d' % (_epoch, next(_ids)), kind, frozenset(topics), json.dumps(data, default=str))
+        _backlog.append(event)
+        while len(_backlog) > settings.RESTORANG_REALTIME['BACKLOG']:
+            _backlog.popleft()
+        streams = [stream for stream in _streams if stream.topics & event[2]]
+    for stream in streams:
+        stream.put(event)
+
+
+def subscribe(topics, last_event_id=None):
+    """A `Stream` of the events for `topics`; with `last_event_id`, the
+    kept events after it are put in first."""
+    stream = Stream(topics, settings.RESTORANG_REALTIME['QUEUE_SIZE'])
+    with _streams_lock:
+        if last_event_id:
+            epoch, _, number = last_event_id.partition('-')
+            known = [event for event in _backlog if event[0].startswith(_epoch + '-')]
+            if epoch != _epoch or not number.isdigit() or (
+                known and int(known[0][0].partition('-')[2]) > int(number) + 1
+            ):
+                stream.lost = True
+            else:
+                for event in known:
+                    if int(event[0].partition('-')[2]) > int(number) and stream.topics & event[2]:
+                        stream.put(event)
+        _streams.add(stream)
+    return stream
+
+
+def unsubscribe(stream):
+    with _streams_lock:
+        _streams.discard(stream)
+
+
+def _format(event):
+    event_id, kind, _, data = event
+    return "id: %s\nevent: %s\ndata: %s\n\n" % (event_id, kind, data)
+
+
+def _reset():
+    # with the id of the newest event, the browser reconnects from there
+    # once it reloaded
+    with _streams_lock:
+        latest = _backlog[-1][0] if _backlog else '%s-0' % _epoch
+    return "id: %s\nevent: reset\ndata: {}\n\n" % latest
+
+
+def events(stream):
+    """Server-sent events of `stream`, with a comment line every
+    ``HEARTBEAT`` seconds, for at most ``MAX_STREAM_SECONDS``; the browser
+    then reconnects with ``Last-Event-ID``."""
+    options = settings.RESTORANG_REALTIME
+    deadline = time.monotonic() + options['MAX_STREAM_SECONDS']
+    try:
+        yield "retry: %d\n\n" % RECONNECT_MS
+        while (remaining := deadline - time.monotonic()) > 0:
+            batch = stream.get(min(options['HEARTBEAT'], remaining))
+            if stream.lost:
+                yield _reset()
+                return
+            yield "".join(map(_format, batch)) if batch else ": keepalive\n\n"
+    finally:
+        unsubscribe(stream)
+
+
+async def aevents(stream):
+    """`events` for async views."""
+    options = settings.RESTORANG_REALTIME
+    deadline = time.monotonic() + options['MAX_STREAM_SECONDS']
+    try:
+        yield "retry: %d\n\n" % RECONNECT_MS
+        while (remaining := deadline - time.monotonic()) > 0:
+            batch = await stream.aget(min(options['HEARTBEAT'], remaining))
+            if stream.lost:
+                yield _reset()
+                return
+            yield "".join(map(_format, batch)) if batch else ": keepalive\n\n"
+    finally:
+        unsubscribe(stream)
+
+
+@receiver(table_changed)
+def _on_write(sender, action, rows, origin=None, **kwargs):
+    if origin is None and sender in MODELS.values():
+        _remember(sender, rows or [])
+    if sender is Price:
+        for row in rows or []:
+            publish('price', {"action": action, "price": row}, _price_topics(row))
+
+
+def _after_fork():
+    global _subscriber, _lock, _epoch, _streams_lock, _written_lock
+    # the subscriber thread stayed in the parent; a child starts its own,
+    # and numbers its events apart from the parent's
+    _subscriber = None
+    _lock = threading.Lock()
+    _streams_lock = threading.Lock()
+    _written_lock = threading.Lock()
+    _epoch = uuid.uuid4().hex[:8]
+    _backlog.clear()
+    _streams.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
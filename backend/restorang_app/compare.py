@@ -0,0 +1,208 @@
+"""Where is it cheapest: current prices of products compared across restaurants.
+
+Items belong to a restaurant, so a product ("Pizza Margherita") is every
+item with that name, folded like the search index folds it. For a basket
+of products `compare` returns, per product, the restaurants ranked by
+their current (latest) price, and per restaurant the basket total, ranked
+by how many of the products it has and then by total.
+
+The latest prices come from `PriceStats` in one query; items with no
+stats yet are computed with one bulk read of their prices. Ranking is
+done on NumPy arrays: one sort of all the prices, then counts and sums
+per restaurant.
+"""
+import json
+
+import numpy as np
+from django.conf import settings
+
+from . import price_stats, search
+from .models import PriceStats
+from .repository import get_repository
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _options():
+    return getattr(settings, 'RESTORANG_COMPARE', {})
+
+
+def _item_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError("item_id must be a number")
+
+
+def _quantity(value):
+    try:
+        quantity = float(value)
+    except (TypeError, ValueError):
+        raise QueryError("quantity must be a number")
+    if quantity <= 0:
+        raise QueryError("quantity must be positive")
+    return quantity
+
+
+def query(request):
+    """``(basket, limit)`` from the request; raises `QueryError`.
+
+    GET takes repeated ``item`` (a name) and ``item_id`` parameters. POST
+    takes a JSON basket, ``{"items": [{"name" or "item_id", "quantity"}],
+    "limit"}``. `basket` is a list of ``(name or item_id, quantity)``.
+    """
+    if request.method == 'POST':
+        try:
+            body = json.loads(request.body or b'{}')
+            entries = body.get('items') or []
+            limit = body.get('limit')
+        except (ValueError, AttributeError):
+            raise QueryError("expected a JSON object with an items list")
+        basket = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not (entry.get('name') or entry.get('item_id')):
+                raise QueryError("every basket entry needs a name or an item_id")
+            product = entry.get('name') or _item_id(entry['item_id'])
+            basket.append((product, _quantity(entry.get('quantity', 1))))
+    else:
+        basket = [(name, 1.0) for name in request.GET.getlist('item') if name.strip()]
+        basket += [(_item_id(item_id), 1.0) for item_id in request.GET.getlist('item_id') if item_id]
+        limit = request.GET.get('limit')
+
+    if not basket:
+        raise QueryError("at least one item or item_id is required")
+    if len(basket) > _options().get('MAX_ITEMS', 200):
+        raise QueryError("at most %d products can be compared" % _options().get('MAX_ITEMS', 200))
+    try:
+        limit = int(limit) if limit else _options().get('LIMIT', 10)
+    except (TypeError, ValueError):
+        raise QueryError("limit must be a number")
+    if limit <= 0:
+        raise QueryError("limit must be positive")
+    return basket, min(limit, _options().get('MAX_LIMIT', 100))
+
+
+def resolve(basket):
+    """Products of `basket` as ``(name, quantity, item rows)``.
+
+    An item_id stands for every item named like it. Products named alike
+    are merged, adding up their quantities.
+    """
+    index = search.get_index()
+    products = {}
+    with index.lock:
+        for product, quantity in basket:
+            if isinstance(product, int):
+                row = index.items.get(product)
+                name = row['name'] if row else str(product)
+                rows = index.items.equal(name) if row else []
+            else:
+                name, rows = product, index.items.equal(product)
+            key = search.fold(name)
+            if key in products:
+                products[key][1] += quantity
+            else:
+                products[key] = [rows[0]['name'] if rows else name, quantity, rows]
+    return [tuple(product) for product in products.values()]
+
+
+def latest_prices(item_ids, repository=None):
+    """``(item_id, rest_id, latest_value, latest_date)`` of every priced item."""
+    item_ids = set(item_ids)
+    rows = list(
+        PriceStats.objects.filter(item_id__in=item_ids)
+        .values_list('item_id', 'rest_id', 'latest_value', 'latest_date')
+    )
+    missing = item_ids.difference(row[0] for row in rows)
+    if missing:
+        repository = repository or get_repository()
+        stats = list(price_stats.aggregate(repository.prices_for_items(sorted(missing))).values())
+        if stats:
+            price_stats.save(stats)
+        rows += [(s.item_id, s.rest_id, s.latest_value, s.latest_date) for s in stats]
+    return rows
+
+
+def rank(quantities, product, item_id, rest_id, value, limit):
+    """Rank restaurants per product and by basket total.
+
+    `product`, `item_id`, `rest_id` and `value` are parallel arrays, one
+    entry per latest price, `product` indexing `quantities`. When a
+    restaurant has several items of a product the cheapest one counts.
+
+    Returns ``(offers, baskets)``: for every product the entry indexes of
+    its `limit` cheapest restaurants, cheapest first; and for the `limit`
+    best restaurants ``(rest_id, total, missing products)``.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    restaurants, column = np.unique(rest_id, return_inverse=True)
+
+    # by product, then price, restaurant and item: the first entry of a
+    # (product, restaurant) pair is the one that counts
+    order = np.lexsort((item_id, column, value, product))
+    _, first = np.unique((product * len(restaurants) + column)[order], return_index=True)
+    chosen = order[np.sort(first)]
+
+    # the first `limit` entries of every product
+    products = product[chosen]
+    starts = np.searchsorted(products, np.arange(len(quantities) + 1))
+    top = chosen[np.arange(len(chosen)) - starts[products] < limit]
+    offers = np.split(top, np.searchsorted(product[top], np.arange(1, len(quantities))))
+
+    columns = column[chosen]
+    totals = np.bincount(columns, weights=value[chosen] * quantities[products], minlength=len(restaurants))
+    missing = len(quantities) - np.bincount(columns, minlength=len(restaurants))
+    baskets = []
+    for col in np.lexsort((restaurants, totals, missing))[:limit]:
+        present = np.zeros(len(quantities), dtype=bool)
+        present[products[columns == col]] = True
+        baskets.append((restaurants[col], totals[col], np.flatnonzero(~present)))
+    return offers, baskets
+
+
+def compare(basket, limit=10, repository=None):
+    products = resolve(basket)
+    item_rows = {row['item_id']: row for _, _, rows in products for row in rows}
+    product_of = {row['item_id']: number for number, (_, _, rows) in enumerate(products) for row in rows}
+    prices = latest_prices(product_of, repository) if product_of else []
+
+    result = {
+        "items": [
+            {"name": name, "quantity": quantity, "offers": []}
+            for name, quantity, _ in products
+        ],
+        "restaurants": [],
+    }
+    if not prices:
+        return result
+
+    count = len(prices)
+    item_id = np.fromiter((row[0] for row in prices), dtype=np.int64, count=count)
+    rest_id = np.fromiter((row[1] for row in prices), dtype=np.int64, count=count)
+    value = np.fromiter((row[2] for row in prices), dtype=float, count=count)
+    product = np.fromiter((product_of[row[0]] for row in prices), dtype=np.int64, count=count)
+    offers, baskets = rank([quantity for _, quantity, _ in products], product, item_id, rest_id, value, limit)
+
+    for entry, found in zip(result["items"], offers):
+        entry["offers"] = [
+            {
+                "rest_id": prices[i][1],
+                "item_id": prices[i][0],
+                "name": item_rows[prices[i][0]]['name'],
+                "value": float(prices[i][2]),
+                "date": prices[i][3].isoformat(),
+            }
+            for i in found.tolist()
+        ]
+    result["restaurants"] = [
+        {
+            "rest_id": int(rest),
+            "total": round(float(total), 2),
+            "available": len(products) - len(absent),
+            "missing": [products[number][0] for number in absent.tolist()],
+        }
+        for rest, total, absent in baskets
+    ]
+    return result
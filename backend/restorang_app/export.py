@@ -0,0 +1,100 @@
+"""Streaming export of the price table as NDJSON or CSV.
+
+Rows come from `Repository.iter_prices`, which reads the upstream one
+keyset page at a time, and are encoded and (optionally) gzip-compressed
+chunk by chunk, so memory use does not grow with the size of the export.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from .models import Price
+
+COLUMNS = tuple(field.column for field in Price._meta.concrete_fields)
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps({column: row.get(column) for column in COLUMNS}, ensure_ascii=False, default=str) + "\n"
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(COLUMNS)
+    for row in rows:
+        yield line([row.get(column) for column in COLUMNS])
+
+
+FORMATS = {
+    'ndjson': ndjson_lines,
+    'csv': csv_lines,
+}
+
+
+def encoded(lines, chunk_size=CHUNK_SIZE):
+    """Join `lines` into UTF-8 chunks of about `chunk_size` bytes."""
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def filters(params):
+    """Repository filters from the query string; raises `ExportError`."""
+    result = {}
+    for name in ('rest_id', 'item_id'):
+        if params.get(name):
+            try:
+                result[name] = int(params[name])
+            except ValueError:
+                raise ExportError("%s must be an integer" % name)
+    for name, key in (('from', 'date_from'), ('to', 'date_to')):
+        if params.get(name):
+            try:
+                result[key] = datetime.date.fromisoformat(params[name]).isoformat()
+            except ValueError:
+                raise ExportError("%s must be a date (YYYY-MM-DD)" % name)
+    return result
+
+
+def stream(rows, fmt, gzip=False):
+    chunks = encoded(FORMATS[fmt](rows))
+    return gzipped(chunks) if gzip else chunks
@@ -0,0 +1,267 @@
+"""Faceted restaurant filtering over bitmaps.
+
+`FacetIndex` keeps every restaurant in memory with one roaring bitmap
+(``pyroaring.BitMap`` of rest_ids) per type, per quarter and per category
+of the items a restaurant serves. A query combines any number of facets -
+values of one facet are OR-ed, facets are AND-ed - with an optional text
+term matched against the name and address like the search index does
+(case and diacritics folded), and returns the matching restaurants in
+`rest_id` order with the number of matches per facet value. The count of
+a value is taken with the filters of the other facets only, so a client
+can show how many restaurants each choice would leave.
+
+The index is built on first use, follows the restaurant, item and
+category writes made through the repository and is rebuilt every
+``RESTORANG_FACETS['REFRESH']`` seconds to pick up writes made elsewhere.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+from pyroaring import BitMap
+
+from .models import Category, Item, Restaurant
+from .repository import get_repository
+from .search import fold
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+FACETS = ('type', 'quarter', 'category')
+# facets that are columns of the restaurant row
+ROW_FACETS = ('type', 'quarter')
+
+
+class QueryError(ValueError):
+    pass
+
+
+class FacetIndex:
+    def __init__(self):
+        self.rows = {}
+        self.all = BitMap()
+        self.facets = {facet: {} for facet in FACETS}
+        self.category_names = {}
+        self._text = {}
+        # item_id -> (rest_id, category_id), and per restaurant how many of
+        # its items are in each category
+        self._items = {}
+        self._served = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _discard(self, facet, value, rest_id):
+        bitmap = self.facets[facet].get(value)
+        if bitmap is not None:
+            bitmap.discard(rest_id)
+            if not bitmap:
+                del self.facets[facet][value]
+
+    def add_restaurant(self, row):
+        rest_id = row['rest_id']
+        previous = self.rows.get(rest_id)
+        if previous is not None:
+            for facet in ROW_FACETS:
+                self._discard(facet, previous.get(facet), rest_id)
+        self.rows[rest_id] = row
+        self._text[rest_id] = (fold(row.get('name') or ''), fold(row.get('location') or ''))
+        self.all.add(rest_id)
+        for facet in ROW_FACETS:
+            if row.get(facet) is not None:
+                self.facets[facet].setdefault(row[facet], BitMap()).add(rest_id)
+
+    def remove_restaurant(self, rest_id):
+        previous = self.rows.pop(rest_id, None)
+        if previous is None:
+            return
+        del self._text[rest_id]
+        self.all.discard(rest_id)
+        for facet in ROW_FACETS:
+            self._discard(facet, previous.get(facet), rest_id)
+
+    def add_item(self, row):
+        self.remove_item(row['item_id'])
+        rest_id, category_id = row.get('rest_id'), row.get('category_id')
+        if rest_id is None or category_id is None:
+            return
+        self._items[row['item_id']] = (rest_id, category_id)
+        served = self._served.setdefault(rest_id, Counter())
+        served[category_id] += 1
+        if served[category_id] == 1:
+            self.facets['category'].setdefault(category_id, BitMap()).add(rest_id)
+
+    def remove_item(self, item_id):
+        found = self._items.pop(item_id, None)
+        if found is None:
+            return
+        rest_id, category_id = found
+        served = self._served[rest_id]
+        served[category_id] -= 1
+        if not served[category_id]:
+            del served[category_id]
+            self._discard('category', category_id, rest_id)
+
+    def _matching_text(self, term):
+        return BitMap(
+            rest_id for rest_id, (name, location) in self._text.items()
+            if term in name or term in location
+        )
+
+    def query(self, filters, term=None):
+        """``(matches, counts)`` for `filters` (``{facet: [values]}``) and `term`.
+
+        `matches` is a bitmap of rest_ids; `counts` holds ``{value: count}``
+        per facet.
+        """
+        base = self._matching_text(fold(term)) if term else self.all
+        selected = {
+            facet: BitMap.union(*(self.facets[facet].get(value, BitMap()) for value in values))
+            for facet, values in filters.items() if values
+        }
+        matches = BitMap.intersection(base, *selected.values())
+        counts = {}
+        for facet in FACETS:
+            others = [bitmap for name, bitmap in selected.items() if name != facet]
+            scope = BitMap.intersection(base, *others) if others else base
+            counts[facet] = {
+                value: scope.intersection_cardinality(bitmap) for value, bitmap in self.facets[facet].items()
+            }
+        return matches, counts
+
+
+def build(repository=None):
+    repository = repository or get_repository()
+    index = FacetIndex()
+    for row in repository.iter_restaurants():
+        index.add_restaurant(row)
+    for row in repository.iter_items():
+        index.add_item(row)
+    category_ids = sorted(index.facets['category'])
+    index.category_names = repository.category_names(category_ids) if category_ids else {}
+    return index
+
+
+_index = None
+_built_at = 0.0
+_state_lock = threading.Lock()
+_refreshing = False
+
+
+def _rebuild():
+    global _index, _built_at, _refreshing
+    try:
+        index = build()
+        with _state_lock:
+            _index, _built_at = index, time.monotonic()
+    except Exception:
+        # keep serving the old index until the next interval
+        logger.exception("Error rebuilding facet index")
+        _built_at = time.monotonic()
+    finally:
+        _refreshing = False
+
+
+def get_index():
+    """The current index; built on first use, refreshed in the background."""
+    global _index, _built_at, _refreshing
+    if _index is None:
+        with _state_lock:
+            if _index is None:
+                _index, _built_at = build(), time.monotonic()
+    elif time.monotonic() - _built_at > settings.RESTORANG_FACETS['REFRESH'] and not _refreshing:
+        with _state_lock:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_rebuild, daemon=True).start()
+    return _index
+
+
+async def aensure():
+    """Build the index off the event loop if it does not exist yet."""
+    if _index is None:
+        await sync_to_async(get_index)()
+
+
+def reset():
+    global _index
+    with _state_lock:
+        _index = None
+
+
+def query(params):
+    """`search` filters and term from the query string; raises `QueryError`."""
+    filters = {facet: params.getlist(facet) for facet in FACETS if params.getlist(facet)}
+    if 'category' in filters:
+        try:
+            filters['category'] = [int(value) for value in filters['category']]
+        except ValueError:
+            raise QueryError("category must be a category ID")
+    return {"filters": filters, "term": (params.get('q') or '').strip() or None}
+
+
+def _counts(index, facet, counts):
+    values = []
+    for value, count in counts.items():
+        entry = {"value": value, "count": count}
+        if facet == 'category':
+            entry["name"] = index.category_names.get(value)
+        values.append(entry)
+    values.sort(key=lambda entry: (-entry["count"], str(entry.get("name", entry["value"]))))
+    return values
+
+
+def search(filters, term=None, limit=100, after=None):
+    """``(rows, total, facets)``: up to `limit` matching restaurants after
+    the `after` rest_id, how many match, and the counts per facet value."""
+    index = get_index()
+    with index.lock:
+        matches, counts = index.query(filters, term)
+        start = matches.rank(after) if after is not None else 0
+        rows = [index.rows[rest_id] for rest_id in matches[start:start + limit]]
+        facets = {facet: _counts(index, facet, counts[facet]) for facet in FACETS}
+        return rows, len(matches), facets
+
+
+@receiver(table_changed, sender=Restaurant)
+def _update_restaurants(sender, action, rows, **kwargs):
+    index = _index
+    if index is None:
+        return
+    with index.lock:
+        for row in rows or []:
+            if action == "delete":
+                index.remove_restaurant(row['rest_id'])
+            else:
+                index.add_restaurant(row)
+
+
+@receiver(table_changed, sender=Item)
+def _update_items(sender, action, rows, **kwargs):
+    index = _index
+    if index is None:
+        return
+    with index.lock:
+        for row in rows or []:
+            if action == "delete":
+                index.remove_item(row['item_id'])
+            else:
+                index.add_item(row)
+
+
+@receiver(table_changed, sender=Category)
+def _update_categories(sender, action, rows, **kwargs):
+    index = _index
+    if index is None:
+        return
+    with index.lock:
+        for row in rows or []:
+            if action == "delete":
+                index.category_names.pop(row['category_id'], None)
+            else:
+                index.category_names[row['category_id']] = row.get('name')
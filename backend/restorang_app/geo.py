@@ -0,0 +1,396 @@
+"""Restaurant coordinates and nearest-restaurant queries.
+
+Coordinates are geocoded once per address by ``manage.py
+geocode_restaurants`` and stored in `RestaurantLocation` (local database),
+instead of in the browser on every page view. `GeoIndex` keeps the
+geocoded restaurants in a grid of ``RESTORANG_GEO['CELL_DEGREES']`` cells:
+a nearest-k query looks at rings of cells around the point until no
+closer restaurant can exist, a radius query only at the cells its
+bounding box covers.
+
+The index follows restaurant writes made through the repository; a
+restaurant whose address changed leaves the index until it is geocoded
+again. Like the search index it is rebuilt every
+``RESTORANG_GEO['REFRESH']`` seconds to pick up new coordinates.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Restaurant, RestaurantLocation
+from .repository import get_repository
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8  # metres
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+# statuses worth retrying later; the others mean the address was not found
+RETRY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class GeocodingError(Exception):
+    pass
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _options():
+    return getattr(settings, 'RESTORANG_GEO', {})
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres (haversine)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geocode(address, client=None):
+    """``(latitude, longitude, status)`` of `address` from the Google Geocoding API.
+
+    The coordinates are None when the address was not found; raises
+    `GeocodingError` when the request itself failed or was refused.
+    """
+    options = _options()
+    if not options.get('API_KEY'):
+        raise GeocodingError("RESTORANG_GEO['API_KEY'] (GOOGLE_MAPS_API_KEY) is not set")
+    params = {"address": address, "key": options['API_KEY']}
+    if options.get('REGION'):
+        params["region"] = options['REGION']
+    try:
+        response = (client or httpx).get(options['GEOCODER_URL'], params=params, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        raise GeocodingError(str(e))
+    status = data.get("status")
+    if status == "OK":
+        location = data["results"][0]["geometry"]["location"]
+        return location["lat"], location["lng"], status
+    if status in ("REQUEST_DENIED", "INVALID_REQUEST"):
+        raise GeocodingError("%s: %s" % (status, data.get("error_message", "")))
+    return None, None, status
+
+
+def save_location(rest_id, address, latitude, longitude, status):
+    RestaurantLocation.objects.update_or_create(
+        rest_id=rest_id,
+        defaults={
+            "address": address, "latitude": latitude, "longitude": longitude,
+            "status": status, "geocoded_at": timezone.now(),
+        },
+    )
+
+
+class GeoIndex:
+    def __init__(self, cell_degrees):
+        self.cell = cell_degrees
+        # rest_id -> (address, latitude, longitude) of every geocoded address
+        self.locations = {}
+        self._cells = {}
+        self._entries = {}
+        self._bounds = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, lat, lng):
+        return math.floor(lat / self.cell), math.floor(lng / self.cell)
+
+    def add(self, row, latitude, longitude):
+        self.remove(row['rest_id'])
+        key = self._key(latitude, longitude)
+        entry = (latitude, longitude, row)
+        self._entries[row['rest_id']] = (key, entry)
+        self._cells.setdefault(key, []).append(entry)
+        self._bounds = None
+
+    def remove(self, rest_id):
+        found = self._entries.pop(rest_id, None)
+        if found is None:
+            return
+        key, entry = found
+        bucket = self._cells[key]
+        bucket.remove(entry)
+        if not bucket:
+            del self._cells[key]
+        self._bounds = None
+
+    def _occupied(self):
+        # (low_row, high_row, low_column, high_column) of the cells in use
+        if self._bounds is None:
+            rows = [key[0] for key in self._cells]
+            columns = [key[1] for key in self._cells]
+            self._bounds = min(rows), max(rows), min(columns), max(columns)
+        return self._bounds
+
+    def _last_ring(self, row, column):
+        # the ring around (row, column) that reaches the farthest cell
+        low_row, high_row, low_column, high_column = self._occupied()
+        return max(abs(row - low_row), abs(row - high_row), abs(column - low_column), abs(column - high_column))
+
+    def located(self, row):
+        """(latitude, longitude) of restaurant `row` if its current address was geocoded."""
+        location = self.locations.get(row['rest_id'])
+        if location is None or location[0] != row.get('location'):
+            return None
+        return location[1], location[2]
+
+    def _extent(self, lat):
+        # shortest side of a cell between `lat` and the indexed cells, in
+        # metres; a little less, as a great circle is shorter than the
+        # parallel between two points
+        low_row, high_row = self._bounds[:2]
+        widest = max(abs(lat), abs(low_row * self.cell), abs((high_row + 1) * self.cell))
+        return 0.99 * self.cell * METERS_PER_DEGREE * math.cos(math.radians(min(widest, 89.9)))
+
+    def _ring(self, row, column, radius):
+        if radius == 0:
+            yield row, column
+            return
+        for c in range(column - radius, column + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, column - radius
+            yield r, column + radius
+
+    def _cell_reach(self, lat, lng, key):
+        # about the shortest distance from (lat, lng) to cell `key`, a little
+        # less to stay a lower bound
+        south, west = key[0] * self.cell, key[1] * self.cell
+        return 0.99 * distance(
+            lat, lng, min(max(lat, south), south + self.cell), min(max(lng, west), west + self.cell)
+        )
+
+    def _rings(self, lat, lng):
+        # (cells, reach) around the point, nearest first; no entry in a later
+        # step is closer than `reach`
+        row, column = self._key(lat, lng)
+        last_ring = self._last_ring(row, column)
+        extent = self._extent(lat)
+        ring = 0
+        while ring <= last_ring and (2 * ring + 1) ** 2 <= len(self._cells):
+            yield self._ring(row, column, ring), ring * extent
+            ring += 1
+        # far from the data most rings are empty: go through the remaining
+        # occupied cells by their distance instead
+        remaining = sorted(
+            (self._cell_reach(lat, lng, key), key)
+            for key in self._cells
+            if max(abs(key[0] - row), abs(key[1] - column)) >= ring
+        )
+        for position, (_, key) in enumerate(remaining):
+            following = remaining[position + 1][0] if position + 1 < len(remaining) else math.inf
+            yield (key,), following
+
+    def nearest(self, lat, lng, k, radius=None, kind=None):
+        """The `k` nearest entries as ``(distance, latitude, longitude, row)``."""
+        if not self._cells or k <= 0:
+            return []
+        best = []  # max-heap on distance: (-distance, rest_id, entry)
+        for keys, reach in self._rings(lat, lng):
+            for key in keys:
+                for entry in self._cells.get(key, ()):
+                    if kind and entry[2].get('type') != kind:
+                        continue
+                    d = distance(lat, lng, entry[0], entry[1])
+                    if radius is not None and d > radius:
+                        continue
+                    item = (-d, entry[2]['rest_id'], entry)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            if (len(best) == k and reach >= -best[0][0]) or (radius is not None and reach > radius):
+                break
+        return [(-negative, *entry) for negative, _, entry in sorted(best, reverse=True)]
+
+    def within(self, lat, lng, radius, kind=None, limit=None):
+        """Entries within `radius` metres, nearest first."""
+        lat_span = radius / METERS_PER_DEGREE
+        lng_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + lat_span, 89.0))), 1e-6))
+        if not self._cells:
+            return []
+        low_row, low_column = self._key(lat - lat_span, lng - lng_span)
+        high_row, high_column = self._key(lat + lat_span, lng + lng_span)
+        # no cell outside the occupied ones holds an entry
+        occupied = self._occupied()
+        low_row, high_row = max(low_row, occupied[0]), min(high_row, occupied[1])
+        low_column, high_column = max(low_column, occupied[2]), min(high_column, occupied[3])
+        if (high_row - low_row + 1) * (high_column - low_column + 1) > len(self._cells):
+            keys = [
+                key for key in self._cells
+                if low_row <= key[0] <= high_row and low_column <= key[1] <= high_column
+            ]
+        else:
+            keys = ((r, c) for r in range(low_row, high_row + 1) for c in range(low_column, high_column + 1))
+        found = []
+        for key in keys:
+            for entry in self._cells.get(key, ()):
+                if kind and entry[2].get('type') != kind:
+                    continue
+                d = distance(lat, lng, entry[0], entry[1])
+                if d <= radius:
+                    found.append((d, *entry))
+        found.sort(key=lambda item: (item[0], item[3]['rest_id']))
+        return found[:limit] if limit else found
+
+
+def build(repository=None):
+    repository = repository or get_repository()
+    index = GeoIndex(_options().get('CELL_DEGREES', 0.01))
+    index.locations = {
+        rest_id: (address, latitude, longitude)
+        for rest_id, address, latitude, longitude in RestaurantLocation.objects.filter(
+            latitude__isnull=False, longitude__isnull=False
+        ).values_list('rest_id', 'address', 'latitude', 'longitude')
+    }
+    for row in repository.iter_restaurants():
+        # coordinates of an older address are not used
+        coordinates = index.located(row)
+        if coordinates:
+            index.add(row, *coordinates)
+    return index
+
+
+_index = None
+_built_at = 0.0
+_state_lock = threading.Lock()
+_refreshing = False
+
+
+def _rebuild():
+    global _index, _built_at, _refreshing
+    try:
+        index = build()
+        with _state_lock:
+            _index, _built_at = index, time.monotonic()
+    except Exception:
+        # keep serving the old index until the next interval
+        logger.exception("Error rebuilding geo index")
+        _built_at = time.monotonic()
+    finally:
+        _refreshing = False
+
+
+def get_index():
+    """The current index; built on first use, refreshed in the background."""
+    global _index, _built_at, _refreshing
+    if _index is None:
+        with _state_lock:
+            if _index is None:
+                _index, _built_at = build(), time.monotonic()
+    elif time.monotonic() - _built_at > _options().get('REFRESH', 300) and not _refreshing:
+        with _state_lock:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_rebuild, daemon=True).start()
+    return _index
+
+
+def index_version():
+    """Changes whenever the index is rebuilt, e.g. to pick up new coordinates."""
+    get_index()
+    return _built_at
+
+
+async def aensure():
+    """Build the index off the event loop if it does not exist yet."""
+    if _index is None:
+        await sync_to_async(get_index)()
+
+
+def reset():
+    global _index
+    with _state_lock:
+        _index = None
+
+
+def _result(found):
+    return [
+        {**row, "latitude": latitude, "longitude": longitude, "distance_m": round(d, 1)}
+        for d, latitude, longitude, row in found
+    ]
+
+
+def query(params):
+    """`nearby` arguments from the query string; raises `QueryError`."""
+    options = _options()
+    try:
+        lat, lng = float(params['lat']), float(params['lng'])
+    except KeyError:
+        raise QueryError("lat and lng are required")
+    except ValueError:
+        raise QueryError("lat and lng must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise QueryError("lat must be within [-90, 90] and lng within [-180, 180]")
+    result = {"lat": lat, "lng": lng, "kind": params.get('type') or None}
+    for name, convert in (('k', int), ('radius', float)):
+        value = params.get(name)
+        try:
+            result[name] = convert(value) if value else None
+        except ValueError:
+            raise QueryError("%s must be a number" % name)
+        if result[name] is not None and not result[name] > 0:
+            raise QueryError("%s must be positive" % name)
+    if result['k'] is not None:
+        result['k'] = min(result['k'], options.get('MAX_K', 100))
+    if result['radius'] is not None:
+        result['radius'] = min(result['radius'], options.get('MAX_RADIUS', 50000))
+    return result
+
+
+def nearby(lat, lng, k=None, radius=None, kind=None):
+    """Restaurants nearest to (`lat`, `lng`), each with its ``distance_m``.
+
+    With `radius` only, every restaurant within `radius` metres (up to
+    ``RESTORANG_GEO['MAX_RESULTS']``); with `k`, the `k` nearest, within
+    `radius` if one is given.
+    """
+    index = get_index()
+    with index.lock:
+        if k is None and radius is not None:
+            return _result(index.within(lat, lng, radius, kind, _options().get('MAX_RESULTS', 500)))
+        return _result(index.nearest(lat, lng, k or 10, radius, kind))
+
+
+def with_coordinates(rows):
+    """Copies of restaurant `rows` with their ``latitude`` and ``longitude`` (None when unknown)."""
+    index = get_index()
+    with index.lock:
+        result = []
+        for row in rows:
+            latitude, longitude = index.located(row) or (None, None)
+            result.append({**row, "latitude": latitude, "longitude": longitude})
+        return result
+
+
+@receiver(table_changed, sender=Restaurant)
+def _update_on_write(sender, action, rows, **kwargs):
+    index = _index
+    if index is None:
+        return
+    with index.lock:
+        for row in rows or []:
+            coordinates = index.located(row) if action != "delete" else None
+            if coordinates:
+                index.add(row, *coordinates)
+            else:
+                index.remove(row['rest_id'])
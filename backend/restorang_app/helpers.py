@@ -1,21 +1,44 @@
-from restorang import settings
-supabase = settings.supabase
+import re
+
+from . import cache, search
+from .repository import get_repository
+
+PRICE_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
 
 def restIdByName(rest_name):
-    rest_id = supabase.table('restaurant').select('rest_id').ilike('rest_name', rest_name).execute()                    
+    rest_id = [{'rest_id': row['rest_id']} for row in search.restaurants_named(rest_name)]
     return rest_id
 
 def restTypeById(rest_id):
-    rest_type = supabase.table('restaurant').select('type').eq('rest_id', rest_id).execute()                    
+    rest_type = cache.cached(
+        'restaurant', 'restaurant:type-by-id:%s' % rest_id,
+        lambda: [{'type': row['type']} for row in get_repository().restaurant(rest_id)]
+    )
     return rest_type
 
 def priceByItemIdAndRestId(item_id, rest_id):
-    price = supabase.table('price').select('value').eq('item_id', item_id).eq('rest_id', rest_id).execute()                    
+    price = get_repository().price_values(item_id, rest_id)
     return price
 
 
     
+def priceLabel(row):
+    # "12.50", or "9.00 - 12.50" when the row has several prices; the
+    # price rows of a search result or the value of a price row
+    values = row.get('price')
+    if not isinstance(values, list):
+        values = [{'value': row.get('value', values)}]
+    numbers = []
+    for price in values:
+        match = PRICE_NUMBER.search(str(price.get('value', '')))
+        if match:
+            numbers.append(float(match.group().replace(',', '.')))
+    if not numbers:
+        return ""
+    low, high = min(numbers), max(numbers)
+    return "%.2f" % low if low == high else "%.2f - %.2f" % (low, high)
+
 def updatePrice(price_id, new_value):
     
-    response = supabase.table('price').update({'value': new_value}).eq('price_id', price_id).execute()
-    return response
\ No newline at end of file
+    response = get_repository().update_price(price_id, new_value)
+    return response
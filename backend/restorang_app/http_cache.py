@@ -0,0 +1,113 @@
+"""HTTP caching for the JSON read endpoints.
+
+`conditional` gives a GET endpoint:
+
+* an ``ETag`` (hash of the body), with ``304 Not Modified`` for a
+  matching ``If-None-Match``;
+* a ``Last-Modified`` (when one of the tables it reads was last written)
+  and ``304`` for ``If-Modified-Since`` only where that time follows every
+  write, see `cache.tracks_writes`; a per-process cache would answer 304
+  for data changed by another process;
+* a ``Cache-Control`` policy of its own (`max_age` seconds, plus
+  ``stale-while-revalidate``);
+* optionally (``settings.RESTORANG_HTTP_CACHE['RESPONSES']``) a server-side
+  cache of the whole response, keyed by the path and the normalized query
+  string and tagged with the tables it was read from, so a write through
+  the app drops it. A revalidation answered from it costs no upstream
+  query at all.
+
+Only successful responses (a JSON object whose ``error`` is null) are
+kept server-side.
+"""
+import functools
+import hashlib
+import json
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import cache
+
+
+def _enabled():
+    return getattr(settings, 'RESTORANG_HTTP_CACHE', {}).get('RESPONSES', False)
+
+
+def _key(request):
+    params = sorted((name, value) for name, values in request.GET.lists() for value in values)
+    return "response:%s?%s" % (request.path, "&".join("%s=%s" % pair for pair in params))
+
+
+def _entry(response, last_modified):
+    return {
+        "content": response.content,
+        "content_type": response["Content-Type"],
+        "etag": '"%s"' % hashlib.sha1(response.content).hexdigest(),
+        "last_modified": last_modified,
+    }
+
+
+def _succeeded(response):
+    if response.status_code != 200 or response.streaming:
+        return False
+    try:
+        payload = json.loads(response.content)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get("error", False) is None
+
+
+def _respond(request, entry, max_age):
+    response = HttpResponse(entry["content"], content_type=entry["content_type"])
+    response["ETag"] = entry["etag"]
+    last_modified = entry["last_modified"]
+    if last_modified is not None:
+        last_modified = int(last_modified)
+        response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=max_age, stale_while_revalidate=max_age)
+    return get_conditional_response(request, etag=entry["etag"], last_modified=last_modified, response=response)
+
+
+def conditional(tables, max_age):
+    """Conditional GET and Cache-Control for a JSON view reading `tables`.
+
+    Works on sync and async views; other methods pass straight through.
+    """
+    if isinstance(tables, str):
+        tables = (tables,)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                cache_key, entry = await cache.alookup(tables, _key(request)) if _enabled() else (None, None)
+                if entry is None:
+                    response = await view(request, *args, **kwargs)
+                    if not _succeeded(response):
+                        return response
+                    entry = _entry(response, await cache.achanged_at(*tables))
+                    if cache_key:
+                        await cache.astore(cache_key, entry)
+                return _respond(request, entry, max_age)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                cache_key, entry = cache.lookup(tables, _key(request)) if _enabled() else (None, None)
+                if entry is None:
+                    response = view(request, *args, **kwargs)
+                    if not _succeeded(response):
+                        return response
+                    entry = _entry(response, cache.changed_at(*tables))
+                    if cache_key:
+                        cache.store(cache_key, entry)
+                return _respond(request, entry, max_age)
+        return wrapper
+
+    return decorator
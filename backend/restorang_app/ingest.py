@@ -0,0 +1,176 @@
+"""Bulk loading of price rows.
+
+A batch is CSV (a header row naming the `Price` columns), a JSON array
+(or ``{"prices": [...]}``) or NDJSON. Every row is validated against the
+`Price` model fields; when several rows share an (item_id, rest_id, date)
+the last one wins. Valid rows are written with chunked upserts on that
+key, so loading the same scrape twice updates the prices instead of
+duplicating them.
+
+Rows that fail validation or are rejected upstream are reported with
+their line number and never abort the rest of the batch: a chunk the
+upstream rejects is split in halves until the offending rows are found.
+The write receivers (price stats, rollups, ...) are notified once, after
+the last chunk, with every row written.
+"""
+import csv
+import io
+import json
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Price
+from .repository import PRICE_NATURAL_KEY, _plain, get_repository
+from .signals import table_changed
+
+FORMATS = ('csv', 'json', 'ndjson')
+MAX_REPORTED_ERRORS = 1000
+
+_EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+class IngestError(ValueError):
+    pass
+
+
+def guess_format(content_type=None, name=None):
+    for extension, fmt in _EXTENSIONS.items():
+        if name and name.lower().endswith(extension):
+            return fmt
+    return _CONTENT_TYPES.get(content_type)
+
+
+def read_rows(data, fmt):
+    """``(line, row, error)`` for every row of a batch in `fmt`."""
+    if fmt not in FORMATS:
+        raise IngestError("format must be csv, json or ndjson")
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise IngestError("batch is not UTF-8")
+
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(data))
+        return ((reader.line_num, row, None) for row in reader)
+
+    if fmt == 'json':
+        try:
+            payload = json.loads(data)
+        except ValueError as e:
+            raise IngestError("invalid JSON: %s" % e)
+        if isinstance(payload, dict):
+            payload = payload.get('prices')
+        if not isinstance(payload, list):
+            raise IngestError('expected a list of prices or {"prices": [...]}')
+        return ((number, row, None) for number, row in enumerate(payload, 1))
+
+    return _ndjson_rows(data)
+
+
+def _ndjson_rows(data):
+    for number, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError as e:
+            yield number, None, {"row": "invalid JSON: %s" % e}
+
+
+def clean(row, model=Price):
+    """Validate `row` against the fields of `model`; returns ``(row, errors)``."""
+    if not isinstance(row, dict):
+        return None, {"row": "expected an object"}
+    cleaned = {}
+    errors = {}
+    for field in model._meta.concrete_fields:
+        raw = row.get(field.column)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        elif isinstance(raw, float):
+            # to_python would keep every binary digit of 12.35
+            raw = str(raw)
+        if raw is None or raw == '':
+            if field.primary_key:
+                continue
+            if field.null:
+                cleaned[field.column] = None
+            else:
+                errors[field.column] = "This field is required."
+            continue
+        target = field.target_field if field.is_relation else field
+        try:
+            value = target.to_python(raw)
+            for validator in target.validators:
+                validator(value)
+        except ValidationError as e:
+            errors[field.column] = " ".join(e.messages)
+            continue
+        cleaned[field.column] = _plain(value)
+    return cleaned, errors
+
+
+def _fail(report, line, errors):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"line": line, "errors": errors})
+
+
+def _write(repository, chunk, report, written):
+    rows = [row for _, row in chunk]
+    try:
+        repository.upsert_prices(rows, notify=False)
+    except Exception as e:
+        if len(chunk) == 1:
+            _fail(report, chunk[0][0], {"upstream": str(e)})
+            return
+        middle = len(chunk) // 2
+        _write(repository, chunk[:middle], report, written)
+        _write(repository, chunk[middle:], report, written)
+    else:
+        report["written"] += len(chunk)
+        written.extend(rows)
+
+
+def ingest(records, repository=None, batch_size=None):
+    """Validate, dedupe and upsert `records` (from `read_rows`); returns a report."""
+    repository = repository or get_repository()
+    batch_size = batch_size or settings.RESTORANG_INGEST['BATCH_SIZE']
+    started = time.perf_counter()
+    report = {"received": 0, "valid": 0, "duplicates": 0, "written": 0, "failed": 0, "errors": []}
+
+    latest = {}
+    for line, row, errors in records:
+        report["received"] += 1
+        if errors is None:
+            row, errors = clean(row)
+        if errors:
+            _fail(report, line, errors)
+            continue
+        key = tuple(row[column] for column in PRICE_NATURAL_KEY)
+        if key in latest:
+            report["duplicates"] += 1
+        latest[key] = (line, row)
+    report["valid"] = len(latest)
+
+    pending = list(latest.values())
+    written = []
+    for start in range(0, len(pending), batch_size):
+        _write(repository, pending[start:start + batch_size], report, written)
+    if written:
+        # every restaurant and item of the batch is recomputed once
+        table_changed.send(sender=Price, action="upsert", rows=written)
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["received"] / elapsed, 1) if elapsed else None
+    return report
@@ -0,0 +1,363 @@
+"""Per-request accounting of upstream (PostgREST) calls.
+
+`InstrumentationMiddleware` opens a record for every request; `record_call`,
+registered on the Supabase transports (`restorang.supabase_client.observe`),
+adds each upstream call made while serving it with its table, status,
+duration and bytes. When the response leaves the middleware the record is
+
+* summarized in a ``Server-Timing`` header (upstream and app time, and one
+  entry per upstream call);
+* added to the Prometheus metrics served at ``/metrics``;
+* logged as one structured line on the ``restorang.requests`` logger, at
+  WARNING when the request made more than
+  ``RESTORANG_METRICS['UPSTREAM_CALL_WARNING']`` upstream calls.
+
+Metrics are kept per process; scrape every worker.
+"""
+import bisect
+import contextvars
+import datetime
+import json
+import logging
+import threading
+import time
+
+import httpx
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger("restorang.requests")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SERVER_TIMING_CALLS = 20
+REST_PREFIX = "/rest/v1/"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    """A value that goes up and down; `collect`, when set, is called for
+    the current values (by label tuple) on every scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception:
+                logger.exception("Error collecting %s", self.name)
+                return
+            with self._lock:
+                self._values = dict(values)
+        yield from super().samples()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", {**labels, "le": bound}, cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+REQUESTS = Counter(
+    "restorang_requests_total", "Requests served.", ("view", "method", "status"))
+REQUEST_SECONDS = Histogram(
+    "restorang_request_duration_seconds", "Time to serve a request.", ("view",))
+RESPONSE_BYTES = Histogram(
+    "restorang_response_bytes", "Size of the response body.", ("view",), BYTE_BUCKETS)
+CALLS_PER_REQUEST = Histogram(
+    "restorang_upstream_calls_per_request", "Upstream calls made to serve a request.", ("view",), CALL_BUCKETS)
+UPSTREAM_CALLS = Counter(
+    "restorang_upstream_calls_total", "Upstream calls.", ("table", "method", "status"))
+UPSTREAM_SECONDS = Histogram(
+    "restorang_upstream_duration_seconds", "Time of an upstream call, retries included.", ("table",))
+UPSTREAM_BYTES = Counter(
+    "restorang_upstream_bytes_total", "Bytes exchanged with the upstream.", ("table", "direction"))
+UPSTREAM_COALESCED = Counter(
+    "restorang_upstream_coalesced_total", "Upstream calls saved by sharing an identical call in flight.", ("table",))
+REPORT_QUEUE_DEPTH = Gauge(
+    "restorang_report_queue_depth", "Price reports in the local queue.", ("state",))
+REPORTS_SUBMITTED = Counter(
+    "restorang_reports_submitted_total", "Price report submissions.", ("outcome",))
+REPORTS_WRITTEN = Counter(
+    "restorang_reports_written_total", "Queued price reports by write result.", ("result",))
+REPORTS_PROMOTED = Counter(
+    "restorang_reports_promoted_total", "Approved price reports copied into prices.")
+REPORT_BATCH_SECONDS = Histogram(
+    "restorang_report_batch_duration_seconds", "Time to write a batch of queued price reports.")
+REPORT_WAIT_SECONDS = Histogram(
+    "restorang_report_queue_wait_seconds", "Time from submission to upstream write of a price report.",
+    buckets=WAIT_BUCKETS)
+REALTIME_CHANGES = Counter(
+    "restorang_realtime_changes_total", "Upstream row changes received on the change feed.", ("table", "outcome"))
+PRICE_STREAMS = Gauge(
+    "restorang_price_streams", "Open price update streams.")
+REPLICA_READS = Counter(
+    "restorang_replica_reads_total", "Repository reads of the replica backend by where they were served from.",
+    ("source",))
+REPLICA_LAG = Gauge(
+    "restorang_replica_lag_seconds", "Time since the least recently synced replica table was synced.")
+REPLICA_ROWS_SYNCED = Counter(
+    "restorang_replica_rows_synced_total", "Replica rows added, changed or removed by a sync.", ("table", "kind"))
+REPLICA_SYNC_SECONDS = Histogram(
+    "restorang_replica_sync_duration_seconds", "Time to sync a replica table.", ("table",))
+
+METRICS = [
+    REQUESTS, REQUEST_SECONDS, RESPONSE_BYTES, CALLS_PER_REQUEST,
+    UPSTREAM_CALLS, UPSTREAM_SECONDS, UPSTREAM_BYTES, UPSTREAM_COALESCED,
+    REPORT_QUEUE_DEPTH, REPORTS_SUBMITTED, REPORTS_WRITTEN, REPORTS_PROMOTED,
+    REPORT_BATCH_SECONDS, REPORT_WAIT_SECONDS, REALTIME_CHANGES, PRICE_STREAMS,
+    REPLICA_READS, REPLICA_LAG, REPLICA_ROWS_SYNCED, REPLICA_SYNC_SECONDS,
+]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def exposition():
+    """The metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            if labels:
+                name += "{%s}" % ",".join('%s="%s"' % (label, _escape(_format(v))) for label, v in labels.items())
+            lines.append("%s %s" % (name, _format(value)))
+    return "\n".join(lines) + "\n"
+
+
+class RequestRecord:
+    def __init__(self):
+        self.calls = []
+        self.coalesced = 0
+
+    @property
+    def upstream_seconds(self):
+        return sum(call["seconds"] for call in self.calls)
+
+    @property
+    def upstream_bytes(self):
+        return sum(call["received"] for call in self.calls)
+
+
+_current = contextvars.ContextVar("restorang_request_record", default=None)
+
+
+def current():
+    """The record of the request being served, or None outside a request."""
+    return _current.get()
+
+
+def _table(url):
+    path = url.path
+    if path.startswith(REST_PREFIX):
+        return path[len(REST_PREFIX):] or "-"
+    return path
+
+
+def record_call(request, response, seconds):
+    table = _table(request.url)
+    status = response.status_code if response is not None else "error"
+    try:
+        sent = len(request.content)
+    except httpx.RequestNotRead:
+        sent = 0
+    received = 0
+    if response is not None:
+        # a response built in memory (no network stream) counts no download
+        received = response.num_bytes_downloaded or len(response.content)
+
+    UPSTREAM_CALLS.inc(table=table, method=request.method, status=status)
+    UPSTREAM_SECONDS.observe(seconds, table=table)
+    UPSTREAM_BYTES.inc(sent, table=table, direction="sent")
+    UPSTREAM_BYTES.inc(received, table=table, direction="received")
+
+    record = _current.get()
+    if record is not None:
+        record.calls.append({
+            "table": table, "method": request.method, "status": status,
+            "seconds": seconds, "sent": sent, "received": received,
+        })
+
+
+def record_coalesced(request):
+    UPSTREAM_COALESCED.inc(table=_table(request.url))
+    record = _current.get()
+    if record is not None:
+        record.coalesced += 1
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    return match.view_name or match.func.__name__
+
+
+def _server_timing(record, total):
+    upstream = record.upstream_seconds
+    entries = [
+        'upstream;dur=%.1f;desc="%d calls"' % (upstream * 1000, len(record.calls)),
+        "app;dur=%.1f" % (max(total - upstream, 0) * 1000),
+    ]
+    for number, call in enumerate(record.calls[:SERVER_TIMING_CALLS], 1):
+        entries.append('db%d;dur=%.1f;desc="%s %s"' % (number, call["seconds"] * 1000, call["method"], call["table"]))
+    entries.append("total;dur=%.1f" % (total * 1000))
+    return ", ".join(entries)
+
+
+def _finish(request, response, record, total):
+    view = _view_name(request)
+    size = len(response.content) if not response.streaming else None
+
+    REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(total, view=view)
+    CALLS_PER_REQUEST.observe(len(record.calls), view=view)
+    if size is not None:
+        RESPONSE_BYTES.observe(size, view=view)
+
+    response["Server-Timing"] = _server_timing(record, total)
+
+    limit = settings.RESTORANG_METRICS["UPSTREAM_CALL_WARNING"]
+    level = logging.WARNING if limit and len(record.calls) > limit else logging.INFO
+    tables = {}
+    for call in record.calls:
+        tables[call["table"]] = tables.get(call["table"], 0) + 1
+    logger.log(level, "%s %s %s", request.method, request.path, response.status_code, extra={
+        "view": view,
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "duration_ms": round(total * 1000, 1),
+        "response_bytes": size,
+        "upstream_calls": len(record.calls),
+        "upstream_ms": round(record.upstream_seconds * 1000, 1),
+        "upstream_bytes": record.upstream_bytes,
+        "upstream_tables": tables,
+        "upstream_coalesced": record.coalesced,
+    })
+
+
+class InstrumentationMiddleware:
+    """Times every request and accounts for the upstream calls it makes.
+
+    Put it first in MIDDLEWARE so the time spent in the other middleware
+    counts as app time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        record = RequestRecord()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _finish(request, response, record, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        record = RequestRecord()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _finish(request, response, record, time.perf_counter() - started)
+        return response
+
+
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any ``extra``."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
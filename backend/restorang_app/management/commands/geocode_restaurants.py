@@ -0,0 +1,56 @@
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from restorang_app import geo
+from restorang_app.models import RestaurantLocation
+from restorang_app.repository import get_repository
+
+
+class Command(BaseCommand):
+    help = "Geocode restaurant addresses that have no stored coordinates yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rest-id", type=int, action="append", help="only these restaurants (repeatable)")
+        parser.add_argument("--all", action="store_true", help="geocode every address again")
+        parser.add_argument("--retry-failed", action="store_true", help="also retry addresses that were not found")
+        parser.add_argument("--delay", type=float, default=0.05, help="seconds between requests")
+
+    def handle(self, *args, **options):
+        rows = get_repository().restaurants()
+        if options["rest_id"]:
+            wanted = set(options["rest_id"])
+            rows = [row for row in rows if row["rest_id"] in wanted]
+        stored = {location.rest_id: location for location in RestaurantLocation.objects.all()}
+
+        pending = []
+        for row in rows:
+            location = stored.get(row["rest_id"])
+            if (
+                options["all"]
+                or location is None
+                or location.address != row["location"]
+                or location.status in geo.RETRY_STATUSES
+                or (options["retry_failed"] and location.latitude is None)
+            ):
+                pending.append(row)
+
+        found = missing = 0
+        with httpx.Client() as client:
+            for number, row in enumerate(pending):
+                if number and options["delay"]:
+                    time.sleep(options["delay"])
+                try:
+                    latitude, longitude, status = geo.geocode(row["location"], client)
+                except geo.GeocodingError as e:
+                    raise CommandError("restaurant %s (%s): %s" % (row["rest_id"], row["location"], e))
+                geo.save_location(row["rest_id"], row["location"], latitude, longitude, status)
+                if latitude is None:
+                    missing += 1
+                    self.stderr.write("restaurant %s: %s (%s)" % (row["rest_id"], status, row["location"]))
+                else:
+                    found += 1
+
+        self.stdout.write("Geocoded %d of %d restaurants (%d not found, %d already stored)." % (
+            found, len(rows), missing, len(rows) - len(pending)))
@@ -0,0 +1,41 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restorang_app import ingest
+
+
+class Command(BaseCommand):
+    help = "Load price rows from CSV, JSON or NDJSON files with batched upserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="files to load, or - for stdin")
+        parser.add_argument("--format", choices=ingest.FORMATS, help="default: from the file extension")
+        parser.add_argument("--batch-size", type=int, help="rows per upsert request")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        for path in options["paths"]:
+            fmt = options["format"] or ingest.guess_format(name=path)
+            if not fmt:
+                raise CommandError("%s: cannot tell the format, pass --format" % path)
+            try:
+                if path == "-":
+                    data = sys.stdin.buffer.read()
+                else:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                report = ingest.ingest(ingest.read_rows(data, fmt), batch_size=options["batch_size"])
+            except (OSError, ingest.IngestError) as e:
+                raise CommandError("%s: %s" % (path, e))
+
+            for error in report["errors"]:
+                self.stderr.write("%s:%s: %s" % (os.path.basename(path), error["line"], error["errors"]))
+            self.stdout.write(
+                "%s: %d rows, %d written, %d failed, %d duplicates in %.2f s (%.0f rows/s)" % (
+                    path, report["received"], report["written"], report["failed"],
+                    report["duplicates"], report["seconds"], report["rows_per_second"] or 0,
+                )
+            )
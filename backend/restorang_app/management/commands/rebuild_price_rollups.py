@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from restorang_app import rollups
+from restorang_app.repository import ID_CHUNK_SIZE, get_repository
+
+
+class Command(BaseCommand):
+    help = "Recompute the price history rollups from the price table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--item-id", type=int, action="append", help="only these items (repeatable)")
+
+    def handle(self, *args, **options):
+        repository = get_repository()
+        item_ids = options["item_id"] or [row["item_id"] for row in repository.iter_items()]
+        # a chunk of items at a time keeps only their history in memory
+        total = 0
+        for start in range(0, len(item_ids), ID_CHUNK_SIZE):
+            total += len(rollups.compute(item_ids[start:start + ID_CHUNK_SIZE], repository))
+        self.stdout.write("Stored %d rollups for %d items." % (total, len(item_ids)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from restorang_app import price_stats
+from restorang_app.repository import get_repository
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed price statistics from the price table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rest-id", type=int, action="append", help="only these restaurants (repeatable)")
+
+    def handle(self, *args, **options):
+        repository = get_repository()
+        # one restaurant at a time keeps a single restaurant's history in memory
+        rest_ids = options["rest_id"] or [row["rest_id"] for row in repository.restaurants()]
+        total = 0
+        for rest_id in rest_ids:
+            total += len(price_stats.compute(repository, rest_id=rest_id))
+        self.stdout.write("Stored statistics for %d item/restaurant pairs in %d restaurants." % (total, len(rest_ids)))
@@ -0,0 +1,31 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from restorang_app import reports
+
+
+class Command(BaseCommand):
+    help = "Write the queued price reports upstream and promote the approved ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="worker threads (default RESTORANG_REPORTS['WORKERS'])")
+        parser.add_argument("--once", action="store_true", help="write the reports due now, promote, and exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            written = reports.drain()
+            promoted = reports.promote()
+            self.stdout.write("Processed %d queued reports, promoted %d." % (written, promoted))
+            return
+
+        workers = reports.Workers(options["workers"] or settings.RESTORANG_REPORTS['WORKERS'] or 1).start()
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        self.stdout.write("Running %d report workers." % workers.count)
+        stopped.wait()
+        workers.stop()
+        self.stdout.write("Stopped; %(pending)d reports pending, %(failed)d failed." % reports.depths())
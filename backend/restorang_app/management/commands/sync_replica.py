@@ -0,0 +1,45 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from restorang_app import replica
+
+
+class Command(BaseCommand):
+    help = "Bring the local read replica up to date, rebuild it or compare it with the upstream."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="copy every table again from scratch")
+        parser.add_argument("--verify", action="store_true", help="compare the replica with the upstream row by row")
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="keep syncing every --interval seconds (for web processes without SYNC_IN_PROCESS)",
+        )
+        parser.add_argument("--interval", type=int, help="seconds between syncs (default RESTORANG_REPLICA['SYNC_INTERVAL'])")
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            report = replica.verify()
+            for table, counts in report.items():
+                self.stdout.write("%s: %d rows, %d missing, %d extra, %d different" % (
+                    table, counts["rows"], counts["missing"], counts["extra"], counts["different"]))
+            if any(counts["missing"] or counts["extra"] or counts["different"] for counts in report.values()):
+                raise CommandError("The replica differs from the upstream; run with --rebuild.")
+            return
+
+        changed = replica.sync(full=options["rebuild"])
+        self.stdout.write("Synced: %s; %.0f s behind." % (
+            ", ".join("%s %d changed" % item for item in changed.items()), replica.lag() or 0))
+        if not options["loop"]:
+            return
+
+        syncer = replica.Syncer(interval=options["interval"] or settings.RESTORANG_REPLICA['SYNC_INTERVAL'] or 30)
+        syncer.start()
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        self.stdout.write("Syncing every %d s." % syncer.interval)
+        stopped.wait()
+        syncer.stop()
@@ -0,0 +1,89 @@
+import asyncio
+
+from . import cache
+from .repository import get_async_repository, get_repository
+
+
+def get_menu(rest_id, repository=None):
+    """Items of a restaurant with their category name and price rows.
+
+    Items, categories and prices are read with one bulk query each and
+    joined here, so the number of upstream calls does not depend on the
+    size of the menu. Items and category names go through the cache.
+    """
+    repository = repository or get_repository()
+    items, categories = _items_and_categories(rest_id, repository)
+    if not items:
+        return []
+    item_ids = list(dict.fromkeys(item['item_id'] for item in items))
+    return _assemble(items, categories, repository.prices_for_items(item_ids))
+
+
+def get_categorized_menu(rest_id, repository=None):
+    """Items of a restaurant grouped by category, without prices.
+
+    Categories are ordered by name, items without one come last.
+    """
+    items, categories = _items_and_categories(rest_id, repository or get_repository())
+    groups = {}
+    for item in items:
+        category_id = item.get('category_id')
+        group = groups.get(category_id)
+        if group is None:
+            group = groups[category_id] = {
+                "category_id": category_id, "category_name": categories.get(category_id), "items": [],
+            }
+        group["items"].append(item)
+    return sorted(groups.values(), key=lambda group: (group["category_name"] is None, group["category_name"] or ''))
+
+
+def _items_and_categories(rest_id, repository):
+    items = cache.cached('item', 'item:rest:%s' % rest_id, lambda: repository.items_for_restaurant(rest_id))
+    if not items:
+        return [], {}
+    category_ids = list(dict.fromkeys(
+        item['category_id'] for item in items if item.get('category_id') is not None
+    ))
+    categories = cache.cached(
+        'category', 'category:names:%s' % ','.join(map(str, sorted(category_ids))),
+        lambda: repository.category_names(category_ids)
+    )
+    return items, categories
+
+
+async def aget_menu(rest_id, repository=None):
+    """Async version of `get_menu`; categories and prices load concurrently."""
+    repository = repository or await get_async_repository()
+
+    items = await cache.acached('item', 'item:rest:%s' % rest_id, lambda: repository.items_for_restaurant(rest_id))
+    if not items:
+        return []
+
+    item_ids = list(dict.fromkeys(item['item_id'] for item in items))
+    category_ids = list(dict.fromkeys(
+        item['category_id'] for item in items if item.get('category_id') is not None
+    ))
+
+    categories, price_rows = await asyncio.gather(
+        cache.acached(
+            'category', 'category:names:%s' % ','.join(map(str, sorted(category_ids))),
+            lambda: repository.category_names(category_ids)
+        ),
+        repository.prices_for_items(item_ids),
+    )
+    return _assemble(items, categories, price_rows)
+
+
+def _assemble(items, categories, price_rows):
+    prices = {}
+    for row in price_rows:
+        prices.setdefault(row['item_id'], []).append(row)
+
+    return [
+        {
+            **item,
+            "prices": prices.get(item['item_id'], []),
+            "category_name": categories.get(item.get('category_id')),
+        }
+        for item in items
+    ]
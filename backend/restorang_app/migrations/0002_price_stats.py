@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStats',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('item_id', models.IntegerField()),
+                ('rest_id', models.IntegerField()),
+                ('latest_price_id', models.IntegerField()),
+                ('latest_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('latest_date', models.DateField()),
+                ('last_changed', models.DateField()),
+                ('min_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('count', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'price_stats',
+                'constraints': [models.UniqueConstraint(fields=('item_id', 'rest_id'), name='price_stats_item_rest')],
+            },
+        ),
+    ]
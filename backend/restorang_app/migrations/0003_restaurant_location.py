@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0002_price_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantLocation',
+            fields=[
+                ('rest_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('address', models.CharField(max_length=255)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('status', models.CharField(max_length=32)),
+                ('geocoded_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'restaurant_location',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0003_restaurant_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('item_id', models.IntegerField()),
+                ('resolution', models.CharField(max_length=8)),
+                ('dimension', models.CharField(max_length=8)),
+                ('series', models.CharField(max_length=255)),
+                ('bucket', models.DateField()),
+                ('open_price_id', models.IntegerField()),
+                ('open_date', models.DateField()),
+                ('open_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('close_price_id', models.IntegerField()),
+                ('close_date', models.DateField()),
+                ('close_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('min_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('count', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'price_rollup',
+                'constraints': [models.UniqueConstraint(fields=('item_id', 'resolution', 'dimension', 'series', 'bucket'), name='price_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0004_price_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedPriceReport',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('payload', models.JSONField()),
+                ('state', models.CharField(default='pending', max_length=8)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('enqueued_at', models.DateTimeField()),
+                ('available_at', models.DateTimeField()),
+                ('claimed_by', models.CharField(blank=True, max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'price_report_queue',
+                'indexes': [models.Index(fields=['state', 'available_at'], name='price_report_queue_due')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0005_price_report_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplicaTable',
+            fields=[
+                ('table', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('high_water', models.BigIntegerField(null=True)),
+                ('high_water_date', models.DateField(null=True)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(null=True)),
+                ('full_synced_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'replica_table',
+                'managed': False,
+            },
+        ),
+    ]
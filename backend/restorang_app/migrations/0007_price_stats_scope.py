@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restorang_app', '0006_replica_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStatsScope',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('column', models.CharField(max_length=8)),
+                ('value', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'price_stats_scope',
+                'constraints': [models.UniqueConstraint(fields=('column', 'value'), name='price_stats_scope_column_value')],
+            },
+        ),
+    ]
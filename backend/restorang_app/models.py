@@ -20,12 +20,18 @@ class Price(models.Model):
     user_id = models.ForeignKey(
         "User",
         on_delete=models.CASCADE,
-        db_column="user_id"
+        db_column="user_id",
+        null=True,
+        blank=True
     )
 
     class Meta:
         managed = False 
         db_table = "price"
+        # one price per item, restaurant and day; bulk ingestion upserts on it
+        constraints = [
+            models.UniqueConstraint(fields=["item_id", "rest_id", "date"], name="price_item_rest_date"),
+        ]
     
     def __str__(self):
         return f"{self.item_id.name} - {self.value}"
@@ -39,6 +45,11 @@ class Item(models.Model):
         on_delete=models.CASCADE,
         db_column="category_id"
     )
+    rest_id = models.ForeignKey(
+        "Restaurant",
+        on_delete=models.CASCADE,
+        db_column="rest_id"
+    )
     class Meta:
         managed = False
         db_table = "item"
@@ -50,6 +61,7 @@ class Restaurant(models.Model):
     name = models.CharField(max_length=255)
     type = models.CharField(max_length=100)
     location = models.CharField(max_length=255)
+    quarter = models.CharField(max_length=255)
     class Meta:
         managed = False
         db_table = "restaurant"
@@ -109,4 +121,140 @@ class PriceReport(models.Model):
     def __str__(self):
         return self.item_id.name + " - " + str(self.price)
 
-    
\ No newline at end of file
+    
+
+class PriceStats(models.Model):
+    # Aggregates of the price rows of one item in one restaurant, kept
+    # current by restorang_app.price_stats. Lives in the local database.
+    id = models.BigAutoField(primary_key=True)
+    item_id = models.IntegerField()
+    rest_id = models.IntegerField()
+    latest_price_id = models.IntegerField()
+    latest_value = models.DecimalField(max_digits=10, decimal_places=2)
+    latest_date = models.DateField()
+    last_changed = models.DateField()
+    min_value = models.DecimalField(max_digits=10, decimal_places=2)
+    max_value = models.DecimalField(max_digits=10, decimal_places=2)
+    total = models.DecimalField(max_digits=16, decimal_places=2)
+    count = models.IntegerField()
+
+    class Meta:
+        db_table = "price_stats"
+        constraints = [
+            models.UniqueConstraint(fields=["item_id", "rest_id"], name="price_stats_item_rest"),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id}@{self.rest_id} - {self.latest_value}"
+
+
+class PriceStatsScope(models.Model):
+    # A restaurant or item all of whose PriceStats pairs were computed in
+    # one read of its prices, so a read of it needs no fallback. Lives in
+    # the local database.
+    id = models.BigAutoField(primary_key=True)
+    column = models.CharField(max_length=8)
+    value = models.IntegerField()
+
+    class Meta:
+        db_table = "price_stats_scope"
+        constraints = [
+            models.UniqueConstraint(fields=["column", "value"], name="price_stats_scope_column_value"),
+        ]
+
+    def __str__(self):
+        return f"{self.column}={self.value}"
+
+
+class PriceRollup(models.Model):
+    # Open, close, min, max and sum of the prices of one item per time
+    # bucket, per restaurant or per source, kept current by
+    # restorang_app.rollups. Lives in the local database.
+    id = models.BigAutoField(primary_key=True)
+    item_id = models.IntegerField()
+    resolution = models.CharField(max_length=8)
+    dimension = models.CharField(max_length=8)
+    series = models.CharField(max_length=255)
+    bucket = models.DateField()
+    open_price_id = models.IntegerField()
+    open_date = models.DateField()
+    open_value = models.DecimalField(max_digits=10, decimal_places=2)
+    close_price_id = models.IntegerField()
+    close_date = models.DateField()
+    close_value = models.DecimalField(max_digits=10, decimal_places=2)
+    min_value = models.DecimalField(max_digits=10, decimal_places=2)
+    max_value = models.DecimalField(max_digits=10, decimal_places=2)
+    total = models.DecimalField(max_digits=16, decimal_places=2)
+    count = models.IntegerField()
+
+    class Meta:
+        db_table = "price_rollup"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["item_id", "resolution", "dimension", "series", "bucket"], name="price_rollup_bucket",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} {self.resolution} {self.dimension}={self.series} {self.bucket}"
+
+
+class RestaurantLocation(models.Model):
+    # Geocoded coordinates of a restaurant's address, filled by
+    # manage.py geocode_restaurants and served by restorang_app.geo.
+    # Lives in the local database.
+    rest_id = models.IntegerField(primary_key=True)
+    address = models.CharField(max_length=255)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    status = models.CharField(max_length=32)
+    geocoded_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "restaurant_location"
+
+    def __str__(self):
+        return f"{self.rest_id} - {self.address} ({self.latitude}, {self.longitude})"
+
+
+class QueuedPriceReport(models.Model):
+    # A submitted price report waiting to be written to pricereport by
+    # restorang_app.reports; deleted once written. Lives in the local
+    # database.
+    id = models.BigAutoField(primary_key=True)
+    payload = models.JSONField()
+    state = models.CharField(max_length=8, default="pending")
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    enqueued_at = models.DateTimeField()
+    available_at = models.DateTimeField()
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "price_report_queue"
+        indexes = [
+            models.Index(fields=["state", "available_at"], name="price_report_queue_due"),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.state} - {self.payload}"
+
+
+class ReplicaTable(models.Model):
+    # Sync state of one table of the local read replica
+    # (restorang_app/replica.py). Lives in the replica database next to
+    # the copied rows, which replica.ensure_schema creates.
+    table = models.CharField(max_length=64, primary_key=True)
+    high_water = models.BigIntegerField(null=True)
+    high_water_date = models.DateField(null=True)
+    rows = models.BigIntegerField(default=0)
+    synced_at = models.DateTimeField(null=True)
+    full_synced_at = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = "replica_table"
+
+    def __str__(self):
+        return f"{self.table} @ {self.high_water}"
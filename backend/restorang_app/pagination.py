@@ -0,0 +1,68 @@
+"""Keyset pagination for the list endpoints.
+
+Clients pass ``limit`` and the opaque ``cursor`` returned as
+``next_cursor`` by the previous page. The cursor holds the sort key of the
+last row sent, and the next page starts right after it, so every page is
+one indexed range read no matter how deep the client pages.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def _iso_date(value):
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+# sort key of each paginated table: column -> parser for cursor values
+RESTAURANT_KEY = {'rest_id': int}
+PRICE_KEY = {'date': _iso_date, 'price_id': int}
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, dict) or set(values) != set(key):
+            raise ValueError
+        return {column: parse(values[column]) for column, parse in key.items()}
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+
+
+def page_params(request, key):
+    """Return ``(limit, after)`` from the request; `after` is None on page one."""
+    default = getattr(settings, 'RESTORANG_PAGE_SIZE', 100)
+    maximum = getattr(settings, 'RESTORANG_MAX_PAGE_SIZE', 1000)
+    try:
+        limit = int(request.GET.get('limit') or request.POST.get('limit') or default)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise PaginationError("limit must be a positive integer")
+    cursor = request.GET.get('cursor') or request.POST.get('cursor')
+    after = decode_cursor(cursor, key) if cursor else None
+    return min(limit, maximum), after
+
+
+def page(rows, limit, key):
+    """Split off the look-ahead row fetched past `limit`.
+
+    Repositories are asked for ``limit + 1`` rows; if the extra row came
+    back there is another page, and its cursor is the key of the last row
+    that is sent.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor({column: rows[-1][column] for column in key})
@@ -0,0 +1,328 @@
+"""Every price in memory as NumPy columns.
+
+`PriceColumns` holds the price table as parallel arrays in `price_id`
+order - ``item_id``, ``rest_id`` and the item's ``category_id`` as int32,
+``day`` as days since 1970-01-01 (int32) and ``cents`` as int64 - 32
+bytes per price instead of a dict of Python objects per row. Sorted
+indexes on item and restaurant (`rows_for`, 4 bytes per price each) give
+the positions of the prices of a few items or restaurants without a
+scan. The analytics in analytics.py are computed on these arrays.
+
+The store is built on first use with one paged read of the prices and
+items, follows the price and item writes made through the repository
+(new prices are appended in batches, changed values set in place) and is
+rebuilt every ``RESTORANG_ANALYTICS['REFRESH']`` seconds - or soon after
+a write it can not apply in place, such as a delete or an upsert. Writes
+made while a build pages through the tables are kept and applied to the
+new store before it replaces the old one.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+
+from .models import Category, Item, Price
+from .repository import get_repository
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+NO_CATEGORY = -1
+# rows converted per step of a build, so that only one page of dicts is held
+CHUNK_SIZE = 10000
+
+
+def days(dates):
+    """Days since 1970-01-01 of ISO `dates` (strings or dates)."""
+    return np.array([str(date)[:10] for date in dates], dtype='datetime64[D]').astype(np.int32)
+
+
+def cents(values):
+    return np.rint(np.asarray(values, dtype=float) * 100).astype(np.int64)
+
+
+class Index:
+    """Positions of the rows per key of one column, for the keys in order."""
+
+    def __init__(self, column):
+        self.order = np.argsort(column, kind='stable').astype(np.int32)
+        self.keys, self.starts = np.unique(column[self.order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(column))
+
+    def rows(self, keys):
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64)
+        found = np.searchsorted(self.keys, keys)
+        found = found[(found < len(self.keys)) & (self.keys[np.minimum(found, len(self.keys) - 1)] == keys)]
+        if not len(found):
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate([self.order[self.starts[i]:self.ends[i]] for i in found]))
+
+
+class PriceColumns:
+    def __init__(self, price_id, item_id, rest_id, day, cents, item_category, category_names=None):
+        self.price_id = price_id
+        self.item_id = item_id
+        self.rest_id = rest_id
+        self.day = day
+        self.cents = cents
+        # item_id -> category_id
+        self.item_category = item_category
+        self.category_names = category_names or {}
+        self.category_id = self._categories(item_id)
+        self._pending = []
+        self.lock = threading.Lock()
+        self._index()
+
+    @classmethod
+    def from_rows(cls, rows, items, category_names=None):
+        """A store of the price `rows` and the `items` they belong to."""
+        parts = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == CHUNK_SIZE:
+                parts.append(_columns(chunk))
+                chunk = []
+        if chunk or not parts:
+            parts.append(_columns(chunk))
+        columns = [np.concatenate(column) for column in zip(*parts)]
+        order = np.argsort(columns[0], kind='stable')
+        item_category = {item['item_id']: item.get('category_id') for item in items}
+        return cls(*(column[order] for column in columns), item_category, category_names)
+
+    def __len__(self):
+        return len(self.price_id)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in (
+            self.price_id, self.item_id, self.rest_id, self.category_id, self.day, self.cents,
+            self.by_item.order, self.by_item.keys, self.by_item.starts, self.by_item.ends,
+            self.by_rest.order, self.by_rest.keys, self.by_rest.starts, self.by_rest.ends,
+        ))
+
+    def _categories(self, item_id):
+        keys = np.fromiter(self.item_category, dtype=np.int32, count=len(self.item_category))
+        values = np.fromiter(
+            (NO_CATEGORY if category is None else category for category in self.item_category.values()),
+            dtype=np.int32, count=len(self.item_category),
+        )
+        if not len(keys):
+            return np.full(len(item_id), NO_CATEGORY, dtype=np.int32)
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        found = np.minimum(np.searchsorted(keys, item_id), len(keys) - 1)
+        return np.where(keys[found] == item_id, values[found], NO_CATEGORY).astype(np.int32)
+
+    def _index(self):
+        self.by_item = Index(self.item_id)
+        self.by_rest = Index(self.rest_id)
+
+    def rows_for(self, item_ids=None, rest_ids=None):
+        """Positions of the prices of `item_ids` and of `rest_ids` (both
+        when both are given), or None for every price."""
+        rows = None
+        if item_ids is not None:
+            rows = self.by_item.rows(np.asarray(item_ids, dtype=np.int32))
+        if rest_ids is not None:
+            found = self.by_rest.rows(np.asarray(rest_ids, dtype=np.int32))
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        return rows
+
+    # -- writes ---------------------------------------------------------
+
+    def append(self, rows):
+        """Queue new price rows; they join the columns on the next `merge`."""
+        self._pending.extend(rows)
+
+    def merge(self):
+        """Add the queued rows; call with `lock` held."""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        price_id, item_id, rest_id, day, value = _columns(rows)
+        # a price written during a build may be in the pages read too
+        new = ~np.isin(price_id, self.price_id)
+        price_id, item_id, rest_id, day, value = (column[new] for column in (price_id, item_id, rest_id, day, value))
+        self.price_id = np.concatenate((self.price_id, price_id))
+        self.item_id = np.concatenate((self.item_id, item_id))
+        self.rest_id = np.concatenate((self.rest_id, rest_id))
+        self.day = np.concatenate((self.day, day))
+        self.cents = np.concatenate((self.cents, value))
+        self.category_id = np.concatenate((self.category_id, self._categories(item_id)))
+        if (np.diff(self.price_id) < 0).any():
+            order = np.argsort(self.price_id, kind='stable')
+            for name in ('price_id', 'item_id', 'rest_id', 'day', 'cents', 'category_id'):
+                setattr(self, name, getattr(self, name)[order])
+        self._index()
+
+    def update(self, rows):
+        """Set the values and dates of existing prices; returns False when
+        a row is not in the store."""
+        self.merge()
+        price_id = np.fromiter((row['price_id'] for row in rows), dtype=np.int64, count=len(rows))
+        found = np.searchsorted(self.price_id, price_id)
+        if (found >= len(self.price_id)).any() or (self.price_id[found] != price_id).any():
+            return False
+        self.cents[found] = cents([row['value'] for row in rows])
+        self.day[found] = days([row['date'] for row in rows])
+        return True
+
+    def set_category(self, item_id, category_id):
+        self.item_category[item_id] = category_id
+        rows = self.by_item.rows(np.asarray([item_id], dtype=np.int32))
+        self.category_id[rows] = NO_CATEGORY if category_id is None else category_id
+
+
+def _columns(rows):
+    count = len(rows)
+    return (
+        np.fromiter((row['price_id'] for row in rows), dtype=np.int64, count=count),
+        np.fromiter((row['item_id'] for row in rows), dtype=np.int32, count=count),
+        np.fromiter((row['rest_id'] for row in rows), dtype=np.int32, count=count),
+        days([row['date'] for row in rows]),
+        cents([row['value'] for row in rows]),
+    )
+
+
+def build(repository=None):
+    repository = repository or get_repository()
+    items = list(repository.iter_items())
+    store = PriceColumns.from_rows(repository.iter_prices(), items)
+    category_ids = sorted({category for category in store.item_category.values() if category is not None})
+    store.category_names = repository.category_names(category_ids) if category_ids else {}
+    return store
+
+
+_store = None
+_built_at = 0.0
+_state_lock = threading.Lock()
+_refreshing = False
+# (apply, action, rows) of the writes made while a build runs
+_missed = None
+_writes_lock = threading.Lock()
+
+
+def _swap_in():
+    """Build a store and make it the current one, with the writes made
+    meanwhile applied."""
+    global _store, _built_at, _missed
+    with _writes_lock:
+        _missed = []
+    try:
+        store = build()
+    except Exception:
+        with _writes_lock:
+            _missed = None
+        raise
+    with _writes_lock:
+        missed, _missed = _missed, None
+        _store, _built_at = store, time.monotonic()
+        with store.lock:
+            for apply, action, rows in missed:
+                apply(store, action, rows)
+
+
+def _rebuild():
+    global _built_at, _refreshing
+    try:
+        _swap_in()
+    except Exception:
+        # keep serving the old store until the next interval
+        logger.exception("Error rebuilding the price columns")
+        _built_at = time.monotonic()
+    finally:
+        _refreshing = False
+
+
+def get_store():
+    """The current store, with the queued prices merged; built on first
+    use, refreshed in the background."""
+    global _refreshing
+    if _store is None:
+        with _state_lock:
+            if _store is None:
+                _swap_in()
+    elif time.monotonic() - _built_at > settings.RESTORANG_ANALYTICS['REFRESH'] and not _refreshing:
+        with _state_lock:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_rebuild, daemon=True).start()
+    store = _store
+    with store.lock:
+        store.merge()
+    return store
+
+
+async def aensure():
+    """Build the store off the event loop if it does not exist yet."""
+    if _store is None:
+        await sync_to_async(get_store)()
+
+
+def reset():
+    global _store
+    with _state_lock:
+        _store = None
+
+
+def _stale():
+    global _built_at
+    # rebuilt in the background on the next read
+    _built_at = 0.0
+
+
+def _follow(apply, action, rows):
+    with _writes_lock:
+        if _missed is not None:
+            _missed.append((apply, action, rows))
+        store = _store
+    if store is not None:
+        with store.lock:
+            apply(store, action, rows)
+
+
+def _apply_prices(store, action, rows):
+    if not rows:
+        return
+    if action == "insert" and all(row.get('price_id') is not None for row in rows):
+        store.append(rows)
+    elif action != "update" or not store.update(rows):
+        _stale()
+
+
+def _apply_items(store, action, rows):
+    for row in rows or []:
+        if action == "delete":
+            store.item_category.pop(row['item_id'], None)
+        elif 'category_id' in row and store.item_category.get(row['item_id'], NO_CATEGORY) != row['category_id']:
+            store.merge()
+            store.set_category(row['item_id'], row['category_id'])
+
+
+def _apply_categories(store, action, rows):
+    for row in rows or []:
+        if action == "delete":
+            store.category_names.pop(row['category_id'], None)
+        else:
+            store.category_names[row['category_id']] = row.get('name')
+
+
+@receiver(table_changed, sender=Price)
+def _update_prices(sender, action, rows, **kwargs):
+    _follow(_apply_prices, action, rows)
+
+
+@receiver(table_changed, sender=Item)
+def _update_items(sender, action, rows, **kwargs):
+    _follow(_apply_items, action, rows)
+
+
+@receiver(table_changed, sender=Category)
+def _update_categories(sender, action, rows, **kwargs):
+    _follow(_apply_categories, action, rows)
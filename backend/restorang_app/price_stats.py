@@ -0,0 +1,186 @@
+"""Precomputed price statistics per item and restaurant.
+
+`PriceStats` holds the latest value, min, max, mean, count and the date
+the price last changed for every (item_id, rest_id) pair, so clients can
+show a summary without downloading the price history.
+
+The store follows the writes made through the repository (`table_changed`):
+inserting a price newer than the current latest one is folded in
+directly, any other write recomputes the pair from its price rows.
+``manage.py rebuild_price_stats`` fills the store up front. A write only
+computes the pairs it touched, so `PriceStatsScope` records the
+restaurants and items whose pairs were all computed at once; a read of
+any other restaurant or item computes it first.
+"""
+import datetime
+import logging
+from decimal import Decimal
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+
+from .models import Price, PriceStats, PriceStatsScope
+from .repository import get_repository
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('item_id', 'rest_id')
+UPDATE_FIELDS = [
+    'latest_price_id', 'latest_value', 'latest_date', 'last_changed',
+    'min_value', 'max_value', 'total', 'count',
+]
+
+
+def _date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _order(row):
+    return (_date(row['date']), row['price_id'])
+
+
+def _fold(stats, row):
+    """Add `row`, which must be newer than every row already in `stats`."""
+    value = Decimal(str(row['value']))
+    date = _date(row['date'])
+    if stats is None:
+        return PriceStats(
+            item_id=row['item_id'], rest_id=row['rest_id'],
+            latest_price_id=row['price_id'], latest_value=value, latest_date=date, last_changed=date,
+            min_value=value, max_value=value, total=value, count=1,
+        )
+    if value != stats.latest_value:
+        stats.last_changed = date
+    stats.latest_price_id = row['price_id']
+    stats.latest_value = value
+    stats.latest_date = date
+    stats.min_value = min(stats.min_value, value)
+    stats.max_value = max(stats.max_value, value)
+    stats.total += value
+    stats.count += 1
+    return stats
+
+
+def aggregate(rows):
+    """Unsaved `PriceStats` for price `rows`, keyed by (item_id, rest_id)."""
+    pairs = {}
+    for row in rows:
+        pairs.setdefault((row['item_id'], row['rest_id']), []).append(row)
+    result = {}
+    for key, pair_rows in pairs.items():
+        stats = None
+        for row in sorted(pair_rows, key=_order):
+            stats = _fold(stats, row)
+        result[key] = stats
+    return result
+
+
+def save(stats):
+    PriceStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['item_id', 'rest_id'], update_fields=UPDATE_FIELDS,
+    )
+
+
+def compute(repository=None, **filters):
+    """Recompute and store the stats of the prices matching `filters`.
+
+    `filters` are those of `Repository.iter_prices`; every price of a pair
+    must match them, so filter by item and/or restaurant only.
+    """
+    repository = repository or get_repository()
+    stats = list(aggregate(repository.iter_prices(**filters)).values())
+    with transaction.atomic():
+        PriceStats.objects.filter(**filters).delete()
+        save(stats)
+        if len(filters) == 1 and next(iter(filters)) in SCOPES:
+            [(column, value)] = filters.items()
+            PriceStatsScope.objects.get_or_create(column=column, value=value)
+    return stats
+
+
+def refresh(item_id, rest_id):
+    compute(item_id=item_id, rest_id=rest_id)
+
+
+def apply_inserts(item_id, rest_id, rows):
+    with transaction.atomic():
+        stats = PriceStats.objects.select_for_update().filter(item_id=item_id, rest_id=rest_id).first()
+        rows = sorted(rows, key=_order)
+        if stats is None or _order(rows[0]) <= (stats.latest_date, stats.latest_price_id):
+            # first price of the pair or a back-dated one: the fold does
+            # not apply, read the pair's history instead
+            stats = None
+        else:
+            for row in rows:
+                _fold(stats, row)
+            stats.save()
+    if stats is None:
+        refresh(item_id, rest_id)
+
+
+def as_dict(stats):
+    return {
+        "item_id": stats.item_id,
+        "rest_id": stats.rest_id,
+        "latest_value": float(stats.latest_value),
+        "latest_date": stats.latest_date.isoformat(),
+        "last_changed": stats.last_changed.isoformat(),
+        "min_value": float(stats.min_value),
+        "max_value": float(stats.max_value),
+        "mean_value": round(float(stats.total / stats.count), 2),
+        "count": stats.count,
+    }
+
+
+def stats_for(item_id=None, rest_id=None):
+    filters = {name: value for name, value in (('item_id', item_id), ('rest_id', rest_id)) if value is not None}
+    if len(filters) == 1:
+        # the stored pairs may be only those written since
+        [(column, value)] = filters.items()
+        complete = PriceStatsScope.objects.filter(column=column, value=value).exists()
+    else:
+        complete = True
+    stats = list(PriceStats.objects.filter(**filters).order_by('item_id', 'rest_id')) if complete else []
+    if not stats:
+        stats = sorted(compute(**filters), key=lambda s: (s.item_id, s.rest_id))
+    return [as_dict(s) for s in stats]
+
+
+def _drop(rest_id, item_ids):
+    try:
+        with transaction.atomic():
+            PriceStats.objects.filter(rest_id=rest_id, item_id__in=item_ids).delete()
+            PriceStatsScope.objects.filter(
+                Q(column='rest_id', value=rest_id) | Q(column='item_id', value__in=item_ids)
+            ).delete()
+    except DatabaseError:
+        logger.exception("Error dropping price stats")
+
+
+@receiver(table_changed, sender=Price)
+def _update_on_write(sender, action, rows, **kwargs):
+    pairs = {}
+    for row in rows or []:
+        pairs.setdefault((row['item_id'], row['rest_id']), []).append(row)
+    restaurants = {}
+    for item_id, rest_id in pairs:
+        restaurants.setdefault(rest_id, []).append(item_id)
+    for rest_id, item_ids in restaurants.items():
+        try:
+            if action == "insert":
+                for item_id in item_ids:
+                    apply_inserts(item_id, rest_id, pairs[item_id, rest_id])
+            elif len(item_ids) > 1:
+                # a bulk write: read the restaurant's prices once
+                compute(rest_id=rest_id)
+            else:
+                refresh(item_ids[0], rest_id)
+        except Exception:
+            # the prices themselves were written; stale summaries are
+            # dropped so that they are recomputed on the next read
+            logger.exception("Error updating price stats")
+            _drop(rest_id, item_ids)
@@ -0,0 +1,560 @@
+"""Local read replica of the upstream restaurant, item, category and price tables.
+
+The replica is a SQLite database (``DATABASES['replica']``) with the four
+tables the read endpoints use, in the schema of the unmanaged models, and
+the sync state of each in `ReplicaTable`. `sync` keeps it current:
+
+* a table never synced (or every table, with ``full=True``) is copied
+  whole in one transaction, so readers see the previous copy until it
+  commits;
+* restaurant, item and category are small and are compared whole with
+  the upstream on every sync, which picks up updated and deleted rows;
+* of the prices, the rows past the primary key high-water mark are added
+  and the prices dated up to ``PRICE_OVERLAP_DAYS`` before the newest
+  synced date are read again, to pick up values replaced by upserts; the
+  whole table is compared every ``FULL_REFRESH`` seconds, which picks up
+  older updates and deletes.
+
+Rows a sync changed in a table copied before are sent as `table_changed`
+(origin ``"replica"``) so the caches and the derived stores follow. Writes
+made through this app and changes received on the change feed
+(changefeed.py) are applied to the replica as they happen.
+
+With ``RESTORANG_DATA_BACKEND = "replica"`` the views read through
+`ReplicaRepository`: from the replica while it is at most
+``MAX_STALENESS`` seconds behind, from the upstream otherwise, and from
+the replica again - stale - when the upstream read fails. Writes go
+upstream. How far behind the replica is counts from the last sync that
+saw every kind of change of each table: any sync for the small tables,
+but for the prices only the last whole comparison - unless the change
+feed follows the price table and brings the other changes in as they
+happen (`lag`).
+
+The replica file outlives the process, so a new process serves from it
+at once. It is synced by ``manage.py sync_replica --loop``, or with
+``SYNC_IN_PROCESS`` by a thread of every process serving requests
+(`start`).
+"""
+import datetime
+import functools
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, instrumentation
+from .models import Category, Item, Price, ReplicaTable, Restaurant
+from .repository import PRICE_NATURAL_KEY, OrmRepository, Repository, SupabaseRepository, _plain
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+ALIAS = 'replica'
+# parents first
+MODELS = (Category, Restaurant, Item, Price)
+# copied whole every FULL_REFRESH seconds
+SMALL = (Category, Restaurant, Item)
+BATCH_SIZE = 1000
+# seconds the sync state read from the replica is reused
+STATE_TTL = 1.0
+
+# repository reads answered from the replica; everything else goes upstream
+LOCAL_READS = frozenset((
+    'restaurants', 'restaurant', 'find_restaurants', 'restaurants_page', 'restaurants_named',
+    'restaurant_types', 'items_for_restaurant', 'items_page', 'categories', 'category_names',
+    'search_items_with_prices', 'prices_for_items', 'price_history', 'price_history_page',
+    'prices_page', 'price_values',
+))
+
+
+class ReplicaRouter:
+    """Keeps migrations off the replica database; `ensure_schema` creates its tables."""
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == ALIAS:
+            return False
+        return None
+
+
+def _objects(model):
+    return model.objects.using(ALIAS)
+
+
+def _fields(model):
+    return model._meta.concrete_fields
+
+
+def _instance(model, row):
+    return model(**{field.attname: row[field.column] for field in _fields(model) if field.column in row})
+
+
+def _normal(model, row):
+    # upstream rows and replica rows compare equal when they hold the same values
+    return tuple(_plain(field.to_python(row.get(field.column))) for field in _fields(model))
+
+
+def ensure_schema():
+    """Create the replica tables that do not exist yet."""
+    connection = connections[ALIAS]
+    existing = set(connection.introspection.table_names())
+    missing = [model for model in (*MODELS, ReplicaTable) if model._meta.db_table not in existing]
+    if not missing:
+        return
+    with connection.cursor() as cursor:
+        # readers do not wait for the sync to commit
+        cursor.execute("PRAGMA journal_mode = WAL")
+    # the copy is not checked against the foreign keys, the upstream is;
+    # users are not copied at all
+    relations = [field for model in missing for field in _fields(model) if field.remote_field]
+    for field in relations:
+        field.db_constraint = False
+    try:
+        with connection.schema_editor() as editor:
+            for model in missing:
+                editor.create_model(model)
+    finally:
+        for field in relations:
+            field.db_constraint = True
+
+
+# -- writing rows ----------------------------------------------------------
+
+def _truncate(model):
+    connection = connections[ALIAS]
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s" % connection.ops.quote_name(model._meta.db_table))
+
+
+def _delete(model, keys):
+    connection = connections[ALIAS]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    keys = list(keys)
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), BATCH_SIZE):
+            chunk = keys[start:start + BATCH_SIZE]
+            cursor.execute(
+                "DELETE FROM %s WHERE %s IN (%s)" % (table, column, ", ".join(["%s"] * len(chunk))), chunk
+            )
+
+
+def _clear_natural_keys(rows):
+    # an upstream delete followed by an insert of the same item,
+    # restaurant and date would otherwise break the unique index
+    keys = {tuple(str(row[column]) for column in PRICE_NATURAL_KEY): row['price_id'] for row in rows}
+    stale = [
+        price_id for price_id, *key in _objects(Price).filter(
+            item_id__in={row['item_id'] for row in rows}, date__in={row['date'] for row in rows}
+        ).values_list('price_id', *PRICE_NATURAL_KEY)
+        if keys.get(tuple(map(str, (key[0], key[1], _plain(key[2]))))) not in (None, price_id)
+    ]
+    if stale:
+        _delete(Price, stale)
+
+
+def apply(model, rows):
+    """Write `rows` into the replica; returns ``(inserted, updated)``, the
+    rows that were missing and the rows that differed."""
+    key = model._meta.pk.column
+    rows = [row for row in rows if row.get(key) is not None]
+    if not rows:
+        return [], []
+    existing = {
+        row[key]: _normal(model, row)
+        for row in _objects(model).filter(pk__in=[row[key] for row in rows]).values(*(f.column for f in _fields(model)))
+    }
+    inserted, updated = [], []
+    for row in rows:
+        known = existing.get(int(row[key]))
+        if known is None:
+            inserted.append(row)
+        elif known != _normal(model, row):
+            updated.append(row)
+    changed = inserted + updated
+    if changed:
+        if model is Price and inserted:
+            _clear_natural_keys(inserted)
+        _objects(model).bulk_create(
+            [_instance(model, row) for row in changed], batch_size=BATCH_SIZE,
+            update_conflicts=True, unique_fields=[model._meta.pk.name],
+            update_fields=[field.name for field in _fields(model) if not field.primary_key],
+        )
+    return inserted, updated
+
+
+# -- reading the upstream --------------------------------------------------
+
+def _upstream_rows(repository, model, after=None, **filters):
+    """Upstream rows of `model` in primary key order, after the `after` key."""
+    if model is Category:
+        return (row for row in repository.categories() if after is None or row['category_id'] > after)
+    if model is Restaurant:
+        return repository.iter_restaurants(BATCH_SIZE, after)
+    if model is Item:
+        return repository.iter_items(BATCH_SIZE, after)
+    return repository.iter_prices(BATCH_SIZE, after, **filters)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _latest_date(rows, latest=None):
+    for row in rows:
+        date = datetime.date.fromisoformat(str(row['date'])[:10])
+        if latest is None or date > latest:
+            latest = date
+    return latest
+
+
+def _state(model):
+    state, _ = ReplicaTable.objects.using(ALIAS).get_or_create(table=model._meta.db_table)
+    return state
+
+
+def copy(model, repository, rebuild=False, notify=False):
+    """Copy the whole table; returns how many rows changed. With `notify`
+    the changed rows are sent as `table_changed`."""
+    state = _state(model)
+    key = model._meta.pk.column
+    changed = 0
+    seen = set()
+    high_water = None
+    latest = None
+    with transaction.atomic(using=ALIAS):
+        if rebuild:
+            _truncate(model)
+        for batch in _batches(_upstream_rows(repository, model)):
+            inserted, updated = apply(model, batch)
+            if notify:
+                _changed(model, inserted, updated)
+            changed += len(inserted) + len(updated)
+            seen.update(row[key] for row in batch)
+            high_water = max(high_water or 0, batch[-1][key])
+            if model is Price:
+                latest = _latest_date(batch, latest)
+        gone = set(_objects(model).values_list('pk', flat=True)) - seen
+        if gone:
+            _delete(model, gone)
+            changed += len(gone)
+            if notify:
+                table_changed.send(
+                    sender=model, action="delete", rows=[{key: pk} for pk in sorted(gone)], origin="replica"
+                )
+        now = timezone.now()
+        state.high_water = high_water
+        state.high_water_date = latest
+        state.rows = len(seen)
+        state.synced_at = state.full_synced_at = now
+        state.save(using=ALIAS)
+    if changed and not notify:
+        cache.invalidate(model._meta.db_table)
+    instrumentation.REPLICA_ROWS_SYNCED.inc(changed, table=model._meta.db_table, kind="full")
+    return changed
+
+
+def _changed(model, inserted, updated):
+    table = model._meta.db_table
+    if inserted:
+        table_changed.send(sender=model, action="insert", rows=inserted, origin="replica")
+    if updated:
+        table_changed.send(sender=model, action="update", rows=updated, origin="replica")
+    instrumentation.REPLICA_ROWS_SYNCED.inc(len(inserted) + len(updated), table=table, kind="incremental")
+
+
+def catch_up(model, repository):
+    """Add the rows past the high-water mark (and re-read the recent
+    prices); returns how many rows changed."""
+    state = _state(model)
+    key = model._meta.pk.column
+    changed = 0
+    reads = [_upstream_rows(repository, model, state.high_water)]
+    if model is Price and state.high_water_date:
+        since = state.high_water_date - datetime.timedelta(days=settings.RESTORANG_REPLICA['PRICE_OVERLAP_DAYS'])
+        reads.append(_upstream_rows(repository, model, date_from=since.isoformat()))
+    for rows in reads:
+        for batch in _batches(rows):
+            inserted, updated = apply(model, batch)
+            _changed(model, inserted, updated)
+            changed += len(inserted) + len(updated)
+            state.rows += len(inserted)
+            state.high_water = max(state.high_water or 0, max(row[key] for row in batch))
+            if model is Price:
+                state.high_water_date = _latest_date(batch, state.high_water_date)
+    state.synced_at = timezone.now()
+    state.save(using=ALIAS)
+    return changed
+
+
+def sync(repository=None, full=False):
+    """Bring the replica up to date; returns ``{table: rows changed}``."""
+    repository = repository or _upstream()
+    options = settings.RESTORANG_REPLICA
+    ensure_schema()
+    states = {state.table: state for state in ReplicaTable.objects.using(ALIAS).all()}
+    now = timezone.now()
+    changed = {}
+    for model in MODELS:
+        table = model._meta.db_table
+        state = states.get(table)
+        started = time.perf_counter()
+        copied = state is not None and state.full_synced_at is not None
+        if full or not copied:
+            changed[table] = copy(model, repository, rebuild=full)
+        elif model in SMALL or (now - state.full_synced_at).total_seconds() > options['FULL_REFRESH']:
+            changed[table] = copy(model, repository, notify=True)
+        else:
+            changed[table] = catch_up(model, repository)
+        instrumentation.REPLICA_SYNC_SECONDS.observe(time.perf_counter() - started, table=table)
+    _forget_state()
+    return changed
+
+
+def verify(repository=None):
+    """Compare the replica with the upstream row by row; returns
+    ``{table: {"rows", "missing", "extra", "different"}}``."""
+    repository = repository or _upstream()
+    ensure_schema()
+    report = {}
+    for model in MODELS:
+        key = model._meta.pk.column
+        local = iter(_objects(model).order_by('pk').values(*(f.column for f in _fields(model))).iterator(BATCH_SIZE))
+        counts = {"rows": 0, "missing": 0, "extra": 0, "different": 0}
+        mine = next(local, None)
+        for row in _upstream_rows(repository, model):
+            counts["rows"] += 1
+            while mine is not None and mine[key] < row[key]:
+                counts["extra"] += 1
+                mine = next(local, None)
+            if mine is None or mine[key] > row[key]:
+                counts["missing"] += 1
+                continue
+            counts["different"] += _normal(model, mine) != _normal(model, row)
+            mine = next(local, None)
+        while mine is not None:
+            counts["extra"] += 1
+            mine = next(local, None)
+        report[model._meta.db_table] = counts
+    return report
+
+
+# -- freshness -------------------------------------------------------------
+
+_synced_at = None
+_state_read_at = 0.0
+
+
+def _forget_state():
+    global _state_read_at
+    _state_read_at = 0.0
+
+
+def _followed():
+    # the change feed brings in the price updates and deletes a sync
+    # past the high-water mark does not see (deletes only with REPLICA
+    # IDENTITY FULL, see changefeed.py)
+    options = settings.RESTORANG_REALTIME
+    return options['ENABLED'] and Price._meta.db_table in options['TABLES']
+
+
+def synced_at():
+    """Until when every table is known to match the upstream: the last
+    sync of the small tables, the last whole comparison of the prices
+    (the last sync when the change feed follows them); None before every
+    table was copied once."""
+    global _synced_at, _state_read_at
+    if time.monotonic() - _state_read_at > STATE_TTL:
+        try:
+            states = list(ReplicaTable.objects.using(ALIAS).filter(
+                table__in=[model._meta.db_table for model in MODELS]
+            ))
+        except DatabaseError:
+            # no replica (yet)
+            states = []
+        times = [
+            state.full_synced_at if state.table == Price._meta.db_table and not _followed() else state.synced_at
+            for state in states
+        ]
+        _synced_at = min(times) if len(times) == len(MODELS) and None not in times else None
+        _state_read_at = time.monotonic()
+    return _synced_at
+
+
+def lag():
+    """Seconds the replica is behind; None when it was never synced."""
+    synced = synced_at()
+    return (timezone.now() - synced).total_seconds() if synced else None
+
+
+instrumentation.REPLICA_LAG.collect = lambda: {(): lag()} if lag() is not None else {}
+
+
+def stats():
+    try:
+        tables = {
+            state.table: {
+                "rows": state.rows,
+                "high_water": state.high_water,
+                "high_water_date": state.high_water_date,
+                "synced_at": state.synced_at,
+                "full_synced_at": state.full_synced_at,
+            }
+            for state in ReplicaTable.objects.using(ALIAS).order_by('table')
+        }
+    except DatabaseError:
+        tables = {}
+    return {
+        "lag": lag(),
+        "max_staleness": settings.RESTORANG_REPLICA['MAX_STALENESS'],
+        "syncing": _syncer is not None and _syncer.is_alive(),
+        "tables": tables,
+    }
+
+
+# -- the repository --------------------------------------------------------
+
+def _upstream():
+    return SupabaseRepository()
+
+
+class ReplicaRepository(Repository):
+    """Reads from the replica while it is fresh enough, everything else
+    from `upstream`."""
+
+    def __init__(self, upstream=None):
+        self.local = OrmRepository(ALIAS)
+        self.upstream = upstream or _upstream()
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('local', 'upstream'):
+            raise AttributeError(name)
+        if name in LOCAL_READS:
+            return functools.partial(self._read, name)
+        # writes, and the tables that are not copied
+        return getattr(self.upstream, name)
+
+    def _read(self, name, *args, **kwargs):
+        behind = lag()
+        if behind is not None and behind <= settings.RESTORANG_REPLICA['MAX_STALENESS']:
+            instrumentation.REPLICA_READS.inc(source="replica")
+            return getattr(self.local, name)(*args, **kwargs)
+        try:
+            rows = getattr(self.upstream, name)(*args, **kwargs)
+        except Exception:
+            if behind is None:
+                raise
+            logger.warning("Upstream read failed, %s served from the replica %.0f s behind", name, behind, exc_info=True)
+            instrumentation.REPLICA_READS.inc(source="stale")
+            return getattr(self.local, name)(*args, **kwargs)
+        instrumentation.REPLICA_READS.inc(source="upstream")
+        return rows
+
+
+# -- background sync -------------------------------------------------------
+
+class Syncer(threading.Thread):
+    """Runs `sync` every ``SYNC_INTERVAL`` seconds."""
+
+    def __init__(self, repository=None, interval=None):
+        super().__init__(name="replica-sync", daemon=True)
+        self.repository = repository
+        self.interval = interval or settings.RESTORANG_REPLICA['SYNC_INTERVAL']
+        self._stopped = threading.Event()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                try:
+                    sync(self.repository)
+                except Exception:
+                    logger.exception("Error syncing the replica")
+                    close_old_connections()
+                self._stopped.wait(self.interval)
+        finally:
+            connections[ALIAS].close()
+
+
+_syncer = None
+_lock = threading.Lock()
+
+
+def start(repository=None):
+    """The sync thread of this process, started on the first call."""
+    global _syncer
+    if _syncer is None:
+        with _lock:
+            if _syncer is None:
+                _syncer = Syncer(repository)
+                _syncer.start()
+    return _syncer
+
+
+def stop(timeout=None):
+    global _syncer
+    with _lock:
+        syncer, _syncer = _syncer, None
+    if syncer is not None:
+        syncer.stop(timeout)
+
+
+def start_on_request(sender, **kwargs):
+    # connected to request_started with SYNC_IN_PROCESS, so only processes
+    # serving requests sync, and management commands do not
+    start()
+
+
+# -- write-through ---------------------------------------------------------
+
+def _update_prices_by_key(rows):
+    # upserted prices come without their price_id; new ones wait for the sync
+    for row in rows:
+        _objects(Price).filter(**{column: row[column] for column in PRICE_NATURAL_KEY}).update(
+            value=row['value'], source=row['source'], user_id=row.get('user_id'),
+        )
+
+
+@receiver(table_changed)
+def _write_through(sender, action, rows, origin=None, **kwargs):
+    if origin == "replica" or sender not in MODELS or not rows:
+        return
+    if getattr(settings, 'RESTORANG_DATA_BACKEND', 'supabase') != 'replica' or synced_at() is None:
+        return
+    key = sender._meta.pk.column
+    try:
+        with transaction.atomic(using=ALIAS):
+            if action == "delete":
+                _delete(sender, [row[key] for row in rows if row.get(key) is not None])
+            else:
+                apply(sender, rows)
+                if sender is Price:
+                    _update_prices_by_key([row for row in rows if row.get(key) is None])
+    except Exception:
+        # the sync brings the rows in later
+        logger.exception("Error writing %s rows to the replica", sender._meta.db_table)
+
+
+def _after_fork():
+    global _syncer, _lock
+    # the thread stayed in the parent; a child starts its own
+    _syncer = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,305 @@
+"""Write-behind queue for submitted price reports.
+
+`submit` validates a report against the `PriceReport` fields, stores it in
+`QueuedPriceReport` (local database) and returns: the upstream write
+happens later, so a slow or unavailable Supabase does not slow down the
+submissions. Once ``RESTORANG_REPORTS['MAX_DEPTH']`` reports wait, new
+ones are refused with `QueueFull` until the workers catch up.
+
+Worker threads (`start_workers`; started on the first submission of a
+process, or run on their own with ``manage.py run_report_workers``) claim
+the oldest waiting reports in batches and insert each batch into
+``pricereport`` with one request. A batch the upstream rejects is split
+in halves until the offending reports are found; those, and whole
+batches that could not reach the upstream, are retried with a doubling
+delay and parked as ``failed`` after ``MAX_ATTEMPTS``. A claim not
+finished within ``CLAIM_TIMEOUT`` seconds (its process died) is taken
+over by another worker, so a report may be written twice but is never
+lost.
+
+Approved reports - submitted with ``AUTO_APPROVE`` or approved upstream
+later - are copied into ``price`` rows (source ``report``) with an upsert
+on (item, restaurant, date) and marked ``promoted``.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+
+import httpx
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import instrumentation
+from .ingest import clean
+from .models import PriceReport, QueuedPriceReport
+from .repository import PRICE_NATURAL_KEY, get_repository
+
+logger = logging.getLogger(__name__)
+
+# pricereport.status
+SUBMITTED = 'pending'
+APPROVED = 'approved'
+PROMOTED = 'promoted'
+
+# QueuedPriceReport.state
+PENDING = 'pending'
+CLAIMED = 'claimed'
+FAILED = 'failed'
+STATES = (PENDING, CLAIMED, FAILED)
+
+SOURCE = 'report'
+MAX_ERROR_LENGTH = 1000
+# seconds a client is asked to wait when the queue is full
+RETRY_AFTER = 10
+
+
+class QueueFull(Exception):
+    pass
+
+
+def depths():
+    """Queued reports per state."""
+    counts = dict(QueuedPriceReport.objects.order_by().values_list('state').annotate(count=Count('id')))
+    return {state: counts.get(state, 0) for state in STATES}
+
+
+instrumentation.REPORT_QUEUE_DEPTH.collect = lambda: {(state,): count for state, count in depths().items()}
+
+
+def submit(row):
+    """Validate and queue a price report; returns ``(entry, errors)``.
+
+    Raises `QueueFull` when ``MAX_DEPTH`` reports are waiting.
+    """
+    options = settings.RESTORANG_REPORTS
+    if isinstance(row, dict):
+        row = {**row, 'status': APPROVED if options['AUTO_APPROVE'] else SUBMITTED}
+        row.setdefault('report_date', timezone.localdate().isoformat())
+    payload, errors = clean(row, PriceReport)
+    if errors:
+        instrumentation.REPORTS_SUBMITTED.inc(outcome="invalid")
+        return None, errors
+
+    waiting = QueuedPriceReport.objects.exclude(state=FAILED).count()
+    if waiting >= options['MAX_DEPTH']:
+        instrumentation.REPORTS_SUBMITTED.inc(outcome="rejected")
+        raise QueueFull("%d price reports are waiting" % waiting)
+    now = timezone.now()
+    entry = QueuedPriceReport.objects.create(payload=payload, enqueued_at=now, available_at=now)
+    instrumentation.REPORTS_SUBMITTED.inc(outcome="queued")
+    if options['WORKERS']:
+        start_workers().wake()
+    return entry, {}
+
+
+def claim(limit):
+    """Claim up to `limit` of the oldest reports due for a write."""
+    now = timezone.now()
+    expired = now - datetime.timedelta(seconds=settings.RESTORANG_REPORTS['CLAIM_TIMEOUT'])
+    due = Q(state=PENDING, available_at__lte=now) | Q(state=CLAIMED, claimed_at__lt=expired)
+    ids = list(QueuedPriceReport.objects.filter(due).order_by('id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # `due` is checked again by the update, so reports another worker
+    # claimed in between are left to it
+    QueuedPriceReport.objects.filter(due, id__in=ids).update(state=CLAIMED, claimed_by=token, claimed_at=now)
+    return list(QueuedPriceReport.objects.filter(claimed_by=token).order_by('id'))
+
+
+def _retry(entries, error):
+    options = settings.RESTORANG_REPORTS
+    now = timezone.now()
+    for entry in entries:
+        entry.attempts += 1
+        entry.error = str(error)[:MAX_ERROR_LENGTH]
+        entry.claimed_by, entry.claimed_at = '', None
+        if entry.attempts >= options['MAX_ATTEMPTS']:
+            entry.state = FAILED
+        else:
+            entry.state = PENDING
+            delay = options['RETRY_DELAY'] * 2 ** (entry.attempts - 1)
+            entry.available_at = now + datetime.timedelta(seconds=delay)
+        instrumentation.REPORTS_WRITTEN.inc(result="failed" if entry.state == FAILED else "retried")
+    QueuedPriceReport.objects.bulk_update(
+        entries, ['attempts', 'error', 'state', 'available_at', 'claimed_by', 'claimed_at']
+    )
+    logger.warning("Writing %d price reports failed: %s", len(entries), error)
+
+
+def _write(repository, entries, written):
+    try:
+        rows = repository.insert_price_reports([entry.payload for entry in entries])
+    except httpx.TransportError as e:
+        # the upstream is unreachable, splitting the batch would not help
+        _retry(entries, e)
+        return
+    except Exception as e:
+        if len(entries) == 1:
+            _retry(entries, e)
+            return
+        middle = len(entries) // 2
+        _write(repository, entries[:middle], written)
+        _write(repository, entries[middle:], written)
+        return
+    QueuedPriceReport.objects.filter(id__in=[entry.id for entry in entries]).delete()
+    now = timezone.now()
+    for entry in entries:
+        instrumentation.REPORT_WAIT_SECONDS.observe((now - entry.enqueued_at).total_seconds())
+    instrumentation.REPORTS_WRITTEN.inc(len(entries), result="written")
+    written.extend(rows)
+
+
+def process(repository=None, batch_size=None):
+    """Write one batch of queued reports upstream; returns how many were claimed."""
+    entries = claim(batch_size or settings.RESTORANG_REPORTS['BATCH_SIZE'])
+    if not entries:
+        return 0
+    repository = repository or get_repository()
+    started = time.perf_counter()
+    written = []
+    _write(repository, entries, written)
+    instrumentation.REPORT_BATCH_SECONDS.observe(time.perf_counter() - started)
+    approved = [row for row in written if row['status'] == APPROVED]
+    if approved:
+        _promote(repository, approved)
+    return len(entries)
+
+
+def _promote(repository, reports):
+    # the upsert updates one price at most once, the latest report wins
+    prices = {}
+    for report in sorted(reports, key=lambda report: report['report_id']):
+        price = {
+            'item_id': report['item_id'],
+            'rest_id': report['rest_id'],
+            'date': report['report_date'],
+            'value': report['price'],
+            'source': SOURCE,
+            'user_id': report['user_id'],
+        }
+        prices[tuple(price[column] for column in PRICE_NATURAL_KEY)] = price
+    repository.upsert_prices(list(prices.values()))
+    repository.set_price_report_status([report['report_id'] for report in reports], PROMOTED)
+    instrumentation.REPORTS_PROMOTED.inc(len(reports))
+
+
+def promote(repository=None, batch_size=None):
+    """Copy the approved reports into price rows; returns how many were promoted."""
+    repository = repository or get_repository()
+    batch_size = batch_size or settings.RESTORANG_REPORTS['BATCH_SIZE']
+    promoted = 0
+    after = None
+    while True:
+        reports = repository.price_reports_page(batch_size, after, status=APPROVED)
+        if reports:
+            _promote(repository, reports)
+            promoted += len(reports)
+        if len(reports) < batch_size:
+            return promoted
+        after = reports[-1]['report_id']
+
+
+def drain(repository=None, batch_size=None):
+    """Write every report due now; returns how many were claimed."""
+    total = 0
+    while True:
+        claimed = process(repository, batch_size)
+        if not claimed:
+            return total
+        total += claimed
+
+
+class Workers:
+    """Threads writing the queued reports, and promoting approved ones
+    every ``PROMOTE_INTERVAL`` seconds."""
+
+    def __init__(self, count):
+        self.count = count
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._next_promotion = 0
+
+    def start(self):
+        for number in range(self.count):
+            thread = threading.Thread(target=self._run, name="report-worker-%d" % number, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def alive(self):
+        return sum(thread.is_alive() for thread in self._threads)
+
+    def _promotion_due(self):
+        interval = settings.RESTORANG_REPORTS['PROMOTE_INTERVAL']
+        with self._lock:
+            if not interval or time.monotonic() < self._next_promotion:
+                return False
+            self._next_promotion = time.monotonic() + interval
+            return True
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                claimed = 0
+                try:
+                    claimed = process()
+                    if self._promotion_due():
+                        promote()
+                except Exception:
+                    logger.exception("Error in price report worker")
+                    close_old_connections()
+                if not claimed:
+                    self._wake.wait(settings.RESTORANG_REPORTS['POLL_INTERVAL'])
+                    self._wake.clear()
+        finally:
+            connection.close()
+
+
+_workers = None
+_lock = threading.Lock()
+
+
+def start_workers(count=None):
+    """The worker threads of this process, started on the first call."""
+    global _workers
+    if _workers is None:
+        with _lock:
+            if _workers is None:
+                _workers = Workers(count or settings.RESTORANG_REPORTS['WORKERS']).start()
+    return _workers
+
+
+def stats():
+    return {
+        "depth": depths(),
+        "max_depth": settings.RESTORANG_REPORTS['MAX_DEPTH'],
+        "workers": _workers.alive() if _workers is not None else 0,
+    }
+
+
+def _after_fork():
+    global _workers, _lock
+    # the threads stayed in the parent; a child starts its own
+    _workers = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
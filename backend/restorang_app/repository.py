@@ -0,0 +1,576 @@
+"""Data access for the restorang views.
+
+Views and helpers read and write through a repository instead of talking
+to Supabase directly. Three interchangeable backends exist, picked by
+``settings.RESTORANG_DATA_BACKEND``:
+
+* ``supabase`` - the PostgREST HTTP API through the client from
+  ``restorang.clients``
+* ``orm`` - the unmanaged models in ``models.py`` over a direct database
+  connection (``settings.RESTORANG_ORM_DATABASE``)
+* ``replica`` - reads of the copied tables from the local copy kept by
+  ``replica.py`` while it is at most ``RESTORANG_REPLICA['MAX_STALENESS']``
+  seconds behind; from ``supabase`` once it is further behind, and from
+  the stale copy again when that read fails. Writes and the tables that
+  are not copied always go to ``supabase``.
+
+All of them return rows as plain dicts shaped like PostgREST rows, so the
+JSON produced by the views does not depend on the backend. The async views
+use ``get_async_repository()``, which has the same read methods as
+coroutines.
+"""
+import asyncio
+import datetime
+import weakref
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q
+from restorang import clients
+from restorang.supabase_client import abuild_client
+
+from .models import Category, Item, Price, PriceReport, Restaurant
+from .signals import table_changed
+
+# PostgREST caps every response (1000 rows on Supabase by default), so bulk
+# reads are paged, and long id lists are split over several `in` filters
+# to keep the query string short.
+PAGE_SIZE = 1000
+ID_CHUNK_SIZE = 500
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class Repository:
+    """Operations shared by both backends; writes notify `table_changed`."""
+
+    def insert_price(self, row):
+        rows = self._insert_price(row)
+        table_changed.send(sender=Price, action="insert", rows=rows)
+        return rows
+
+    def update_price(self, price_id, value):
+        rows = self._update_price(price_id, value)
+        table_changed.send(sender=Price, action="update", rows=rows)
+        return rows
+
+    def upsert_prices(self, rows, notify=True):
+        """Write `rows`, replacing prices with the same item, restaurant and date.
+
+        Rows without a `price_id` get one from the database. Needs a unique
+        index on ``price (item_id, rest_id, date)``. With `notify` off no
+        `table_changed` is sent; a caller writing one batch in several
+        calls sends it once for the batch.
+        """
+        self._upsert_prices(rows)
+        if notify:
+            table_changed.send(sender=Price, action="upsert", rows=rows)
+        return rows
+
+    def insert_price_reports(self, rows):
+        """Insert price reports in one request; returns them with their `report_id`."""
+        rows = self._insert_price_reports(rows)
+        table_changed.send(sender=PriceReport, action="insert", rows=rows)
+        return rows
+
+    def set_price_report_status(self, report_ids, status):
+        rows = self._set_price_report_status(report_ids, status)
+        table_changed.send(sender=PriceReport, action="update", rows=rows)
+        return rows
+
+    def _iter_pages(self, fetch, key, page_size, after=None):
+        # only a single page is held in memory however large the table is
+        while True:
+            rows = fetch(page_size, after)
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1][key]
+
+    def iter_prices(self, page_size=PAGE_SIZE, after=None, **filters):
+        """Yield every price matching `filters` in `price_id` order, after
+        the `after` price_id."""
+        return self._iter_pages(
+            lambda limit, after: self.prices_page(limit, after, **filters), 'price_id', page_size, after
+        )
+
+    def iter_restaurants(self, page_size=PAGE_SIZE, after=None):
+        return self._iter_pages(
+            lambda limit, after: self.restaurants_page(limit, after and {'rest_id': after}), 'rest_id', page_size,
+            after
+        )
+
+    def iter_items(self, page_size=PAGE_SIZE, after=None):
+        return self._iter_pages(self.items_page, 'item_id', page_size, after)
+
+
+class SupabaseRepository(Repository):
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        # looked up on every call, so that `clients.override` and the
+        # client rebuilt after a fork are used
+        return self._client or clients.get('supabase')
+
+    def _fetch_in(self, table, columns, column, values, order):
+        rows = []
+        for chunk in _chunks(list(values), ID_CHUNK_SIZE):
+            start = 0
+            while True:
+                response = (
+                    self.client.table(table)
+                    .select(columns)
+                    .in_(column, chunk)
+                    .order(order)
+                    .range(start, start + PAGE_SIZE - 1)
+                    .execute()
+                )
+                rows.extend(response.data)
+                if len(response.data) < PAGE_SIZE:
+                    break
+                start += PAGE_SIZE
+        return rows
+
+    # restaurants
+
+    def restaurants(self):
+        return self.client.table('restaurant').select('*').execute().data
+
+    def restaurant(self, rest_id):
+        return self.client.table('restaurant').select('*').eq('rest_id', rest_id).execute().data
+
+    def find_restaurants(self, column, term):
+        """Restaurants whose `column` contains `term`, ignoring case."""
+        return self.client.table('restaurant').select('*').ilike(column, "%" + term + "%").execute().data
+
+    def restaurants_page(self, limit, after=None, column=None, term=None):
+        """Restaurants ordered by `rest_id`, starting after the `after` key."""
+        query = self.client.table('restaurant').select('*')
+        if column:
+            query = query.ilike(column, "%" + term + "%")
+        if after is not None:
+            query = query.gt('rest_id', after['rest_id'])
+        return query.order('rest_id').limit(limit).execute().data
+
+    def restaurants_named(self, name):
+        return self.client.table('restaurant').select('*').ilike('name', name).execute().data
+
+    def restaurant_types(self):
+        return [row['type'] for row in self.client.table('restaurant').select('type').execute().data]
+
+    # items and categories
+
+    def items_for_restaurant(self, rest_id):
+        return self.client.table('item').select('*').eq('rest_id', rest_id).execute().data
+
+    def items_page(self, limit, after=None):
+        query = self.client.table('item').select('*')
+        if after is not None:
+            query = query.gt('item_id', after)
+        return query.order('item_id').limit(limit).execute().data
+
+    def categories(self):
+        return self.client.table('category').select('*').order('category_id').execute().data
+
+    def category_names(self, category_ids):
+        rows = self._fetch_in('category', 'category_id, name', 'category_id', category_ids, 'category_id')
+        return {row['category_id']: row['name'] for row in rows}
+
+    def search_items_with_prices(self, term):
+        return self.client.table('item').select('name, price(value)').ilike('name', "%" + term + "%").execute().data
+
+    # prices
+
+    def prices_for_items(self, item_ids):
+        return self._fetch_in('price', '*', 'item_id', item_ids, 'price_id')
+
+    def price_history(self, item_id):
+        return self.client.table('price').select('*').eq('item_id', item_id).order('date', desc=True).execute().data
+
+    def price_history_page(self, item_id, limit, after=None):
+        """Prices of an item, newest first, starting after the `after` key."""
+        query = self.client.table('price').select('*').eq('item_id', item_id)
+        if after is not None:
+            query = query.or_('date.lt.{date},and(date.eq.{date},price_id.lt.{price_id})'.format(**after))
+        return query.order('date', desc=True).order('price_id', desc=True).limit(limit).execute().data
+
+    def prices_page(self, limit, after=None, rest_id=None, item_id=None, date_from=None, date_to=None):
+        """Prices ordered by `price_id`, starting after the `after` id."""
+        query = self.client.table('price').select(', '.join(PRICE_FIELDS))
+        if rest_id is not None:
+            query = query.eq('rest_id', rest_id)
+        if item_id is not None:
+            query = query.eq('item_id', item_id)
+        if date_from is not None:
+            query = query.gte('date', date_from)
+        if date_to is not None:
+            query = query.lte('date', date_to)
+        if after is not None:
+            query = query.gt('price_id', after)
+        return query.order('price_id').limit(limit).execute().data
+
+    def price_reports_page(self, limit, after=None, status=None):
+        """Price reports ordered by `report_id`, starting after the `after` id."""
+        query = self.client.table('pricereport').select(', '.join(PRICE_REPORT_FIELDS))
+        if status is not None:
+            query = query.eq('status', status)
+        if after is not None:
+            query = query.gt('report_id', after)
+        return query.order('report_id').limit(limit).execute().data
+
+    def price_values(self, item_id, rest_id):
+        return self.client.table('price').select('value').eq('item_id', item_id).eq('rest_id', rest_id).execute().data
+
+    def _insert_price(self, row):
+        return self.client.table('price').insert(row).execute().data
+
+    def _update_price(self, price_id, value):
+        return self.client.table('price').update({'value': value}).eq('price_id', price_id).execute().data
+
+    def _insert_price_reports(self, rows):
+        return self.client.table('pricereport').insert(rows).execute().data
+
+    def _set_price_report_status(self, report_ids, status):
+        rows = []
+        for chunk in _chunks(list(report_ids), ID_CHUNK_SIZE):
+            rows.extend(
+                self.client.table('pricereport').update({'status': status}).in_('report_id', chunk).execute().data
+            )
+        return rows
+
+    def _upsert_prices(self, rows):
+        from postgrest import ReturnMethod
+
+        # one request per set of columns, so that a missing price_id means
+        # "use the default" instead of null
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            self.client.table('price').upsert(
+                group, on_conflict=','.join(PRICE_NATURAL_KEY), returning=ReturnMethod.minimal
+            ).execute()
+
+
+def _plain(value):
+    # match the JSON types PostgREST returns
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _rows(queryset, *fields):
+    return [{key: _plain(value) for key, value in row.items()} for row in queryset.values(*fields)]
+
+
+RESTAURANT_FIELDS = ('rest_id', 'name', 'type', 'location', 'quarter')
+CATEGORY_FIELDS = ('category_id', 'name')
+ITEM_FIELDS = ('item_id', 'name', 'type', 'category_id', 'rest_id')
+PRICE_FIELDS = ('price_id', 'date', 'value', 'source', 'item_id', 'rest_id', 'user_id')
+PRICE_NATURAL_KEY = ('item_id', 'rest_id', 'date')
+PRICE_REPORT_FIELDS = ('report_id', 'status', 'price', 'report_date', 'item_id', 'rest_id', 'user_id')
+
+
+class OrmRepository(Repository):
+    def __init__(self, using=None):
+        self.using = using or getattr(settings, 'RESTORANG_ORM_DATABASE', 'default')
+
+    def _objects(self, model):
+        return model.objects.using(self.using)
+
+    # restaurants
+
+    def restaurants(self):
+        return _rows(self._objects(Restaurant).order_by('rest_id'), *RESTAURANT_FIELDS)
+
+    def restaurant(self, rest_id):
+        return _rows(self._objects(Restaurant).filter(rest_id=rest_id), *RESTAURANT_FIELDS)
+
+    def find_restaurants(self, column, term):
+        queryset = self._objects(Restaurant).filter(**{column + '__icontains': term})
+        return _rows(queryset.order_by('rest_id'), *RESTAURANT_FIELDS)
+
+    def restaurants_page(self, limit, after=None, column=None, term=None):
+        queryset = self._objects(Restaurant)
+        if column:
+            queryset = queryset.filter(**{column + '__icontains': term})
+        if after is not None:
+            queryset = queryset.filter(rest_id__gt=after['rest_id'])
+        return _rows(queryset.order_by('rest_id')[:limit], *RESTAURANT_FIELDS)
+
+    def restaurants_named(self, name):
+        return _rows(self._objects(Restaurant).filter(name__iexact=name), *RESTAURANT_FIELDS)
+
+    def restaurant_types(self):
+        return list(self._objects(Restaurant).order_by('rest_id').values_list('type', flat=True))
+
+    # items and categories
+
+    def items_for_restaurant(self, rest_id):
+        return _rows(self._objects(Item).filter(rest_id=rest_id).order_by('item_id'), *ITEM_FIELDS)
+
+    def items_page(self, limit, after=None):
+        queryset = self._objects(Item)
+        if after is not None:
+            queryset = queryset.filter(item_id__gt=after)
+        return _rows(queryset.order_by('item_id')[:limit], *ITEM_FIELDS)
+
+    def categories(self):
+        return _rows(self._objects(Category).order_by('category_id'), *CATEGORY_FIELDS)
+
+    def category_names(self, category_ids):
+        return dict(self._objects(Category).filter(category_id__in=category_ids).values_list('category_id', 'name'))
+
+    def search_items_with_prices(self, term):
+        items = (
+            self._objects(Item)
+            .filter(name__icontains=term)
+            .prefetch_related(Prefetch('price_set', queryset=self._objects(Price).only('value', 'item_id')))
+        )
+        return [
+            {"name": item.name, "price": [{"value": _plain(price.value)} for price in item.price_set.all()]}
+            for item in items
+        ]
+
+    # prices
+
+    def prices_for_items(self, item_ids):
+        return _rows(self._objects(Price).filter(item_id__in=item_ids).order_by('price_id'), *PRICE_FIELDS)
+
+    def price_history(self, item_id):
+        return _rows(self._objects(Price).filter(item_id=item_id).order_by('-date'), *PRICE_FIELDS)
+
+    def price_history_page(self, item_id, limit, after=None):
+        queryset = self._objects(Price).filter(item_id=item_id)
+        if after is not None:
+            queryset = queryset.filter(
+                Q(date__lt=after['date']) | Q(date=after['date'], price_id__lt=after['price_id'])
+            )
+        return _rows(queryset.order_by('-date', '-price_id')[:limit], *PRICE_FIELDS)
+
+    def prices_page(self, limit, after=None, rest_id=None, item_id=None, date_from=None, date_to=None):
+        queryset = self._objects(Price)
+        if rest_id is not None:
+            queryset = queryset.filter(rest_id=rest_id)
+        if item_id is not None:
+            queryset = queryset.filter(item_id=item_id)
+        if date_from is not None:
+            queryset = queryset.filter(date__gte=date_from)
+        if date_to is not None:
+            queryset = queryset.filter(date__lte=date_to)
+        if after is not None:
+            queryset = queryset.filter(price_id__gt=after)
+        return _rows(queryset.order_by('price_id')[:limit], *PRICE_FIELDS)
+
+    def price_reports_page(self, limit, after=None, status=None):
+        queryset = self._objects(PriceReport)
+        if status is not None:
+            queryset = queryset.filter(status=status)
+        if after is not None:
+            queryset = queryset.filter(report_id__gt=after)
+        return _rows(queryset.order_by('report_id')[:limit], *PRICE_REPORT_FIELDS)
+
+    def price_values(self, item_id, rest_id):
+        return _rows(self._objects(Price).filter(item_id=item_id, rest_id=rest_id), 'value')
+
+    def _insert_price(self, row):
+        price = Price(
+            price_id=row['price_id'],
+            date=row['date'],
+            value=row['value'],
+            source=row['source'],
+            item_id_id=row['item_id'],
+            rest_id_id=row['rest_id'],
+            user_id_id=row.get('user_id'),
+        )
+        price.save(using=self.using, force_insert=True)
+        return _rows(self._objects(Price).filter(pk=price.pk), *PRICE_FIELDS)
+
+    def _update_price(self, price_id, value):
+        self._objects(Price).filter(price_id=price_id).update(value=value)
+        return _rows(self._objects(Price).filter(price_id=price_id), *PRICE_FIELDS)
+
+    def _insert_price_reports(self, rows):
+        with transaction.atomic(using=self.using):
+            # report_id has no database default here either
+            next_id = (self._objects(PriceReport).aggregate(top=Max('report_id'))['top'] or 0) + 1
+            reports = [
+                PriceReport(
+                    report_id=next_id + number,
+                    status=row['status'],
+                    price=row['price'],
+                    report_date=row['report_date'],
+                    item_id_id=row['item_id'],
+                    rest_id_id=row['rest_id'],
+                    user_id_id=row['user_id'],
+                )
+                for number, row in enumerate(rows)
+            ]
+            self._objects(PriceReport).bulk_create(reports)
+        queryset = self._objects(PriceReport).filter(report_id__in=[report.report_id for report in reports])
+        return _rows(queryset.order_by('report_id'), *PRICE_REPORT_FIELDS)
+
+    def _set_price_report_status(self, report_ids, status):
+        queryset = self._objects(PriceReport).filter(report_id__in=report_ids)
+        queryset.update(status=status)
+        return _rows(queryset.order_by('report_id'), *PRICE_REPORT_FIELDS)
+
+    def _upsert_prices(self, rows):
+        with transaction.atomic(using=self.using):
+            # price_id has no database default here; new rows are numbered
+            # after the current maximum
+            next_id = (self._objects(Price).aggregate(top=Max('price_id'))['top'] or 0) + 1
+            prices = []
+            for row in rows:
+                price_id = row.get('price_id')
+                if price_id is None:
+                    price_id, next_id = next_id, next_id + 1
+                prices.append(Price(
+                    price_id=price_id,
+                    date=row['date'],
+                    value=row['value'],
+                    source=row['source'],
+                    item_id_id=row['item_id'],
+                    rest_id_id=row['rest_id'],
+                    user_id_id=row.get('user_id'),
+                ))
+            self._objects(Price).bulk_create(
+                prices, update_conflicts=True,
+                unique_fields=PRICE_NATURAL_KEY, update_fields=['value', 'source', 'user_id'],
+            )
+
+
+class AsyncSupabaseRepository:
+    """Read methods of `SupabaseRepository` over the async client.
+
+    Independent requests (the chunks of a bulk `in` read) run concurrently.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def _fetch_chunk(self, table, columns, column, chunk, order):
+        rows = []
+        start = 0
+        while True:
+            response = await (
+                self.client.table(table)
+                .select(columns)
+                .in_(column, chunk)
+                .order(order)
+                .range(start, start + PAGE_SIZE - 1)
+                .execute()
+            )
+            rows.extend(response.data)
+            if len(response.data) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    async def _fetch_in(self, table, columns, column, values, order):
+        chunks = await asyncio.gather(*(
+            self._fetch_chunk(table, columns, column, chunk, order)
+            for chunk in _chunks(list(values), ID_CHUNK_SIZE)
+        ))
+        return [row for chunk in chunks for row in chunk]
+
+    async def restaurants(self):
+        return (await self.client.table('restaurant').select('*').execute()).data
+
+    async def restaurant(self, rest_id):
+        return (await self.client.table('restaurant').select('*').eq('rest_id', rest_id).execute()).data
+
+    async def find_restaurants(self, column, term):
+        return (await self.client.table('restaurant').select('*').ilike(column, "%" + term + "%").execute()).data
+
+    async def restaurants_page(self, limit, after=None, column=None, term=None):
+        query = self.client.table('restaurant').select('*')
+        if column:
+            query = query.ilike(column, "%" + term + "%")
+        if after is not None:
+            query = query.gt('rest_id', after['rest_id'])
+        return (await query.order('rest_id').limit(limit).execute()).data
+
+    async def restaurant_types(self):
+        return [row['type'] for row in (await self.client.table('restaurant').select('type').execute()).data]
+
+    async def items_for_restaurant(self, rest_id):
+        return (await self.client.table('item').select('*').eq('rest_id', rest_id).execute()).data
+
+    async def category_names(self, category_ids):
+        rows = await self._fetch_in('category', 'category_id, name', 'category_id', category_ids, 'category_id')
+        return {row['category_id']: row['name'] for row in rows}
+
+    async def prices_for_items(self, item_ids):
+        return await self._fetch_in('price', '*', 'item_id', item_ids, 'price_id')
+
+    async def price_history(self, item_id):
+        return (await self.client.table('price').select('*').eq('item_id', item_id).order('date', desc=True).execute()).data
+
+    async def price_history_page(self, item_id, limit, after=None):
+        query = self.client.table('price').select('*').eq('item_id', item_id)
+        if after is not None:
+            query = query.or_('date.lt.{date},and(date.eq.{date},price_id.lt.{price_id})'.format(**after))
+        return (await query.order('date', desc=True).order('price_id', desc=True).limit(limit).execute()).data
+
+
+class SyncToAsyncRepository:
+    """Async facade over a synchronous repository (the ORM backend)."""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __getattr__(self, name):
+        return sync_to_async(getattr(self.repository, name))
+
+
+def _replica_repository():
+    # replica.py builds on this module
+    from .replica import ReplicaRepository
+    return ReplicaRepository()
+
+
+BACKENDS = {
+    'supabase': SupabaseRepository,
+    'orm': OrmRepository,
+    'replica': _replica_repository,
+}
+
+_repository = None
+
+
+def get_repository():
+    global _repository
+    if _repository is None:
+        _repository = BACKENDS[getattr(settings, 'RESTORANG_DATA_BACKEND', 'supabase')]()
+    return _repository
+
+
+# httpx.AsyncClient is bound to the event loop it was created in, so the
+# async repository (and its connection pool) is kept per loop.
+_async_repositories = weakref.WeakKeyDictionary()
+
+
+async def get_async_repository():
+    if not settings.RESTORANG_ASYNC_VIEWS:
+        # under WSGI every async view runs in a loop of its own, which would
+        # build a client and connection pool per request
+        return SyncToAsyncRepository(get_repository())
+    loop = asyncio.get_running_loop()
+    repository = _async_repositories.get(loop)
+    if repository is None:
+        if getattr(settings, 'RESTORANG_DATA_BACKEND', 'supabase') == 'supabase':
+            client = await abuild_client(settings.SUPABASE_URL, settings.SUPABASE_KEY, settings.SUPABASE_HTTP)
+            repository = AsyncSupabaseRepository(client)
+        else:
+            repository = SyncToAsyncRepository(get_repository())
+        _async_repositories[loop] = repository
+    return repository
@@ -0,0 +1,99 @@
+"""Everything the restaurant page shows, in one response.
+
+The page used to load the restaurant, then its menu, then the price
+history of every item, each a browser round-trip fanning out to the
+upstream. `build` returns the parts named in `fields`:
+
+* ``restaurant`` - the restaurant row
+* ``menu`` - its items grouped by category (`menu.get_categorized_menu`)
+* ``prices`` - the latest price, min, max and mean of every item priced
+  at the restaurant, from the `PriceStats` store
+* ``sparklines`` - the closing price of the last `points` buckets of every
+  item at the restaurant, from the `PriceRollup` store
+
+Restaurant, items and category names go through the cache; prices and
+sparklines are read with one local query each. Items whose rollups were
+never computed are computed together from one read of their prices.
+"""
+import itertools
+
+from django.conf import settings
+
+from . import cache, menu, price_stats, rollups
+from .models import PriceRollup
+from .repository import get_repository
+
+FIELDS = ('restaurant', 'menu', 'prices', 'sparklines')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def query(params):
+    """`build` arguments from the query string; raises `QueryError`."""
+    options = settings.RESTORANG_RESTAURANT_PAGE
+    try:
+        rest_id = int(params.get('rest_id') or '')
+    except ValueError:
+        raise QueryError("rest_id must be a restaurant ID")
+
+    fields = [field.strip() for field in (params.get('fields') or '').split(',') if field.strip()]
+    unknown = sorted(set(fields).difference(FIELDS))
+    if unknown:
+        raise QueryError("unknown fields: %s (expected %s)" % (", ".join(unknown), ", ".join(FIELDS)))
+
+    resolution = params.get('resolution') or options['RESOLUTION']
+    if resolution not in rollups.RESOLUTIONS:
+        raise QueryError("resolution must be one of %s" % ", ".join(rollups.RESOLUTIONS))
+    try:
+        points = int(params.get('points') or options['POINTS'])
+    except ValueError:
+        raise QueryError("points must be a number")
+    if not 1 <= points <= options['MAX_POINTS']:
+        raise QueryError("points must be between 1 and %d" % options['MAX_POINTS'])
+    return {"rest_id": rest_id, "fields": fields or list(FIELDS), "resolution": resolution, "points": points}
+
+
+def sparklines(rest_id, item_ids, resolution, points):
+    """``{item_id: [[bucket, close], ...]}``, the last `points` buckets, oldest first."""
+    item_ids = set(item_ids)
+    stored = set(PriceRollup.objects.filter(item_id__in=item_ids).values_list('item_id', flat=True).distinct())
+    missing = item_ids - stored
+    if missing:
+        rollups.compute(sorted(missing))
+    rows = (
+        PriceRollup.objects
+        .filter(item_id__in=item_ids, resolution=resolution, dimension='rest_id', series=str(rest_id))
+        .order_by('item_id', 'bucket')
+        .values_list('item_id', 'bucket', 'close_value')
+    )
+    return {
+        item_id: [[start.isoformat(), float(close)] for _, start, close in list(group)[-points:]]
+        for item_id, group in itertools.groupby(rows, key=lambda row: row[0])
+    }
+
+
+def build(rest_id, fields=FIELDS, resolution='month', points=12, repository=None):
+    """The restaurant page parts named in `fields`; None when the restaurant does not exist."""
+    repository = repository or get_repository()
+    restaurant = cache.cached(
+        'restaurant', 'restaurant:id:%s' % rest_id,
+        lambda: repository.restaurant(rest_id)
+    )
+    if not restaurant:
+        return None
+
+    page = {}
+    if 'restaurant' in fields:
+        page["restaurant"] = restaurant[0]
+    if 'menu' in fields or 'sparklines' in fields:
+        categories = menu.get_categorized_menu(rest_id, repository)
+        if 'menu' in fields:
+            page["menu"] = categories
+    if 'prices' in fields:
+        page["prices"] = {stats["item_id"]: stats for stats in price_stats.stats_for(rest_id=rest_id)}
+    if 'sparklines' in fields:
+        item_ids = [item['item_id'] for group in categories for item in group["items"]]
+        page["sparklines"] = sparklines(rest_id, item_ids, resolution, points) if item_ids else {}
+    return page
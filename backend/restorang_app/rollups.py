@@ -0,0 +1,226 @@
+"""Price history rolled up per day, week, month or quarter.
+
+`PriceRollup` holds, for every item, time bucket and restaurant (or
+source), the opening and closing price, min, max, sum and count, so a
+chart of a long range reads one row per bucket instead of every price.
+Weeks start on Monday; months and quarters on their first day.
+
+The store follows the writes made through the repository (`table_changed`):
+inserted prices are folded into the buckets of items already rolled up
+(an item without rollups is computed from all its prices), any other
+write recomputes the item's rollups from its price rows. Items never rolled up
+are computed on first read; ``manage.py rebuild_price_rollups`` fills
+the store up front.
+"""
+import datetime
+import itertools
+import logging
+from decimal import Decimal
+
+from django.db import DatabaseError, transaction
+from django.dispatch import receiver
+
+from .models import Price, PriceRollup
+from .repository import get_repository
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = ('day', 'week', 'month', 'quarter')
+DIMENSIONS = ('rest_id', 'source')
+
+UPDATE_FIELDS = [
+    'open_price_id', 'open_date', 'open_value', 'close_price_id', 'close_date', 'close_value',
+    'min_value', 'max_value', 'total', 'count',
+]
+UNIQUE_FIELDS = ['item_id', 'resolution', 'dimension', 'series', 'bucket']
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def bucket(date, resolution):
+    """First day of the `resolution` bucket holding `date`."""
+    if resolution == 'day':
+        return date
+    if resolution == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if resolution == 'month':
+        return date.replace(day=1)
+    return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+
+
+def _keys(row):
+    date = _date(row['date'])
+    for resolution in RESOLUTIONS:
+        start = bucket(date, resolution)
+        for dimension in DIMENSIONS:
+            series = row.get(dimension)
+            yield (row['item_id'], resolution, dimension, '' if series is None else str(series), start)
+
+
+def _fold(rollup, key, row):
+    value = Decimal(str(row['value']))
+    date = _date(row['date'])
+    order = (date, row['price_id'])
+    if rollup is None:
+        item_id, resolution, dimension, series, start = key
+        return PriceRollup(
+            item_id=item_id, resolution=resolution, dimension=dimension, series=series, bucket=start,
+            open_price_id=row['price_id'], open_date=date, open_value=value,
+            close_price_id=row['price_id'], close_date=date, close_value=value,
+            min_value=value, max_value=value, total=value, count=1,
+        )
+    if order < (rollup.open_date, rollup.open_price_id):
+        rollup.open_price_id, rollup.open_date, rollup.open_value = row['price_id'], date, value
+    if order > (rollup.close_date, rollup.close_price_id):
+        rollup.close_price_id, rollup.close_date, rollup.close_value = row['price_id'], date, value
+    rollup.min_value = min(rollup.min_value, value)
+    rollup.max_value = max(rollup.max_value, value)
+    rollup.total += value
+    rollup.count += 1
+    return rollup
+
+
+def aggregate(rows, rollups=None):
+    """Fold price `rows` into `rollups` (unsaved `PriceRollup`s by key)."""
+    rollups = {} if rollups is None else rollups
+    for row in rows:
+        for key in _keys(row):
+            rollups[key] = _fold(rollups.get(key), key, row)
+    return rollups
+
+
+def save(rollups):
+    PriceRollup.objects.bulk_create(
+        rollups, batch_size=500, update_conflicts=True, unique_fields=UNIQUE_FIELDS, update_fields=UPDATE_FIELDS,
+    )
+
+
+def compute(item_ids, repository=None):
+    """Recompute and store the rollups of `item_ids` from one read of their prices."""
+    repository = repository or get_repository()
+    rollups = list(aggregate(repository.prices_for_items(item_ids)).values())
+    with transaction.atomic():
+        PriceRollup.objects.filter(item_id__in=item_ids).delete()
+        PriceRollup.objects.bulk_create(rollups, batch_size=500)
+    return rollups
+
+
+def apply_inserts(rows):
+    # order, min, max and sum all fold in whatever the date of the new row
+    with transaction.atomic():
+        item_ids = {row['item_id'] for row in rows}
+        rolled_up = set(
+            PriceRollup.objects.filter(item_id__in=item_ids).values_list('item_id', flat=True).distinct()
+        )
+        # an item never rolled up has older prices that a fold would miss
+        rows = [row for row in rows if row['item_id'] in rolled_up]
+        starts = {key[4] for row in rows for key in _keys(row)}
+        stored = PriceRollup.objects.select_for_update().filter(item_id__in=rolled_up, bucket__in=starts)
+        rollups = {
+            (r.item_id, r.resolution, r.dimension, r.series, r.bucket): r
+            for r in stored
+        }
+        changed = set()
+        for row in rows:
+            for key in _keys(row):
+                rollups[key] = _fold(rollups.get(key), key, row)
+                changed.add(key)
+        save([rollups[key] for key in changed])
+    missing = sorted(item_ids - rolled_up)
+    if missing:
+        compute(missing)
+
+
+def query(params):
+    """`series` arguments from the query string; raises `QueryError`."""
+    resolution = params.get('resolution')
+    if resolution not in RESOLUTIONS:
+        raise QueryError("resolution must be one of %s" % ", ".join(RESOLUTIONS))
+    dimension = params.get('by') or 'rest_id'
+    if dimension not in DIMENSIONS:
+        raise QueryError("by must be one of %s" % ", ".join(DIMENSIONS))
+    result = {"resolution": resolution, "dimension": dimension}
+    for name, key in (('from', 'date_from'), ('to', 'date_to')):
+        try:
+            result[key] = datetime.date.fromisoformat(params[name]) if params.get(name) else None
+        except ValueError:
+            raise QueryError("%s must be a date (YYYY-MM-DD)" % name)
+    return result
+
+
+POINT_FIELDS = ('series', 'bucket', 'open_value', 'close_value', 'min_value', 'max_value', 'total', 'count')
+
+
+def _point(values):
+    _, start, open_value, close_value, min_value, max_value, total, count = values
+    return {
+        "bucket": start.isoformat(),
+        "open": float(open_value),
+        "close": float(close_value),
+        "min": float(min_value),
+        "max": float(max_value),
+        "avg": round(float(total / count), 2),
+        "count": count,
+    }
+
+
+def series(item_id, resolution, dimension='rest_id', date_from=None, date_to=None):
+    """The rolled-up price series of an item, one per restaurant or source.
+
+    Buckets overlapping ``[date_from, date_to]`` are returned whole,
+    oldest first.
+    """
+    filters = {'item_id': item_id, 'resolution': resolution, 'dimension': dimension}
+    if date_from is not None:
+        filters['bucket__gte'] = bucket(date_from, resolution)
+    if date_to is not None:
+        filters['bucket__lte'] = date_to
+    queryset = PriceRollup.objects.filter(**filters).order_by('series', 'bucket').values_list(*POINT_FIELDS)
+    rows = list(queryset)
+    if not rows and not PriceRollup.objects.filter(item_id=item_id).exists():
+        compute([item_id])
+        rows = list(queryset.all())
+
+    result = [
+        {dimension: int(name) if dimension == 'rest_id' else name or None, "points": [_point(row) for row in group]}
+        for name, group in itertools.groupby(rows, key=lambda row: row[0])
+    ]
+    if dimension == 'rest_id':
+        # series are stored as text
+        result.sort(key=lambda entry: entry['rest_id'])
+    return result
+
+
+def _drop(item_ids):
+    try:
+        PriceRollup.objects.filter(item_id__in=item_ids).delete()
+    except DatabaseError:
+        logger.exception("Error dropping price rollups")
+
+
+@receiver(table_changed, sender=Price)
+def _update_on_write(sender, action, rows, **kwargs):
+    rows = rows or []
+    item_ids = sorted({row['item_id'] for row in rows})
+    if not item_ids:
+        return
+    try:
+        if action == "insert":
+            apply_inserts(rows)
+        else:
+            # a replaced value can not be taken out of min and max
+            compute(item_ids)
+    except Exception:
+        # the prices themselves were written; stale rollups are dropped
+        # so that they are recomputed on the next read
+        logger.exception("Error updating price rollups")
+        _drop(item_ids)
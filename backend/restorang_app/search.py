@@ -0,0 +1,321 @@
+"""In-process search index over restaurant names, restaurant types and item names.
+
+``ilike '%term%'`` cannot use a B-tree index, so every search scanned the
+upstream tables. The index here keeps the names in memory with a trigram
+posting list, folded to lower case without diacritics ("Čevapi" matches
+"cevapi", "Đir" matches "dir"):
+
+* a term of three or more characters is looked up through the postings of
+  its trigrams and then checked as a substring, like ``ilike``;
+* shorter terms are matched by scanning the (small) name list;
+* when nothing contains the term, names are ranked by trigram similarity
+  instead, so small typos still find something.
+
+Results are ranked: exact name, name prefix, word prefix, then anywhere
+in the name, shorter names first. The index is built on first use, kept
+current from `table_changed` and rebuilt in the background every
+``settings.RESTORANG_SEARCH['REFRESH']`` seconds to pick up writes made
+elsewhere.
+"""
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+
+from .models import Item, Restaurant
+from .repository import get_repository
+from .signals import table_changed
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.3
+
+# letters NFKD does not decompose
+_EXTRA_FOLDS = str.maketrans({"đ": "d", "ð": "d", "ł": "l", "ø": "o", "ß": "ss"})
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.translate(_EXTRA_FOLDS).split())
+
+
+def trigrams(folded):
+    grams = set()
+    for word in folded.split():
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _inner_trigrams(folded):
+    # trigrams every name containing `folded` must have
+    grams = set()
+    for word in folded.split():
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def _rank(term, name):
+    if name == term:
+        return 0
+    if name.startswith(term):
+        return 1
+    if (" " + term) in (" " + name):
+        return 2
+    return 3
+
+
+class TrigramIndex:
+    # Postings point at distinct folded names, each holding the values
+    # of every document with that name; menus repeat the same dish names
+    # across restaurants, so ranking works on far fewer entries.
+
+    def __init__(self):
+        self._docs = {}
+        self._names = {}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, text, value):
+        self.remove(doc_id)
+        folded = fold(text)
+        self._docs[doc_id] = folded
+        if folded not in self._names:
+            grams = trigrams(folded)
+            self._names[folded] = (len(grams), {})
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(folded)
+        self._names[folded][1][doc_id] = value
+
+    def remove(self, doc_id):
+        folded = self._docs.pop(doc_id, None)
+        if folded is None:
+            return
+        values = self._names[folded][1]
+        del values[doc_id]
+        if values:
+            return
+        del self._names[folded]
+        for gram in trigrams(folded):
+            names = self._postings[gram]
+            names.discard(folded)
+            if not names:
+                del self._postings[gram]
+
+    def _contains(self, term):
+        grams = _inner_trigrams(term)
+        if not grams:
+            return [name for name in self._names if term in name]
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return [name for name in candidates if term in name]
+
+    def _similar(self, term):
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        scored = []
+        for name, count in shared.items():
+            similarity = count / (len(grams) + self._names[name][0] - count)
+            if similarity >= SIMILARITY_THRESHOLD:
+                scored.append((-similarity, name))
+        return [name for _, name in sorted(scored)]
+
+    def search(self, text, limit=None, fuzzy=True):
+        """Values whose text contains `text`, best match first."""
+        term = fold(text)
+        if not term:
+            return []
+        names = self._contains(term)
+        if names:
+            def order(name):
+                return (_rank(term, name), len(name), name)
+            names = heapq.nsmallest(limit, names, key=order) if limit else sorted(names, key=order)
+        elif fuzzy:
+            names = self._similar(term)
+        values = [value for name in names for value in self._names[name][1].values()]
+        return values[:limit]
+
+    def get(self, doc_id):
+        folded = self._docs.get(doc_id)
+        return None if folded is None else self._names[folded][1][doc_id]
+
+    def equal(self, text):
+        name = self._names.get(fold(text))
+        return list(name[1].values()) if name else []
+
+
+class SearchIndex:
+    def __init__(self):
+        self.restaurants = TrigramIndex()
+        self.items = TrigramIndex()
+        self.types = TrigramIndex()
+        self._type_counts = Counter()
+        self._restaurant_types = {}
+        self.lock = threading.Lock()
+
+    def add_restaurant(self, row):
+        self.remove_restaurant(row['rest_id'])
+        self.restaurants.add(row['rest_id'], row['name'], row)
+        kind = row.get('type')
+        if kind:
+            self._restaurant_types[row['rest_id']] = kind
+            self._type_counts[kind] += 1
+            if self._type_counts[kind] == 1:
+                self.types.add(kind, kind, kind)
+
+    def remove_restaurant(self, rest_id):
+        self.restaurants.remove(rest_id)
+        kind = self._restaurant_types.pop(rest_id, None)
+        if kind is not None:
+            self._type_counts[kind] -= 1
+            if not self._type_counts[kind]:
+                del self._type_counts[kind]
+                self.types.remove(kind)
+
+    def add_item(self, row):
+        self.items.add(row['item_id'], row['name'], row)
+
+    def remove_item(self, item_id):
+        self.items.remove(item_id)
+
+
+def build(repository=None):
+    repository = repository or get_repository()
+    index = SearchIndex()
+    for row in repository.iter_restaurants():
+        index.add_restaurant(row)
+    for row in repository.iter_items():
+        index.add_item(row)
+    return index
+
+
+_index = None
+_built_at = 0.0
+_state_lock = threading.Lock()
+_refreshing = False
+
+
+def _refresh_interval():
+    return getattr(settings, 'RESTORANG_SEARCH', {}).get('REFRESH', 300)
+
+
+def _rebuild():
+    global _index, _built_at, _refreshing
+    try:
+        index = build()
+        with _state_lock:
+            _index, _built_at = index, time.monotonic()
+    except Exception:
+        # keep serving the old index until the next interval
+        logger.exception("Error rebuilding search index")
+        _built_at = time.monotonic()
+    finally:
+        _refreshing = False
+
+
+def get_index():
+    """The current index; built on first use, refreshed in the background."""
+    global _index, _built_at, _refreshing
+    if _index is None:
+        with _state_lock:
+            if _index is None:
+                _index, _built_at = build(), time.monotonic()
+    elif time.monotonic() - _built_at > _refresh_interval() and not _refreshing:
+        with _state_lock:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_rebuild, daemon=True).start()
+    return _index
+
+
+async def aensure():
+    """Build the index off the event loop if it does not exist yet."""
+    if _index is None:
+        await sync_to_async(get_index)()
+
+
+def reset():
+    global _index
+    with _state_lock:
+        _index = None
+
+
+def restaurants(term, limit=None):
+    index = get_index()
+    with index.lock:
+        return index.restaurants.search(term, limit)
+
+
+def restaurants_named(name):
+    index = get_index()
+    with index.lock:
+        return index.restaurants.equal(name)
+
+
+def items(term, limit=None):
+    index = get_index()
+    with index.lock:
+        return index.items.search(term, limit)
+
+
+def types(term, limit=None):
+    index = get_index()
+    with index.lock:
+        return index.types.search(term, limit)
+
+
+def items_with_prices(term, repository=None):
+    """Matching items as ``{"name", "price": [{"value"}]}``, the shape of
+    `Repository.search_items_with_prices`."""
+    repository = repository or get_repository()
+    found = items(term)
+    prices = {}
+    for row in repository.prices_for_items([item['item_id'] for item in found]):
+        prices.setdefault(row['item_id'], []).append({"value": row['value']})
+    return [{"name": item['name'], "price": prices.get(item['item_id'], [])} for item in found]
+
+
+def autocomplete(term, limit=10):
+    index = get_index()
+    with index.lock:
+        return {
+            "restaurants": [
+                {"rest_id": row['rest_id'], "name": row['name']}
+                for row in index.restaurants.search(term, limit)
+            ],
+            "items": [
+                {"item_id": row['item_id'], "name": row['name'], "rest_id": row.get('rest_id')}
+                for row in index.items.search(term, limit)
+            ],
+            "types": index.types.search(term, limit),
+        }
+
+
+@receiver(table_changed, sender=Restaurant)
+@receiver(table_changed, sender=Item)
+def _update_on_write(sender, action, rows, **kwargs):
+    index = _index
+    if index is None:
+        return
+    with index.lock:
+        for row in rows or []:
+            if sender is Restaurant:
+                if action == "delete":
+                    index.remove_restaurant(row['rest_id'])
+                else:
+                    index.add_restaurant(row)
+            elif action == "delete":
+                index.remove_item(row['item_id'])
+            else:
+                index.add_item(row)
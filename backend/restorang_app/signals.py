@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent after rows of an upstream table were written through this app.
+# `sender` is the model class of the table (Price, Restaurant, ...),
+# `action` is "insert", "update" or "delete" and `rows` the written rows
+# as returned by PostgREST. Changes made elsewhere and received on the
+# change feed (changefeed.py) are sent with `origin="realtime"`.
+table_changed = Signal()
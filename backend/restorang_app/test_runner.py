@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class UnmanagedModelTestRunner(DiscoverRunner):
+    """Creates the tables of the unmanaged restorang models for tests.
+
+    The models mirror tables that live in Supabase, so migrations never
+    create them. For the test database they are switched to managed and
+    the app's migrations are skipped, which makes Django build the tables
+    straight from the models.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        from django.apps import apps
+
+        self.unmanaged_models = [
+            model for model in apps.get_app_config('restorang_app').get_models()
+            if not model._meta.managed
+        ]
+        for model in self.unmanaged_models:
+            model._meta.managed = True
+        settings.MIGRATION_MODULES = {**settings.MIGRATION_MODULES, 'restorang_app': None}
+        super().setup_test_environment(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        for model in self.unmanaged_models:
+            model._meta.managed = False
@@ -0,0 +1,1123 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.http import JsonResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from benchmarks.fixtures import tables_from_fixture
+from benchmarks.postgrest_stub import PostgrestStub
+
+from . import cache, changefeed, http_cache, repository
+from .models import Price, Restaurant
+from .repository import OrmRepository, SupabaseRepository
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "restorang_sample.json")
+
+
+class OrmRepositoryTests(TestCase):
+    """The ORM backend on the sample fixture, row for row against the
+    PostgREST backend on the same data."""
+
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.rest = SupabaseRepository(PostgrestStub(tables_from_fixture(FIXTURE)).client())
+        # the write receivers (price stats, rollups, ...) read through it
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+
+    def assertSameRows(self, orm_rows, rest_rows, key):
+        self.assertTrue(orm_rows)
+        self.assertEqual(sorted(orm_rows, key=lambda row: row[key]), sorted(rest_rows, key=lambda row: row[key]))
+
+    def test_restaurants(self):
+        rows = self.orm.restaurants()
+        self.assertEqual([row["rest_id"] for row in rows], [1, 2, 3])
+        self.assertEqual(rows[0], {
+            "rest_id": 1, "name": "Caffe bar Đuro", "type": "kafić",
+            "location": "Ilica 12, Zagreb", "quarter": "Centar",
+        })
+        self.assertSameRows(rows, self.rest.restaurants(), "rest_id")
+        self.assertEqual(self.orm.restaurant(2), self.rest.restaurant(2))
+
+    def test_items_for_restaurant(self):
+        rows = self.orm.items_for_restaurant(1)
+        self.assertTrue(all(row["rest_id"] == 1 for row in rows))
+        self.assertSameRows(rows, self.rest.items_for_restaurant(1), "item_id")
+
+    def test_prices_for_items(self):
+        rows = self.orm.prices_for_items([1, 2])
+        self.assertEqual({row["item_id"] for row in rows}, {1, 2})
+        # PostgREST returns numeric as a JSON number and dates as ISO strings
+        self.assertIsInstance(rows[0]["value"], float)
+        self.assertIsInstance(rows[0]["date"], str)
+        self.assertEqual(rows, self.rest.prices_for_items([1, 2]))
+
+    def test_price_history(self):
+        rows = self.orm.price_history(1)
+        self.assertEqual([row["date"] for row in rows], sorted((row["date"] for row in rows), reverse=True))
+        self.assertEqual(
+            [(row["date"], row["price_id"]) for row in rows],
+            [(row["date"], row["price_id"]) for row in self.rest.price_history(1)],
+        )
+        self.assertEqual(rows[0].keys(), self.rest.price_history(1)[0].keys())
+
+    def test_category_names(self):
+        self.assertEqual(self.orm.category_names([1, 3]), {1: "Kava", 3: "Pizza"})
+        self.assertEqual(self.orm.category_names([1, 3]), self.rest.category_names([1, 3]))
+
+    def test_insert_and_update_price(self):
+        top = max(Price.objects.values_list("price_id", flat=True))
+        row = {
+            "price_id": top + 1, "date": "2025-09-01", "value": 2.1, "source": "web",
+            "item_id": 1, "rest_id": 1, "user_id": None,
+        }
+        self.assertEqual(self.orm.insert_price(row), [row])
+        self.assertEqual(self.orm.update_price(top + 1, 2.3)[0]["value"], 2.3)
+        self.assertEqual(float(Price.objects.get(price_id=top + 1).value), 2.3)
+
+    def test_upsert_prices(self):
+        existing = self.orm.price_history(1)[0]
+        self.orm.upsert_prices([
+            {**existing, "value": 9.99, "price_id": None},
+            {"date": "2030-01-01", "value": 3.0, "source": "menu", "item_id": 1, "rest_id": 1, "user_id": None},
+        ])
+        history = self.orm.price_history(1)
+        self.assertEqual(history[0]["date"], "2030-01-01")
+        self.assertEqual(
+            [row["value"] for row in history if row["price_id"] == existing["price_id"]], [9.99]
+        )
+
+
+class RollupTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+
+    def test_insert_into_an_item_never_rolled_up(self):
+        from . import rollups
+        from .models import PriceRollup
+
+        top = max(Price.objects.values_list("price_id", flat=True))
+        self.orm.insert_price({
+            "price_id": top + 1, "date": "2030-01-01", "value": 2.1, "source": "web",
+            "item_id": 1, "rest_id": 1, "user_id": None,
+        })
+        self.assertTrue(PriceRollup.objects.filter(item_id=1).exists())
+        counted = sum(
+            point["count"] for entry in rollups.series(1, "month") for point in entry["points"]
+        )
+        self.assertEqual(counted, Price.objects.filter(item_id=1).count())
+
+
+class SupabaseClientTests(TestCase):
+    def test_repository_follows_client_override(self):
+        from restorang import clients
+
+        stub = PostgrestStub(tables_from_fixture(FIXTURE))
+        shared = SupabaseRepository()
+        with clients.override("supabase", stub.client()):
+            self.assertEqual([row["rest_id"] for row in shared.restaurants()], [1, 2, 3])
+        with clients.override("supabase", PostgrestStub({"restaurant": []}).client()):
+            self.assertEqual(shared.restaurants(), [])
+
+
+class PriceStatsTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+        cache.backend.clear()
+
+    def pairs(self, **filters):
+        return sorted(set(Price.objects.filter(**filters).values_list("item_id", "rest_id")))
+
+    def insert(self, **row):
+        top = max(Price.objects.values_list("price_id", flat=True))
+        self.orm.insert_price({"price_id": top + 1, "source": "web", "user_id": None, **row})
+
+    def test_a_write_does_not_hide_the_other_pairs(self):
+        from . import price_stats, restaurant_page
+
+        self.insert(date="2030-01-01", value=2.1, item_id=1, rest_id=1)
+        stats = price_stats.stats_for(rest_id=1)
+        self.assertEqual([(row["item_id"], row["rest_id"]) for row in stats], self.pairs(rest_id=1))
+        page = restaurant_page.build(1, fields=("prices",), repository=self.orm)
+        self.assertEqual(sorted(page["prices"]), [item_id for item_id, _ in self.pairs(rest_id=1)])
+
+    def test_inserts_are_folded_in(self):
+        from . import price_stats
+
+        before = {row["item_id"]: row for row in price_stats.stats_for(rest_id=1)}
+        self.insert(date="2030-01-01", value=99.0, item_id=1, rest_id=1)
+        with mock.patch.object(price_stats, "compute", side_effect=AssertionError("recomputed")):
+            after = {row["item_id"]: row for row in price_stats.stats_for(rest_id=1)}
+        self.assertEqual(after[1]["count"], before[1]["count"] + 1)
+        self.assertEqual((after[1]["latest_value"], after[1]["max_value"]), (99.0, 99.0))
+        self.assertEqual(after[1]["latest_date"], "2030-01-01")
+        self.assertEqual(after[2], before[2])
+
+    def test_back_dated_inserts_and_updates_are_recomputed(self):
+        from . import price_stats
+
+        price_stats.stats_for(rest_id=1)
+        self.insert(date="2024-01-01", value=0.9, item_id=1, rest_id=1)
+        [stats] = price_stats.stats_for(item_id=1, rest_id=1)
+        self.assertEqual((stats["count"], stats["min_value"], stats["latest_value"]), (4, 0.9, 1.65))
+        self.assertEqual(stats["mean_value"], round((0.9 + 1.5 + 1.59 + 1.65) / 4, 2))
+
+        self.orm.update_price(3, 1.2)
+        [stats] = price_stats.stats_for(item_id=1, rest_id=1)
+        self.assertEqual((stats["latest_value"], stats["max_value"]), (1.2, 1.59))
+
+    def test_bulk_writes_are_recomputed(self):
+        from . import price_stats
+
+        price_stats.stats_for(rest_id=1)
+        self.orm.upsert_prices([
+            {"date": "2025-11-15", "value": 1.7, "source": "web", "item_id": 1, "rest_id": 1, "user_id": None},
+            {"date": "2025-11-15", "value": 2.5, "source": "web", "item_id": 2, "rest_id": 1, "user_id": None},
+        ])
+        stats = {row["item_id"]: row for row in price_stats.stats_for(rest_id=1)}
+        self.assertEqual(
+            [(item_id, row["latest_value"], row["count"]) for item_id, row in sorted(stats.items())],
+            [(1, 1.7, 3), (2, 2.5, 3), (3, 3.3, 3)],
+        )
+
+
+class IngestTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+
+    def test_one_notification_per_batch(self):
+        from . import ingest
+        from .signals import table_changed
+
+        sent = []
+
+        def record(sender, action, rows, **kwargs):
+            sent.append((action, len(rows)))
+
+        table_changed.connect(record, sender=Price)
+        self.addCleanup(table_changed.disconnect, record, sender=Price)
+        records = [
+            (line, {"date": "2030-01-%02d" % line, "value": "2.50", "source": "web", "item_id": 1, "rest_id": 1}, None)
+            for line in range(1, 8)
+        ]
+        report = ingest.ingest(records, self.orm, batch_size=2)
+        self.assertEqual(report["written"], 7)
+        self.assertEqual(sent, [("upsert", 7)])
+
+
+    def test_numbers_with_cents(self):
+        from . import ingest
+
+        records = ingest.read_rows(json.dumps([
+            {"date": "2030-01-01", "value": 12.35, "source": "web", "item_id": 1, "rest_id": 1},
+            {"date": "2030-01-02", "value": 12.0, "source": "web", "item_id": 1, "rest_id": 1},
+        ]), "json")
+        report = ingest.ingest(records, self.orm)
+        self.assertEqual((report["written"], report["failed"]), (2, 0))
+        self.assertEqual(self.orm.price_history(1)[1]["value"], 12.35)
+        _, errors = ingest.clean({"date": "2030-01-01", "value": 12.355, "source": "web", "item_id": 1, "rest_id": 1})
+        self.assertIn("value", errors)
+
+    def test_batch_size_and_token_are_checked(self):
+        from django.core.management import CommandError, call_command
+
+        ingest_settings = {**settings.RESTORANG_INGEST, "TOKEN": "secret"}
+        body = json.dumps([{"date": "2030-01-01", "value": 2.5, "source": "web", "item_id": 1, "rest_id": 1}])
+        with override_settings(RESTORANG_INGEST=ingest_settings):
+            response = self.client.post(
+                "/api/ingest/prices/?batch_size=-5", body, content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer secret",
+            )
+            self.assertEqual(response.status_code, 400)
+            response = self.client.post(
+                "/api/ingest/prices/", body, content_type="application/json", HTTP_AUTHORIZATION="Bearer šifra",
+            )
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post(
+                "/api/ingest/prices/", body, content_type="application/json", HTTP_AUTHORIZATION="Bearer secret",
+            )
+            self.assertEqual(response.json()["written"], 1)
+        with self.assertRaises(CommandError):
+            call_command("ingest_prices", "-", format="json", batch_size=-5)
+
+
+@override_settings(RESTORANG_REPORTS={**settings.RESTORANG_REPORTS, "WORKERS": 0})
+class PriceReportTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+
+    def test_json_report_with_cents(self):
+        from .models import QueuedPriceReport
+
+        response = self.client.post(
+            "/api/reports/",
+            json.dumps({"price": 12.35, "report_date": "2030-01-01", "item_id": 1, "rest_id": 1, "user_id": 1}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 202)
+        entry = QueuedPriceReport.objects.get(id=response.json()["queued"])
+        self.assertEqual(entry.payload["price"], 12.35)
+
+
+class ConditionalResponseTests(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+
+        self.factory = RequestFactory()
+        self.payloads = []
+
+        @http_cache.conditional('restaurant', max_age=60)
+        def view(request):
+            return JsonResponse(self.payloads.pop(0), json_dumps_params={"separators": (",", ":")})
+
+        self.view = view
+        cache.backend.clear()
+
+    def test_success_is_read_from_the_payload(self):
+        self.payloads = [{"items": [1], "error": None}, {"items": [2], "error": None}]
+        first = self.view(self.factory.get("/x"))
+        self.assertEqual(self.view(self.factory.get("/x")).content, first.content)
+        self.assertEqual(self.payloads, [{"items": [2], "error": None}])
+
+        self.payloads = [{"items": [{"error": None}], "error": "failed"}, {"items": [], "error": None}]
+        self.view(self.factory.get("/y"))
+        self.assertEqual(json.loads(self.view(self.factory.get("/y")).content)["error"], None)
+
+    def test_no_last_modified_from_a_per_process_cache(self):
+        self.payloads = [{"error": None}, {"error": None}]
+        first = self.view(self.factory.get("/x"))
+        self.assertNotIn("Last-Modified", first)
+        later = self.view(self.factory.get("/x", HTTP_IF_MODIFIED_SINCE="Sat, 01 Jan 2050 00:00:00 GMT"))
+        self.assertEqual(later.status_code, 200)
+        self.assertEqual(self.view(self.factory.get("/x", HTTP_IF_NONE_MATCH=first["ETag"])).status_code, 304)
+
+    def test_last_modified_follows_writes(self):
+        shared = cache.DjangoBackend("default", 60)
+        shared.shared = True
+        shared.clear()
+        self.addCleanup(shared.clear)
+        realtime = {**settings.RESTORANG_REALTIME, "ENABLED": True}
+        with mock.patch.object(cache, "backend", shared), override_settings(RESTORANG_REALTIME=realtime):
+            self.payloads = [{"error": None}, {"error": None}]
+            first = self.view(self.factory.get("/x"))
+            modified = first["Last-Modified"]
+            self.assertEqual(self.view(self.factory.get("/x", HTTP_IF_MODIFIED_SINCE=modified)).status_code, 304)
+
+            with mock.patch("time.time", return_value=time.time() + 10):
+                cache.invalidate('restaurant')
+            later = self.view(self.factory.get("/x", HTTP_IF_MODIFIED_SINCE=modified))
+        self.assertEqual(later.status_code, 200)
+        self.assertGreater(parsedate_to_datetime(later["Last-Modified"]), parsedate_to_datetime(modified))
+
+
+class GeoQueryTests(TestCase):
+    def test_radius_is_clamped(self):
+        from django.http import QueryDict
+
+        from . import geo
+
+        query = geo.query(QueryDict("lat=45.8&lng=15.97&radius=1e9"))
+        self.assertEqual(query["radius"], settings.RESTORANG_GEO["MAX_RADIUS"])
+        with self.assertRaises(geo.QueryError):
+            geo.query(QueryDict("lat=45.8&lng=15.97&radius=nan"))
+
+    def test_within_visits_only_occupied_cells(self):
+        from . import geo
+
+        index = geo.GeoIndex(0.01)
+        index.add({"rest_id": 1, "type": "bistro"}, 45.81, 15.97)
+        index.add({"rest_id": 2, "type": "bistro"}, 45.80, 15.99)
+        started = time.perf_counter()
+        found = index.within(45.8, 15.97, 1e9)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual([row["rest_id"] for _, _, _, row in found], [1, 2])
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.sent = []
+
+        def record(sender, action, rows, **kwargs):
+            self.sent.append((action, rows))
+
+        from .signals import table_changed
+
+        table_changed.connect(record, sender=Restaurant)
+        self.addCleanup(table_changed.disconnect, record, sender=Restaurant)
+        changefeed._backlog.clear()
+
+    def change(self, kind, record=None, old_record=None, table="restaurant"):
+        return {"data": {"table": table, "type": kind, "record": record, "old_record": old_record}}
+
+    def run_feed(self, payloads):
+        done = threading.Event()
+
+        async def source(tables, on_change, on_subscribed):
+            on_subscribed()
+            for payload in payloads:
+                on_change(payload)
+            done.set()
+            await asyncio.Event().wait()
+
+        subscriber = changefeed.Subscriber(source=source, tables=["restaurant"]).start()
+        self.addCleanup(subscriber.stop, 5)
+        self.assertTrue(done.wait(5))
+        subscriber.flush()
+        self.assertTrue(subscriber.connected)
+
+    def test_apply_sends_table_changed(self):
+        row = {"rest_id": 7, "name": "Bistro", "type": "bistro", "location": "Ilica 1", "quarter": "Centar"}
+        self.run_feed([
+            self.change("INSERT", record=row),
+            self.change("UPDATE", record={**row, "name": "Bistro 7"}),
+            self.change("DELETE", old_record={"rest_id": 7}),
+        ])
+        self.assertEqual(self.sent, [
+            ("insert", [row]), ("update", [{**row, "name": "Bistro 7"}]), ("delete", [{"rest_id": 7}]),
+        ])
+
+    def test_echoes_of_local_writes_are_skipped(self):
+        from .signals import table_changed
+
+        row = {"rest_id": 8, "name": "Konoba"}
+        table_changed.send(sender=Restaurant, action="update", rows=[row])
+        self.sent.clear()
+        self.assertEqual(changefeed.apply(self.change("UPDATE", record=row)), "echo")
+        self.assertEqual(self.sent, [])
+
+        window = settings.RESTORANG_REALTIME["ECHO_WINDOW"]
+        with mock.patch("time.monotonic", return_value=time.monotonic() + window + 1):
+            self.assertEqual(changefeed.apply(self.change("UPDATE", record=row)), "applied")
+        self.assertEqual(self.sent, [("update", [row])])
+
+    def test_price_delete_without_its_item_only_invalidates(self):
+        received = []
+
+        def record(sender, **kwargs):
+            received.append(kwargs)
+
+        from .signals import table_changed
+
+        table_changed.connect(record, sender=Price)
+        self.addCleanup(table_changed.disconnect, record, sender=Price)
+        before = cache.version("price")
+        outcome = changefeed.apply(self.change("DELETE", old_record={"price_id": 5, "rest_id": 1}, table="price"))
+        self.assertEqual(outcome, "partial")
+        self.assertEqual(received, [])
+        self.assertNotEqual(cache.version("price"), before)
+
+    def test_reconnect_replays_the_backlog(self):
+        for number in range(3):
+            changefeed.publish("price", {"number": number}, {"rest:1"})
+        changefeed.publish("price", {"number": 3}, {"rest:2"})
+        first = changefeed._backlog[0][0]
+        stream = changefeed.subscribe(["rest:1"], first)
+        self.addCleanup(changefeed.unsubscribe, stream)
+        self.assertFalse(stream.lost)
+        self.assertEqual([json.loads(event[3])["number"] for event in stream.get(0)], [1, 2])
+
+    def test_reconnect_past_the_backlog_is_reset(self):
+        with override_settings(RESTORANG_REALTIME={**settings.RESTORANG_REALTIME, "BACKLOG": 2}):
+            for number in range(4):
+                changefeed.publish("price", {"number": number}, {"rest:1"})
+            first_id = changefeed._backlog[0][0].partition("-")[0] + "-1"
+            stream = changefeed.subscribe(["rest:1"], first_id)
+            self.assertTrue(stream.lost)
+            sent = list(changefeed.events(stream))
+        self.assertEqual(sent[1], "id: %s\nevent: reset\ndata: {}\n\n" % changefeed._backlog[-1][0])
+        self.assertEqual(len(sent), 2)
+
+        stream = changefeed.subscribe(["rest:1"], "other-1")
+        changefeed.unsubscribe(stream)
+        self.assertTrue(stream.lost)
+
+
+class ReplicaTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        from . import replica
+
+        self.rest = SupabaseRepository(PostgrestStub(tables_from_fixture(FIXTURE)).client())
+        replica.sync(self.rest)
+        replica._forget_state()
+        self.addCleanup(replica._forget_state)
+
+    def test_small_tables_follow_updates_and_deletes(self):
+        from . import replica
+        from .models import Item
+
+        self.rest.client.table("restaurant").update({"name": "Novi Đuro"}).eq("rest_id", 1).execute()
+        self.rest.client.table("item").delete().eq("item_id", 8).execute()
+        changed = replica.sync(self.rest)
+        self.assertEqual((changed["restaurant"], changed["item"]), (1, 1))
+        self.assertEqual(Restaurant.objects.using("replica").get(rest_id=1).name, "Novi Đuro")
+        self.assertFalse(Item.objects.using("replica").filter(item_id=8).exists())
+
+    def test_prices_are_fresh_as_of_the_last_whole_comparison(self):
+        import datetime
+
+        from django.utils import timezone
+
+        from . import replica
+        from .models import ReplicaTable
+
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        ReplicaTable.objects.using("replica").filter(table="price").update(full_synced_at=hour_ago)
+        self.assertGreater(replica.lag(), 3000)
+
+        replica._forget_state()
+        realtime = {**settings.RESTORANG_REALTIME, "ENABLED": True}
+        with override_settings(RESTORANG_REALTIME=realtime):
+            self.assertLess(replica.lag(), 60)
+
+
+class PriceColumnsTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from . import price_columns
+
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+        self.addCleanup(price_columns.reset)
+
+    def test_writes_during_a_rebuild_reach_the_new_store(self):
+        from . import price_columns
+
+        price_columns.get_store()
+        top = max(Price.objects.values_list("price_id", flat=True))
+        first = Price.objects.order_by("price_id").first()
+        build = price_columns.build
+
+        def slow_build(repository=None):
+            store = build(repository)
+            # written after the pages were read
+            self.orm.insert_price({
+                "price_id": top + 1, "date": "2030-01-01", "value": 7.5, "source": "web",
+                "item_id": 1, "rest_id": 1, "user_id": None,
+            })
+            self.orm.update_price(first.price_id, 1.25)
+            return store
+
+        with mock.patch.object(price_columns, "build", slow_build):
+            price_columns._rebuild()
+        store = price_columns.get_store()
+        self.assertEqual(len(store), Price.objects.count())
+        row = int(np.searchsorted(store.price_id, top + 1))
+        self.assertEqual((int(store.price_id[row]), int(store.cents[row])), (top + 1, 750))
+        self.assertEqual(int(store.cents[np.searchsorted(store.price_id, first.price_id)]), 125)
+
+    def test_a_price_read_and_written_during_a_build_is_kept_once(self):
+        from . import price_columns
+
+        store = price_columns.get_store()
+        count = len(store)
+        row = self.orm.price_history(1)[0]
+        with store.lock:
+            store.append([row])
+            store.merge()
+        self.assertEqual(len(store), count)
+
+
+class PaginationTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+        cache.backend.clear()
+
+    def walk(self, path, **params):
+        pages = [self.client.get(path, params).json()]
+        while pages[-1]["next_cursor"]:
+            pages.append(self.client.get(path, {**params, "cursor": pages[-1]["next_cursor"]}).json())
+        return pages
+
+    def test_cursor_round_trip(self):
+        from . import pagination
+
+        cursor = pagination.encode_cursor({"date": "2025-11-15", "price_id": 3})
+        self.assertNotIn("=", cursor)
+        self.assertEqual(
+            pagination.decode_cursor(cursor, pagination.PRICE_KEY), {"date": "2025-11-15", "price_id": 3}
+        )
+        for cursor in ("not-a-cursor", pagination.encode_cursor({"rest_id": 1}),
+                       pagination.encode_cursor({"date": "yesterday", "price_id": 3})):
+            with self.assertRaises(pagination.PaginationError):
+                pagination.decode_cursor(cursor, pagination.PRICE_KEY)
+
+    def test_restaurant_pages(self):
+        pages = self.walk("/api/restaurants/", limit=2)
+        self.assertEqual([[row["rest_id"] for row in page["items"]] for page in pages], [[1, 2], [3]])
+        self.assertIsNone(pages[-1]["next_cursor"])
+
+    def test_price_history_pages_with_equal_dates(self):
+        top = max(Price.objects.values_list("price_id", flat=True))
+        self.orm.insert_price({
+            "price_id": top + 1, "date": "2025-11-15", "value": 1.7, "source": "web",
+            "item_id": 1, "rest_id": 2, "user_id": None,
+        })
+        pages = self.walk("/api/item-price-history/", item_id=1, limit=1)
+        self.assertEqual(
+            [(row["date"], row["price_id"]) for page in pages for row in page["prices"]],
+            [("2025-11-15", top + 1), ("2025-11-15", 3), ("2025-06-01", 2), ("2025-01-10", 1)],
+        )
+
+    def test_bad_limit_and_cursor(self):
+        self.assertEqual(self.client.get("/api/restaurants/?limit=0").json()["error"], "limit must be a positive integer")
+        self.assertEqual(self.client.get("/api/restaurants/?cursor=xyz").json()["error"], "Invalid cursor")
+        with override_settings(RESTORANG_MAX_PAGE_SIZE=1):
+            payload = self.client.get("/api/restaurants/?limit=50").json()
+        self.assertEqual(len(payload["items"]), 1)
+
+
+class ExportTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = OrmRepository(using="default")
+
+    def test_ndjson(self):
+        response = self.client.get("/api/export/prices/?rest_id=2&from=2025-06-01")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["price_id"] for row in rows], [11, 12, 14, 15, 17, 18])
+        self.assertEqual(rows[0], {
+            "price_id": 11, "date": "2025-06-01", "value": 9.01, "source": "menu",
+            "item_id": 4, "rest_id": 2, "user_id": None,
+        })
+
+    def test_csv(self):
+        import csv
+        import io
+
+        response = self.client.get("/api/export/prices/?format=csv&item_id=1")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="prices.csv"')
+        lines = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(lines[0], ["price_id", "date", "value", "source", "item_id", "rest_id", "user_id"])
+        self.assertEqual(lines[1:], [
+            ["1", "2025-01-10", "1.5", "web", "1", "1", ""],
+            ["2", "2025-06-01", "1.59", "menu", "1", "1", ""],
+            ["3", "2025-11-15", "1.65", "korisnik", "1", "1", ""],
+        ])
+
+    def test_gzip(self):
+        import gzip
+
+        plain = b"".join(self.client.get("/api/export/prices/").streaming_content)
+        response = self.client.get("/api/export/prices/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), plain)
+        self.assertEqual(len(plain.splitlines()), 24)
+
+    def test_chunks(self):
+        from . import export
+
+        chunks = list(export.encoded(("x" * 10 + "\n" for _ in range(10)), chunk_size=25))
+        self.assertEqual([len(chunk) for chunk in chunks], [33, 33, 33, 11])
+
+    def test_bad_parameters(self):
+        for query in ("format=xml", "rest_id=one", "from=2025-13-01"):
+            self.assertEqual(self.client.get("/api/export/prices/?" + query).status_code, 400)
+
+
+@override_settings(RESTORANG_REPORTS={**settings.RESTORANG_REPORTS, "WORKERS": 0, "AUTO_APPROVE": True})
+class ReportQueueTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from .models import User
+
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+        User.objects.create(user_id=1, first_name="Ana", last_name="Horvat", email="ana@example.com",
+                            password="x", role="user")
+
+    def submit(self, **row):
+        from . import reports
+
+        entry, errors = reports.submit({"report_date": "2030-01-01", "item_id": 1, "rest_id": 1, "user_id": 1, **row})
+        self.assertEqual(errors, {})
+        return entry
+
+    def test_approved_reports_are_promoted(self):
+        from . import reports
+        from .models import PriceReport, QueuedPriceReport
+
+        self.submit(price=1.8)
+        self.submit(price=1.9)
+        self.submit(price=4.5, item_id=7, rest_id=3)
+        self.assertEqual(reports.depths(), {"pending": 3, "claimed": 0, "failed": 0})
+        self.assertEqual(reports.drain(self.orm), 3)
+        self.assertFalse(QueuedPriceReport.objects.exists())
+        self.assertEqual(
+            sorted(PriceReport.objects.values_list("status", flat=True)), [reports.PROMOTED] * 3
+        )
+        # one price per (item, restaurant, date); the latest report wins
+        price = self.orm.price_history(1)[0]
+        self.assertEqual((price["date"], price["value"], price["source"]), ("2030-01-01", 1.9, reports.SOURCE))
+        self.assertEqual(self.orm.price_history(7)[0]["value"], 4.5)
+
+    def test_invalid_reports_are_not_queued(self):
+        from . import reports
+
+        entry, errors = reports.submit({"price": "abc", "item_id": 1, "rest_id": 1, "user_id": 1})
+        self.assertIsNone(entry)
+        self.assertIn("price", errors)
+
+    def test_a_rejected_report_is_retried_alone(self):
+        from . import reports
+        from .models import PriceReport, QueuedPriceReport
+
+        insert = self.orm.insert_price_reports
+
+        def reject_bad(rows):
+            if any(row["price"] == 13.13 for row in rows):
+                raise ValueError("rejected")
+            return insert(rows)
+
+        for price in (1.8, 13.13, 2.0, 2.1):
+            self.submit(price=price)
+        with mock.patch.object(self.orm, "insert_price_reports", side_effect=reject_bad):
+            self.assertEqual(reports.process(self.orm), 4)
+        self.assertEqual(PriceReport.objects.count(), 3)
+        failed = QueuedPriceReport.objects.get()
+        self.assertEqual((failed.state, failed.attempts, failed.error), (reports.PENDING, 1, "rejected"))
+        self.assertEqual(failed.payload["price"], 13.13)
+        # not due again before its retry delay
+        self.assertEqual(reports.process(self.orm), 0)
+
+    def test_unreachable_upstream_parks_reports_after_max_attempts(self):
+        import httpx
+
+        from . import reports
+        from .models import QueuedPriceReport
+
+        self.submit(price=1.8)
+        options = {**settings.RESTORANG_REPORTS, "MAX_ATTEMPTS": 2, "RETRY_DELAY": 0}
+        with override_settings(RESTORANG_REPORTS=options), \
+                mock.patch.object(self.orm, "insert_price_reports", side_effect=httpx.ConnectError("down")):
+            self.assertEqual(reports.process(self.orm), 1)
+            self.assertEqual(QueuedPriceReport.objects.get().state, reports.PENDING)
+            self.assertEqual(reports.process(self.orm), 1)
+        self.assertEqual(QueuedPriceReport.objects.get().state, reports.FAILED)
+        self.assertEqual(reports.process(self.orm), 0)
+
+    def test_reports_approved_later_are_promoted(self):
+        from . import reports
+
+        with override_settings(RESTORANG_REPORTS={**settings.RESTORANG_REPORTS, "AUTO_APPROVE": False}):
+            self.submit(price=1.8)
+        reports.drain(self.orm)
+        self.assertEqual(self.orm.price_history(1)[0]["date"], "2025-11-15")
+        [report] = self.orm.price_reports_page(10, status=reports.SUBMITTED)
+        self.orm.set_price_report_status([report["report_id"]], reports.APPROVED)
+        self.assertEqual(reports.promote(self.orm, batch_size=1), 1)
+        self.assertEqual(self.orm.price_history(1)[0]["value"], 1.8)
+        self.assertEqual(self.orm.price_reports_page(10, status=reports.PROMOTED)[0]["report_id"], report["report_id"])
+
+
+class RestaurantPageTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = OrmRepository(using="default")
+        cache.backend.clear()
+
+    def get(self, **params):
+        return self.client.get("/api/restaurant-page/", params)
+
+    def test_only_the_fields_asked_for(self):
+        payload = self.get(rest_id=1, fields="restaurant,prices").json()
+        self.assertEqual(set(payload), {"restaurant", "prices", "error"})
+        self.assertEqual(payload["restaurant"]["name"], "Caffe bar Đuro")
+        self.assertEqual(sorted(payload["prices"]), ["1", "2", "3"])
+        self.assertEqual(payload["prices"]["1"]["latest_value"], 1.65)
+        self.assertEqual((payload["prices"]["1"]["min_value"], payload["prices"]["1"]["count"]), (1.5, 3))
+
+        payload = self.get(rest_id=2, fields="menu").json()
+        self.assertEqual(set(payload), {"menu", "error"})
+        self.assertEqual(
+            sorted(item["item_id"] for group in payload["menu"] for item in group["items"]), [4, 5, 6]
+        )
+
+    def test_all_fields_by_default(self):
+        payload = self.get(rest_id=3).json()
+        self.assertEqual(set(payload), {"restaurant", "menu", "prices", "sparklines", "error"})
+
+    def test_sparklines(self):
+        payload = self.get(rest_id=1, fields="sparklines", resolution="month", points=2).json()
+        self.assertEqual(payload["sparklines"]["1"], [["2025-06-01", 1.59], ["2025-11-01", 1.65]])
+        payload = self.get(rest_id=1, fields="sparklines", resolution="quarter").json()
+        self.assertEqual(payload["sparklines"]["3"], [["2025-01-01", 3.0], ["2025-04-01", 3.18], ["2025-10-01", 3.3]])
+
+    def test_bad_queries(self):
+        self.assertEqual(self.get(rest_id=1, fields="menu,reviews").status_code, 400)
+        self.assertEqual(self.get(rest_id="one").status_code, 400)
+        self.assertEqual(self.get(rest_id=1, points=0).status_code, 400)
+        self.assertEqual(self.get(rest_id=99).status_code, 404)
+
+
+class FacetTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from . import facets
+
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = OrmRepository(using="default")
+        cache.backend.clear()
+        facets.reset()
+        self.addCleanup(facets.reset)
+
+    def get(self, **params):
+        payload = self.client.get("/api/restaurant-facets/", params).json()
+        counts = {
+            facet: {entry["value"]: entry["count"] for entry in values} for facet, values in payload["facets"].items()
+        }
+        return [row["rest_id"] for row in payload["restaurants"]], payload["total"], counts
+
+    def test_counts_leave_out_the_facets_own_filter(self):
+        rest_ids, total, counts = self.get(category=1)
+        self.assertEqual((rest_ids, total), ([1, 2], 2))
+        self.assertEqual(counts["category"], {1: 2, 2: 1, 3: 1, 4: 1})
+        self.assertEqual(counts["type"], {"kafić": 1, "pizzeria": 1, "slastičarnica": 0})
+
+        rest_ids, total, counts = self.get(category=[1, 4], type="pizzeria")
+        self.assertEqual(rest_ids, [2])
+        self.assertEqual(counts["category"], {1: 1, 2: 0, 3: 1, 4: 0})
+        self.assertEqual(counts["type"], {"kafić": 1, "pizzeria": 1, "slastičarnica": 1})
+        self.assertEqual(counts["quarter"], {"Centar": 0, "Podsljeme": 1, "Maksimir": 0})
+
+    def test_text_and_category_names(self):
+        payload = self.client.get("/api/restaurant-facets/", {"q": "SESTINE"}).json()
+        self.assertEqual([row["rest_id"] for row in payload["restaurants"]], [2])
+        self.assertEqual(
+            [(entry["name"], entry["count"]) for entry in payload["facets"]["category"]],
+            [("Kava", 1), ("Pizza", 1), ("Deserti", 0), ("Pića", 0)],
+        )
+
+    def test_paging(self):
+        payload = self.client.get("/api/restaurant-facets/", {"limit": 2}).json()
+        self.assertEqual(([row["rest_id"] for row in payload["restaurants"]], payload["total"]), ([1, 2], 3))
+        payload = self.client.get("/api/restaurant-facets/", {"limit": 2, "cursor": payload["next_cursor"]}).json()
+        self.assertEqual([row["rest_id"] for row in payload["restaurants"]], [3])
+        self.assertIsNone(payload["next_cursor"])
+
+    def test_writes_update_the_index(self):
+        from .models import Item
+        from .signals import table_changed
+
+        self.get()
+        table_changed.send(sender=Restaurant, action="update", rows=[{
+            "rest_id": 3, "name": "Slastičarnica Čokolada", "type": "pizzeria",
+            "location": "Maksimirska 45, Zagreb", "quarter": "Maksimir",
+        }])
+        table_changed.send(sender=Item, action="delete", rows=[{"item_id": 6}])
+        rest_ids, _, counts = self.get(type="pizzeria")
+        self.assertEqual(rest_ids, [2, 3])
+        self.assertEqual(counts["type"], {"kafić": 1, "pizzeria": 2})
+        self.assertEqual(counts["category"], {1: 0, 2: 0, 3: 1, 4: 1})
+
+    def test_bad_category(self):
+        self.assertEqual(self.client.get("/api/restaurant-facets/", {"category": "kava"}).status_code, 400)
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_identical_reads_share_one_call(self):
+        import httpx
+
+        from restorang.supabase_client import PooledTransport
+
+        transport = PooledTransport({"RETRIES": 1})
+        calls = []
+        arrived = threading.Semaphore(0)
+        release = threading.Event()
+
+        def send(request):
+            calls.append((request.method, str(request.url)))
+            release.wait(5)
+            # unread, like the responses of the connection pool
+            return httpx.Response(200, stream=httpx.ByteStream(b'[{"rest_id": 1}]'))
+
+        results = []
+
+        def read(url):
+            with httpx.Client(transport=transport) as client:
+                arrived.release()
+                response = client.get(url)
+                results.append((url, response.json()))
+
+        urls = ["http://stub.local/restaurant?id=eq.1"] * 4 + ["http://stub.local/restaurant?id=eq.2"]
+        with mock.patch.object(transport, "_send", side_effect=send):
+            threads = [threading.Thread(target=read, args=(url,)) for url in urls]
+            for thread in threads:
+                thread.start()
+            for _ in threads:
+                arrived.acquire()
+            # let the followers reach the flight of the first caller
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+            with httpx.Client(transport=transport) as client:
+                client.post("http://stub.local/restaurant", json={})
+                client.post("http://stub.local/restaurant", json={})
+
+        self.assertEqual(sorted(calls), [
+            ("GET", urls[0]), ("GET", urls[-1]), ("POST", "http://stub.local/restaurant"),
+            ("POST", "http://stub.local/restaurant"),
+        ])
+        self.assertEqual(results.count((urls[0], [{"rest_id": 1}])), 4)
+        self.assertEqual(transport.pool_stats()["coalesced"], 3)
+        self.assertEqual(transport.pool_stats()["shared_in_flight"], 0)
+
+    def test_errors_reach_every_caller(self):
+        from restorang.supabase_client import SingleFlight
+
+        flight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fail():
+            release.wait(5)
+            raise ConnectionError("down")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len(flight), 0)
+
+    def test_async_callers_share_one_call(self):
+        from restorang.supabase_client import AsyncSingleFlight
+
+        async def run():
+            flight = AsyncSingleFlight()
+            release = asyncio.Event()
+            calls = []
+
+            async def fetch(key):
+                calls.append(key)
+                await release.wait()
+                return [key]
+
+            tasks = [asyncio.create_task(flight.do(key, lambda key=key: fetch(key))) for key in "aaab"]
+            await asyncio.sleep(0)
+            release.set()
+            return calls, await asyncio.gather(*tasks)
+
+        calls, results = asyncio.run(run())
+        self.assertEqual(calls, ["a", "b"])
+        self.assertEqual(results, [(["a"], False), (["a"], True), (["a"], True), (["b"], False)])
+
+
+class AnalyticsTests(TestCase):
+    """The analytics on the sample fixture, against sums done by hand."""
+
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from . import price_columns
+
+        self.orm = OrmRepository(using="default")
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = self.orm
+        price_columns.reset()
+        self.addCleanup(price_columns.reset)
+
+    def test_category_prices(self):
+        import datetime
+
+        from . import analytics
+
+        result = analytics.category_prices()
+        self.assertEqual([entry["name"] for entry in result], ["Kava", "Deserti", "Pizza", "Pića"])
+        # the current prices: espresso 1.65 and 1.76, cappuccino 2.42
+        self.assertEqual(result[0], {
+            "category_id": 1, "name": "Kava", "items": 3, "avg": 1.94, "median": 1.76, "min": 1.65, "max": 2.42,
+        })
+        self.assertEqual(result[1], {
+            "category_id": 4, "name": "Deserti", "items": 2, "avg": 3.96, "median": 3.96, "min": 3.52, "max": 4.4,
+        })
+        self.assertEqual((result[2]["min"], result[2]["max"]), (9.35, 11.0))
+
+        kava = analytics.category_prices(category_ids=[1], as_of=datetime.date(2025, 6, 30))
+        self.assertEqual([(entry["median"], entry["min"], entry["max"]) for entry in kava], [(1.7, 1.59, 2.33)])
+        self.assertEqual(analytics.category_prices(as_of=datetime.date(2024, 12, 31)), [])
+        self.assertEqual(
+            [(entry["name"], entry["items"]) for entry in analytics.category_prices(rest_ids=[2])],
+            [("Pizza", 2), ("Kava", 1)],
+        )
+
+    def test_price_index(self):
+        from . import analytics
+
+        kava = (165 + 242 + 176) / 3
+        pizza = (935 + 1100) / 2
+        desserts = (352 + 440) / 2
+        expected = {
+            1: 100 * (165 / kava * 242 / kava * 1) ** (1 / 3),
+            2: 100 * (176 / kava * 935 / pizza * 1100 / pizza) ** (1 / 3),
+            3: 100 * (352 / desserts * 440 / desserts) ** (1 / 2),
+        }
+        result = analytics.price_index()
+        self.assertEqual([entry["rest_id"] for entry in result], sorted(expected, key=expected.get))
+        for entry in result:
+            self.assertAlmostEqual(entry["index"], expected[entry["rest_id"]], delta=0.01)
+        self.assertEqual([entry["rest_id"] for entry in analytics.price_index(min_items=3)], [2, 1])
+        # the market stays every restaurant
+        [entry] = analytics.price_index(rest_ids=[3])
+        self.assertAlmostEqual(entry["index"], expected[3], delta=0.01)
+
+    def test_inflation(self):
+        import math
+
+        from . import analytics
+
+        result = analytics.inflation(period='quarter')
+        self.assertEqual(
+            [(entry["period"], entry["items"]) for entry in result],
+            [("2025-01-01", 0), ("2025-04-01", 8), ("2025-07-01", 0), ("2025-10-01", 0)],
+        )
+        january = [150, 220, 300, 850, 1000, 160, 320, 400]
+        june = [159, 233, 318, 901, 1060, 170, 339, 424]
+        change = math.prod(new / old for new, old in zip(june, january)) ** (1 / 8)
+        self.assertIsNone(result[0]["change_pct"])
+        self.assertAlmostEqual(result[1]["change_pct"], (change - 1) * 100, delta=0.01)
+        # a period without a comparison keeps the index where it was
+        self.assertEqual({entry["index"] for entry in result[1:]}, {round(change * 100, 2)})
+
+    def test_inflation_takes_the_last_price_of_a_period(self):
+        import datetime
+
+        from . import analytics
+
+        top = max(Price.objects.values_list("price_id", flat=True))
+        for number, (date, value) in enumerate([("2025-12-20", 2.31), ("2025-12-01", 1.98)], start=1):
+            self.orm.insert_price({
+                "price_id": top + number, "date": date, "value": value, "source": "web",
+                "item_id": 1, "rest_id": 1, "user_id": None,
+            })
+        result = analytics.inflation(item_ids=[1], date_from=datetime.date(2025, 11, 1))
+        self.assertEqual(result, [
+            {"period": "2025-11-01", "change_pct": None, "index": 100.0, "items": 0},
+            {"period": "2025-12-01", "change_pct": 40.0, "index": 140.0, "items": 1},
+        ])
+
+
+class SearchTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from . import search
+
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = OrmRepository(using="default")
+        search.reset()
+        self.addCleanup(search.reset)
+
+    def test_folded_and_fuzzy_matches(self):
+        from . import search
+
+        found = search.autocomplete("cokolad")
+        self.assertEqual([row["name"] for row in found["restaurants"]], ["Slastičarnica Čokolada"])
+        self.assertEqual([row["name"] for row in found["items"]], ["Čokoladna torta"])
+        self.assertEqual([row["rest_id"] for row in search.autocomplete("đuro")["restaurants"]], [1])
+        # nothing contains the typo; the names are ranked by similarity
+        self.assertEqual({row["name"] for row in search.autocomplete("esspresso")["items"]}, {"Espresso"})
+
+    def test_writes_update_the_index(self):
+        from . import search
+        from .models import Item
+        from .signals import table_changed
+
+        search.autocomplete("kava")
+        table_changed.send(sender=Item, action="insert", rows=[
+            {"item_id": 9, "name": "Turska kava", "type": "piće", "category_id": 1, "rest_id": 3},
+        ])
+        table_changed.send(sender=Item, action="delete", rows=[{"item_id": 7}])
+        self.assertEqual([row["item_id"] for row in search.autocomplete("kava")["items"]], [9])
+        self.assertEqual(search.autocomplete("kremsnita")["items"], [])
+
+
+class CompareTests(TestCase):
+    fixtures = ["restorang_sample.json"]
+
+    def setUp(self):
+        from . import search
+
+        self.addCleanup(setattr, repository, "_repository", repository._repository)
+        repository._repository = OrmRepository(using="default")
+        cache.backend.clear()
+        search.reset()
+        self.addCleanup(search.reset)
+
+    def test_basket(self):
+        response = self.client.post(
+            "/api/compare/",
+            json.dumps({"items": [{"name": "espresso", "quantity": 2}, {"item_id": 4}]}),
+            content_type="application/json",
+        )
+        payload = response.json()
+        espresso, margherita = payload["items"]
+        self.assertEqual((espresso["name"], espresso["quantity"]), ("Espresso", 2))
+        self.assertEqual(
+            [(offer["rest_id"], offer["value"]) for offer in espresso["offers"]], [(1, 1.65), (2, 1.76)]
+        )
+        self.assertEqual([offer["rest_id"] for offer in margherita["offers"]], [2])
+        self.assertEqual(payload["restaurants"], [
+            {"rest_id": 2, "total": 12.87, "available": 2, "missing": []},
+            {"rest_id": 1, "total": 3.3, "available": 1, "missing": ["Margherita"]},
+        ])
+
+    def test_bad_baskets(self):
+        for query in ("", "item_id=one", "item=Espresso&limit=0"):
+            self.assertEqual(self.client.get("/api/compare/?" + query).status_code, 400)
+        response = self.client.post(
+            "/api/compare/", json.dumps({"items": [{"name": "Espresso", "quantity": -1}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["error"], "quantity must be positive")
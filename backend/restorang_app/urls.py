@@ -10,9 +10,26 @@ urlpatterns = [
     path('restbytype/', views.fetch_all_restaurants_by_type, name="restbytype"),
     path('resttypes/', views.fetch_all_restaurant_types, name="resttypes"),
     path('restbyquater/', views.fetch_all_restaurants_by_quarter, name="restbyquarter"),
+    path('restaurant-facets/', views.restaurant_facets, name='restaurant_facets'),
     path('fetch-items-prices/', views.get_menu_by_rest_id, name='get_menu_by_rest_id'),
     path('item-price-history/', views.get_item_price_history, name='item_price_history'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('nearby/', views.nearby_restaurants, name='nearby'),
+    path('compare/', views.compare_prices, name='compare_prices'),
+    path('restaurant-page/', views.get_restaurant_page, name='restaurant_page'),
+    path('price-updates/', views.price_updates, name='price_updates'),
+    path('analytics/category-prices/', views.category_prices, name='category_prices'),
+    path('analytics/price-index/', views.price_index, name='price_index'),
+    path('analytics/inflation/', views.price_inflation, name='price_inflation'),
+    path('price-stats/', views.get_price_stats, name='price_stats'),
+    path('export/prices/', views.export_prices, name='export_prices'),
+    path('ingest/prices/', views.ingest_prices, name='ingest_prices'),
+    path('reports/', views.submit_price_report, name='submit_price_report'),
+    path('report-stats/', views.report_stats, name='report_stats'),
+    path('replica-stats/', views.replica_stats, name='replica_stats'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('pool-stats/', views.pool_stats, name='pool_stats'),
     
     path('items-by-restaurant/', views.items_by_restaurant, name='items_by_restaurant'),  #for testing
     path('price-history/', views.item_price_history, name='price_history_page'),          #for testing
-]
\ No newline at end of file
+]
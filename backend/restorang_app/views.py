@@ -1,24 +1,36 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from restorang import settings
-from . import helpers
-
-supabase = settings.supabase
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from restorang import supabase_client
+from . import analytics, cache, changefeed, compare, export, facets, geo, helpers, http_cache, ingest, instrumentation, menu, pagination, price_stats, replica, reports, restaurant_page, rollups, search
+from .repository import get_async_repository, get_repository
 
+import hmac
+import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
 
 def multiply_numbers(request):
-    result = ""
     context = None
     code = 0
     if request.method =='GET':
-        response = supabase.table('restaurant').select('*').execute()
         code = 1
         context = {
-                    "items": response.data or [],
+                    # only read when the cached restaurant list fragment
+                    # of home.html is missing or stale
+                    "items": lambda: geo.with_coordinates(
+                        cache.cached('restaurant', 'restaurant:all', get_repository().restaurants) or []
+                    ),
+                    "fragment_version": "%s,geo@%s" % (cache.version('restaurant'), geo.index_version()),
+                    "fragment_timeout": settings.RESTORANG_TEMPLATE_CACHE['TIMEOUT'],
                     "code": code,
                     "googleapi": os.getenv("GOOGLE_MAPS_API_KEY"),
                     "error": None
@@ -28,140 +40,174 @@ def multiply_numbers(request):
         select_type = request.POST.get('select-type')
         try:
             if select_type == "option1":
-                response = supabase.table('item').select('name, price(value)').ilike('name', "%"+select_arg+"%").execute() 
+                data = search.items_with_prices(select_arg)
                 code = 2                   
             elif select_type == "option2":
-                response = supabase.table('restaurant').select('*').ilike('name', "%"+select_arg+"%").execute()
+                data = search.restaurants(select_arg)
                 code = 3
             else: 
-                response = supabase.table("price").insert({
+                data = get_repository().insert_price({
                     "price_id": request.POST.get('insert-id'),
                     "date": request.POST.get('insert-date'),
                     "value": request.POST.get('insert-value'),
                     "source": request.POST.get('insert-source'),
                     "item_id": request.POST.get('item-id'),
                     "rest_id": request.POST.get('rest-id'),
-                }).execute()
-            if response.data:
-                for item in response.data:
-                    pricestring = str(item["price"])
-                    pricechar = ""
-                    for ch in pricestring:
-                        if ch=='.' or ch.isdigit():
-                            pricechar+=ch
-                    item["price"] = pricechar
-                context = {
-                    "items": response.data or [],
-                    "code": code,
-                    "googleapi": os.getenv("GOOGLE_MAPS_API_KEY"),
-                    "error": None
-                }
-            if not response.data:
-                context["error"] = "No matches found for your search."
-        except Exception as e:
-            print("Error fetching data:", e)
-
-
-        except Exception as e:
-            result+="zamisli ne bit preekstra"
-            print("Error fetching data:", e)
+                })
+            # prices are formatted once here instead of in the template
+            items = [{**item, "price": helpers.priceLabel(item)} for item in data or []]
+            context = {
+                "items": items,
+                "code": code,
+                "googleapi": os.getenv("GOOGLE_MAPS_API_KEY"),
+                "error": None if items else "No matches found for your search."
+            }
+        except Exception:
+            logger.exception("Error fetching data")
     return render(request,'home.html', context)
 
     
 
 
-def fetch_all_restaurants(request):
+@http_cache.conditional('restaurant', max_age=300)
+async def fetch_all_restaurants(request):
     context = None
     try:
-        response = supabase.table('restaurant').select('*').execute()                    
-        if response.data:
-            print(response.data)
+        limit, after = pagination.page_params(request, pagination.RESTAURANT_KEY)
+        repository = await get_async_repository()
+        rows = await cache.acached(
+            'restaurant', 'restaurant:page:%s:%s' % (after and after['rest_id'], limit),
+            lambda: repository.restaurants_page(limit + 1, after)
+        )
+        data, next_cursor = pagination.page(rows, limit, pagination.RESTAURANT_KEY)
+        if data:
+            logger.debug("%d rows", len(data))
             context = {
-                "items": response.data or [],
+                "items": data or [],
+                "next_cursor": next_cursor,
                 "error": None
             }
-        if not response.data:
+        if not data:
             context["error"] = "No matches found for your search."
-    except Exception as e:
-        print("Error fetching data:", e)
+    except pagination.PaginationError as e:
+        context = {"items": [], "next_cursor": None, "error": str(e)}
+    except Exception:
+        logger.exception("Error fetching data")
     return JsonResponse(context)
 
+@http_cache.conditional('restaurant', max_age=300)
 def get_rest_id_by_name(request):
     context = None
-    if request.method == 'POST':
-        select_name = request.POST.get('select-name')
-        try:
-            response = supabase.table('restaurant').select('rest_id').ilike('name', "%"+select_name+"%").execute()                    
-            if response.data:
-                print(response.data)
-                context = {
-                    "items": response.data or [],
-                    "error": None
-                }
-            if not response.data:
-                context["error"] = "No matches found for your search."
-        except Exception as e:
-            print("Error fetching data:", e)
+    select_name = request.GET.get('select-name') or request.POST.get('select-name')
+    if not select_name:
+        return JsonResponse({
+            "items": [],
+            "error": "Restaurant name is required"
+        })
+    try:
+        data = [{'rest_id': row['rest_id']} for row in search.restaurants(select_name)]                    
+        if data:
+            logger.debug("%d rows", len(data))
+            context = {
+                "items": data or [],
+                "error": None
+            }
+        if not data:
+            context["error"] = "No matches found for your search."
+    except Exception:
+        logger.exception("Error fetching data")
     return JsonResponse(context)
 
-def get_restaurant_by_id(request):
+@http_cache.conditional('restaurant', max_age=300)
+async def get_restaurant_by_id(request):
     context = None
-    if request.method == 'POST':
-        rest_id = request.POST.get('rest_id')
-        try:
-            response = supabase.table('restaurant').select('*').eq('rest_id', rest_id).execute()
-            if response.data:
-                print(response.data)
-                context = {
-                    "items": response.data or [],
-                    "error": None
-                }
-            if not response.data:
-                context["error"] = "No matches found for your search."
-        except Exception as e:
-            print("Error fetching data:", e)
+    rest_id = request.GET.get('rest_id') or request.POST.get('rest_id')
+    if not rest_id:
+        return JsonResponse({
+            "items": [],
+            "error": "Restaurant ID is required"
+        })
+    try:
+        repository = await get_async_repository()
+        data = await cache.acached(
+            'restaurant', 'restaurant:id:%s' % rest_id,
+            lambda: repository.restaurant(rest_id)
+        )
+        if data:
+            logger.debug("%d rows", len(data))
+            context = {
+                "items": data or [],
+                "error": None
+            }
+        if not data:
+            context["error"] = "No matches found for your search."
+    except Exception:
+        logger.exception("Error fetching data")
     return JsonResponse(context)
 
-def fetch_all_restaurants_by_type(request):
+async def _restaurants_by(request, column, missing_error, empty_error):
     context = None
     try:
-        restaurant_type = request.GET.get('type') or request.POST.get('type')
-        
-        if not restaurant_type:
+        term = request.GET.get(column) or request.POST.get(column)
+
+        if not term:
             return JsonResponse({
                 "restaurants": [],
-                "error": "Restaurant type is required"
+                "error": missing_error
             })
-        
-        response = supabase.table('restaurant').select('*').ilike('type', "%"+restaurant_type+"%").execute()                    
-        
-        if response.data:
+
+        limit, after = pagination.page_params(request, pagination.RESTAURANT_KEY)
+        repository = await get_async_repository()
+        rows = await repository.restaurants_page(limit + 1, after, column, term)
+        data, next_cursor = pagination.page(rows, limit, pagination.RESTAURANT_KEY)
+
+        if data:
             context = {
-                "restaurants": response.data or [],
+                "restaurants": data or [],
+                "next_cursor": next_cursor,
                 "error": None
             }
         else:
             context = {
                 "restaurants": [],
-                "error": "No restaurants found of this type"
+                "next_cursor": None,
+                "error": empty_error
             }
+    except pagination.PaginationError as e:
+        context = {
+            "restaurants": [],
+            "next_cursor": None,
+            "error": str(e)
+        }
     except Exception as e:
-        print("Error fetching data:", e)
+        logger.exception("Error fetching data")
         context = {
             "restaurants": [],
             "error": f"Error fetching data: {str(e)}"
         }
-    
+
     return JsonResponse(context)
 
-def fetch_all_restaurant_types(request):
+@http_cache.conditional('restaurant', max_age=300)
+async def fetch_all_restaurants_by_type(request):
+    return await _restaurants_by(request, 'type', "Restaurant type is required", "No restaurants found of this type")
+
+@http_cache.conditional('restaurant', max_age=300)
+async def fetch_all_restaurants_by_quarter(request):
+    return await _restaurants_by(request, 'quarter', "Quarter is required", "No restaurants found in this quarter")
+
+@http_cache.conditional('restaurant', max_age=3600)
+async def fetch_all_restaurant_types(request):
     context = None
     try:
-        response = supabase.table('restaurant').select('type', count='distinct').execute()                    
-        
-        if response.data:
+        repository = await get_async_repository()
+        types = await cache.acached('restaurant', 'restaurant:types', repository.restaurant_types)
+        # one entry per type, in the order they first appear
+        types = list(dict.fromkeys(types))
+
+        if types:
             context = {
-                "types": [item['type'] for item in response.data] or [],
+                "types": types or [],
                 "error": None
             }
         else:
@@ -170,74 +216,52 @@ def fetch_all_restaurant_types(request):
                 "error": "No restaurant types found"
             }
     except Exception as e:
-        print("Error fetching data:", e)
+        logger.exception("Error fetching data")
         context = {
             "types": [],
             "error": f"Error fetching data: {str(e)}"
         }
-    
+
     return JsonResponse(context)
 
-def fetch_all_restaurants_by_quarter(request):
-    context = None
+@http_cache.conditional(('restaurant', 'item', 'category'), max_age=300)
+def restaurant_facets(request):
     try:
-        quarter = request.GET.get('quarter') or request.POST.get('quarter')
-        
-        if not quarter:
-            return JsonResponse({
-                "restaurants": [],
-                "error": "Quarter is required"
-            })
-        
-        response = supabase.table('restaurant').select('*').ilike('quarter', "%"+quarter+"%").execute()                    
-        
-        if response.data:
-            context = {
-                "restaurants": response.data or [],
-                "error": None
-            }
-        else:
-            context = {
-                "restaurants": [],
-                "error": "No restaurants found in this quarter"
-            }
-    except Exception as e:
-        print("Error fetching data:", e)
+        query = facets.query(request.GET)
+        limit, after = pagination.page_params(request, pagination.RESTAURANT_KEY)
+    except (facets.QueryError, pagination.PaginationError) as e:
+        return JsonResponse({"restaurants": [], "next_cursor": None, "error": str(e)}, status=400)
+    try:
+        rows, total, counts = facets.search(limit=limit + 1, after=after and after['rest_id'], **query)
+        data, next_cursor = pagination.page(rows, limit, pagination.RESTAURANT_KEY)
         context = {
-            "restaurants": [],
-            "error": f"Error fetching data: {str(e)}"
+            "restaurants": data,
+            "total": total,
+            "facets": counts,
+            "next_cursor": next_cursor,
+            "error": None if data else "No restaurants match these filters"
         }
-    
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"restaurants": [], "next_cursor": None, "error": f"Error fetching data: {str(e)}"}
     return JsonResponse(context)
 
-def get_menu_by_rest_id(request):
+@http_cache.conditional(('item', 'category', 'price'), max_age=60)
+async def get_menu_by_rest_id(request):
     context = None
     try:
         restaurant_id = request.GET.get('rest_id') or request.POST.get('rest_id')
-        
+
         if not restaurant_id:
             return JsonResponse({
                 "items": [],
                 "error": "Restaurant ID is required"
             })
-        
-        # Fetch all items for the restaurant
-        items_response = supabase.table('item').select('*').eq('rest_id', restaurant_id).execute()
-        
-        if items_response.data:
-            # For each item, fetch its prices
-            items_with_prices = []
-            for item in items_response.data:
-                category_response = supabase.table('category').select('name').eq('category_id', item['category_id']).execute()
-                prices_response = supabase.table('price').select('*').eq('item_id', item['item_id']).execute()
-                
-                item_data = {
-                    **item,
-                    "prices": prices_response.data or [],
-                    "category_name": category_response.data[0]['name'] if category_response.data else None
-                }
-                items_with_prices.append(item_data)
-            
+
+        # Categories and prices are fetched concurrently
+        items_with_prices = await menu.aget_menu(restaurant_id)
+
+        if items_with_prices:
             context = {
                 "items": items_with_prices,
                 "error": None
@@ -248,49 +272,318 @@ def get_menu_by_rest_id(request):
                 "error": "No items found for this restaurant"
             }
     except Exception as e:
-        print("Error fetching data:", e)
+        logger.exception("Error fetching data")
         context = {
             "items": [],
             "error": f"Error fetching data: {str(e)}"
         }
-    
+
     return JsonResponse(context)
 
-def get_item_price_history(request):
+@http_cache.conditional('price', max_age=60)
+async def get_item_price_history(request):
     context = None
     try:
-        # Get item_id from request
         item_id = request.GET.get('item_id') or request.POST.get('item_id')
-        
+
         if not item_id:
             return JsonResponse({
                 "prices": [],
                 "error": "Item ID is required"
             })
-        
-        # Fetch all prices for the item, ordered by date descending
-        prices_response = supabase.table('price').select('*').eq('item_id', item_id).order('date', desc=True).execute()
-        
-        if prices_response.data:
+
+        # Rolled up per bucket instead of every price row
+        if request.GET.get('resolution'):
+            try:
+                query = rollups.query(request.GET)
+            except rollups.QueryError as e:
+                return JsonResponse({"series": [], "error": str(e)}, status=400)
+            series = await sync_to_async(rollups.series)(int(item_id), **query)
+            return JsonResponse({
+                "resolution": query["resolution"],
+                "by": query["dimension"],
+                "series": series,
+                "error": None if series else "No price history found for this item"
+            })
+
+        limit, after = pagination.page_params(request, pagination.PRICE_KEY)
+        repository = await get_async_repository()
+        rows = await repository.price_history_page(item_id, limit + 1, after)
+        prices, next_cursor = pagination.page(rows, limit, pagination.PRICE_KEY)
+
+        if prices:
             context = {
-                "prices": prices_response.data or [],
+                "prices": prices or [],
+                "next_cursor": next_cursor,
                 "error": None
             }
         else:
             context = {
                 "prices": [],
+                "next_cursor": None,
                 "error": "No price history found for this item"
             }
+    except pagination.PaginationError as e:
+        context = {
+            "prices": [],
+            "next_cursor": None,
+            "error": str(e)
+        }
     except Exception as e:
-        print("Error fetching data:", e)
+        logger.exception("Error fetching data")
         context = {
             "prices": [],
             "error": f"Error fetching data: {str(e)}"
         }
+
+    return JsonResponse(context)
+
+@http_cache.conditional(('restaurant', 'item'), max_age=300)
+def autocomplete(request):
+    term = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit') or 10), 50)
+    except ValueError:
+        limit = 10
+    try:
+        context = {**search.autocomplete(term, limit), "error": None}
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"restaurants": [], "items": [], "types": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+def nearby_restaurants(request):
+    try:
+        query = geo.query(request.GET)
+    except geo.QueryError as e:
+        return JsonResponse({"restaurants": [], "error": str(e)}, status=400)
+    try:
+        data = geo.nearby(**query)
+        context = {
+            "restaurants": data,
+            "error": None if data else "No restaurants found near this point"
+        }
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"restaurants": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+@csrf_exempt
+@http_cache.conditional(('item', 'price'), max_age=60)
+def compare_prices(request):
+    try:
+        basket, limit = compare.query(request)
+    except compare.QueryError as e:
+        return JsonResponse({"items": [], "restaurants": [], "error": str(e)}, status=400)
+    try:
+        data = compare.compare(basket, limit)
+        context = {
+            **data,
+            "error": None if data["restaurants"] else "No prices found"
+        }
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"items": [], "restaurants": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+@http_cache.conditional(('restaurant', 'item', 'category', 'price'), max_age=60)
+def get_restaurant_page(request):
+    try:
+        query = restaurant_page.query(request.GET)
+    except restaurant_page.QueryError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        page = restaurant_page.build(**query)
+        if page is None:
+            return JsonResponse({"error": "Restaurant not found"}, status=404)
+        context = {**page, "error": None}
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+def price_updates(request):
+    try:
+        topics = changefeed.topics(request.GET)
+    except changefeed.QueryError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    # EventSource sends Last-Event-ID when it reconnects
+    stream = changefeed.subscribe(topics, request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    # under ASGI waiting for events holds no thread
+    events = changefeed.aevents(stream) if settings.RESTORANG_ASYNC_VIEWS else changefeed.events(stream)
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@http_cache.conditional(('price', 'item', 'category'), max_age=300)
+def category_prices(request):
+    try:
+        query = analytics.category_query(request.GET)
+    except analytics.QueryError as e:
+        return JsonResponse({"categories": [], "error": str(e)}, status=400)
+    try:
+        data = analytics.category_prices(**query)
+        context = {"categories": data, "error": None if data else "No prices found"}
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"categories": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+@http_cache.conditional(('price', 'item', 'category'), max_age=300)
+def price_index(request):
+    try:
+        query = analytics.index_query(request.GET)
+    except analytics.QueryError as e:
+        return JsonResponse({"restaurants": [], "error": str(e)}, status=400)
+    try:
+        data = analytics.price_index(**query)
+        context = {"restaurants": data, "error": None if data else "No prices found"}
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"restaurants": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+@http_cache.conditional(('price', 'item', 'category'), max_age=300)
+def price_inflation(request):
+    try:
+        query = analytics.inflation_query(request.GET)
+    except analytics.QueryError as e:
+        return JsonResponse({"periods": [], "error": str(e)}, status=400)
+    try:
+        data = analytics.inflation(**query)
+        context = {"period": query["period"], "periods": data, "error": None if data else "No prices found"}
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {"periods": [], "error": f"Error fetching data: {str(e)}"}
+    return JsonResponse(context)
+
+@http_cache.conditional('price', max_age=60)
+def get_price_stats(request):
+    context = None
+    try:
+        item_id = request.GET.get('item_id') or request.POST.get('item_id')
+        rest_id = request.GET.get('rest_id') or request.POST.get('rest_id')
+        
+        if not item_id and not rest_id:
+            return JsonResponse({
+                "stats": [],
+                "error": "Item ID or restaurant ID is required"
+            })
+        
+        # One precomputed summary per item and restaurant
+        stats = price_stats.stats_for(
+            int(item_id) if item_id else None,
+            int(rest_id) if rest_id else None
+        )
+        
+        if stats:
+            context = {
+                "stats": stats,
+                "error": None
+            }
+        else:
+            context = {
+                "stats": [],
+                "error": "No prices found"
+            }
+    except Exception as e:
+        logger.exception("Error fetching data")
+        context = {
+            "stats": [],
+            "error": f"Error fetching data: {str(e)}"
+        }
     
     return JsonResponse(context)
 
 
+def export_prices(request):
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return JsonResponse({"error": "format must be ndjson or csv"}, status=400)
+    try:
+        filters = export.filters(request.GET)
+    except export.ExportError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # rows are read page by page while the response is being sent
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    rows = get_repository().iter_prices(**filters)
+    response = StreamingHttpResponse(export.stream(rows, fmt, compress), content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = 'attachment; filename="prices.%s"' % fmt
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@csrf_exempt
+def ingest_prices(request):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST a CSV, JSON or NDJSON batch"}, status=405)
+    token = settings.RESTORANG_INGEST['TOKEN']
+    # bytes, so that a non-ASCII header is a mismatch instead of a TypeError
+    authorization = request.headers.get('Authorization', '').encode()
+    if not token or not hmac.compare_digest(authorization, ('Bearer ' + token).encode()):
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    upload = request.FILES.get('file')
+    fmt = request.GET.get('format') or ingest.guess_format(
+        upload.content_type if upload else request.content_type,
+        upload.name if upload else None
+    )
+    try:
+        batch_size = int(request.GET.get('batch_size') or 0) or None
+        if batch_size is not None and batch_size < 1:
+            raise ingest.IngestError("batch_size must be positive")
+        records = ingest.read_rows(upload.read() if upload else request.body, fmt)
+        report = ingest.ingest(records, batch_size=batch_size)
+    except (ingest.IngestError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({**report, "error": None})
+
+
+@csrf_exempt
+def submit_price_report(request):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST a price report"}, status=405)
+    if request.content_type == 'application/json':
+        try:
+            row = json.loads(request.body or b'null')
+        except ValueError as e:
+            return JsonResponse({"error": "invalid JSON: %s" % e}, status=400)
+    else:
+        row = request.POST.dict()
+    try:
+        entry, errors = reports.submit(row)
+    except reports.QueueFull:
+        response = JsonResponse({"error": "Too many reports waiting, try again later"}, status=503)
+        response['Retry-After'] = str(reports.RETRY_AFTER)
+        return response
+    if errors:
+        return JsonResponse({"error": "Invalid report", "errors": errors}, status=400)
+    # written upstream by the report workers
+    return JsonResponse({"queued": entry.id, "error": None}, status=202)
+
+
+def report_stats(request):
+    return JsonResponse(reports.stats())
+
+
+def replica_stats(request):
+    return JsonResponse(replica.stats())
+
+
+def cache_stats(request):
+    return JsonResponse(cache.stats())
+
+def pool_stats(request):
+    return JsonResponse({"pools": supabase_client.pool_stats()})
+
+def metrics(request):
+    return HttpResponse(instrumentation.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # just for displaying html pages for testing
 def item_price_history(request):
     return render(request, 'item_price_history.html')
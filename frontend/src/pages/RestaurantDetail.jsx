@@ -4,31 +4,50 @@ import "./restaurantDetail.css";
 
 const API_BASE = "http://localhost:8000/api";
 
+function Sparkline({ points }) {
+  if (!points || points.length < 2) return null;
+
+  const values = points.map(([, value]) => value);
+  const min = Math.min(...values);
+  const span = Math.max(...values) - min || 1;
+  const step = 80 / (points.length - 1);
+  const line = values
+    .map((value, i) => `${(i * step).toFixed(1)},${(22 - ((value - min) / span) * 20).toFixed(1)}`)
+    .join(" ");
+
+  return (
+    <svg className="sparkline" width="80" height="24" viewBox="0 0 80 24">
+      <polyline points={line} fill="none" stroke="#2563eb" strokeWidth="1.5" />
+    </svg>
+  );
+}
+
 function RestaurantDetail() {
   const { id } = useParams();
   const navigate = useNavigate();
 
   const [restaurant, setRestaurant] = useState(null);
+  const [menu, setMenu] = useState([]);
+  const [prices, setPrices] = useState({});
+  const [sparklines, setSparklines] = useState({});
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [reload, setReload] = useState(0);
 
   useEffect(() => {
     const fetchRestaurant = async () => {
       try {
-        const formData = new FormData();
-        formData.append("rest_id", id);
-
-        const res = await fetch(`${API_BASE}/restbyud/`, {
-          method: "POST",
-          body: formData,
-        });
+        // restoran, jelovnik, cijene i grafovi u jednom zahtjevu;
+        // GET, da preglednik može keširati odgovor (ETag / 304)
+        const res = await fetch(
+          `${API_BASE}/restaurant-page/?rest_id=${encodeURIComponent(id)}`
+        );
 
+        if (res.status === 404) throw new Error("Restoran nije pronađen");
         if (!res.ok) throw new Error("Greška pri dohvaćanju restorana");
 
         const json = await res.json();
-        const r = json.items?.[0];
-
-        if (!r) throw new Error("Restoran nije pronađen");
+        const r = json.restaurant;
 
         setRestaurant({
           id: r.rest_id,
@@ -37,6 +56,9 @@ function RestaurantDetail() {
           type: r.type,
           city: r.quarter,
         });
+        setMenu(json.menu || []);
+        setPrices(json.prices || {});
+        setSparklines(json.sparklines || {});
       } catch (e) {
         console.error(e);
         setError("Ne mogu dohvatiti podatke o objektu.");
@@ -46,6 +68,35 @@ function RestaurantDetail() {
     };
 
     fetchRestaurant();
+  }, [id, reload]);
+
+  useEffect(() => {
+    // nove cijene šalje poslužitelj (server-sent events)
+    const source = new EventSource(
+      `${API_BASE}/price-updates/?rest_id=${encodeURIComponent(id)}`
+    );
+
+    source.addEventListener("price", (event) => {
+      const { action, price } = JSON.parse(event.data);
+      if (action === "delete") return;
+      setPrices((current) => {
+        const known = current[price.item_id];
+        if (known && price.date < known.latest_date) return current;
+        return {
+          ...current,
+          [price.item_id]: {
+            ...known,
+            item_id: price.item_id,
+            latest_value: Number(price.value),
+            latest_date: price.date,
+          },
+        };
+      });
+    });
+    // propuštene promjene: ponovno dohvati stranicu
+    source.addEventListener("reset", () => setReload((n) => n + 1));
+
+    return () => source.close();
   }, [id]);
 
   if (loading) return <p>Učitavanje...</p>;
@@ -64,9 +115,33 @@ function RestaurantDetail() {
         </p>
       </div>
 
+      {menu.length === 0 && <p className="menu-empty">Nema artikala.</p>}
+
+      {menu.map((category) => (
+        <div className="detail-card menu-category" key={category.category_id ?? "other"}>
+          <h2>{category.category_name || "Ostalo"}</h2>
+          <table className="menu-table">
+            <tbody>
+              {category.items.map((item) => {
+                const price = prices[item.item_id];
+                return (
+                  <tr key={item.item_id}>
+                    <td>{item.name}</td>
+                    <td className="menu-price">
+                      {price ? `€${price.latest_value.toFixed(2)}` : "—"}
+                    </td>
+                    <td>
+                      <Sparkline points={sparklines[item.item_id]} />
+                    </td>
+                  </tr>
+                );
+              })}
+            </tbody>
+          </table>
+        </div>
+      ))}
+
       {/* OVDJE IDE IDUĆE:
-          - tablica artikala
-          - graf cijena
           - dojave */}
     </div>
   );
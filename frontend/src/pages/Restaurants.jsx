@@ -1,71 +1,95 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useState } from "react";
 import RestaurantCard from "../components/RestaurantCard";
 import "./restaurants.css";
 
 const API_BASE = "http://localhost:8000/api";
 
+const ALL_CITIES = "Svi gradovi";
+const ALL_TYPES = "Sve vrste";
+
+//  MAPIRANJE BACKEND → FRONTEND SHAPE
+const toRestaurant = (r) => ({
+  id: r.rest_id,
+  name: r.name,
+  address: r.location,
+  city: r.quarter, // privremeno quarter → city
+  type: r.type,
+});
+
 function Restaurants() {
   const [data, setData] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [facets, setFacets] = useState({ type: [], quarter: [] });
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
   const [query, setQuery] = useState("");
-  const [city, setCity] = useState("Svi gradovi");
-  const [type, setType] = useState("Sve vrste");
+  const [city, setCity] = useState(ALL_CITIES);
+  const [type, setType] = useState(ALL_TYPES);
+
+  // filtrira backend (/restaurant-facets/): vraća samo stranicu
+  // pogodaka i broj objekata po gradu i vrsti
+  const fetchPage = async (after) => {
+    const params = new URLSearchParams();
+    if (query.trim()) params.append("q", query.trim());
+    if (city !== ALL_CITIES) params.append("quarter", city);
+    if (type !== ALL_TYPES) params.append("type", type);
+    if (after) params.append("cursor", after);
+
+    const res = await fetch(`${API_BASE}/restaurant-facets/?${params}`);
+    if (!res.ok) throw new Error("Greška pri dohvaćanju restorana");
+    return res.json();
+  };
 
   // FETCH RESTORANA S BACKENDA
   useEffect(() => {
-    const fetchRestaurants = async () => {
+    let cancelled = false;
+    // pričekaj da korisnik završi s tipkanjem
+    const timer = setTimeout(async () => {
       try {
-        const res = await fetch(`${API_BASE}/restaurants/`);
-        if (!res.ok) throw new Error("Greška pri dohvaćanju restorana");
-
-        const json = await res.json();
-
-        //  MAPIRANJE BACKEND → FRONTEND SHAPE
-        const mapped = (json.items || []).map((r) => ({
-          id: r.rest_id,
-          name: r.name,
-          address: r.location,
-          city: r.quarter, // privremeno quarter → city
-          type: r.type,
-        }));
-
-        setData(mapped);
+        const json = await fetchPage(null);
+        if (cancelled) return;
+        setData((json.restaurants || []).map(toRestaurant));
+        setTotal(json.total || 0);
+        setFacets(json.facets || { type: [], quarter: [] });
+        setCursor(json.next_cursor);
+        setError(null);
       } catch (err) {
         console.error(err);
-        setError("Ne mogu dohvatiti restorane.");
+        if (!cancelled) setError("Ne mogu dohvatiti restorane.");
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
-    };
-
-    fetchRestaurants();
-  }, []);
+    }, 250);
 
-  //  FILTERI 
-  const cities = useMemo(() => {
-    const set = new Set(data.map((r) => r.city));
-    return ["Svi gradovi", ...Array.from(set)];
-  }, [data]);
-
-  const types = useMemo(() => {
-    const set = new Set(data.map((r) => r.type));
-    return ["Sve vrste", ...Array.from(set)];
-  }, [data]);
-
-  const filtered = useMemo(() => {
-    return data.filter((r) => {
-      const matchesQuery =
-        r.name.toLowerCase().includes(query.toLowerCase()) ||
-        r.address.toLowerCase().includes(query.toLowerCase());
-
-      const matchesCity = city === "Svi gradovi" ? true : r.city === city;
-      const matchesType = type === "Sve vrste" ? true : r.type === type;
-
-      return matchesQuery && matchesCity && matchesType;
-    });
-  }, [data, query, city, type]);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [query, city, type]);
+
+  const loadMore = async () => {
+    try {
+      const json = await fetchPage(cursor);
+      setData((previous) => [...previous, ...(json.restaurants || []).map(toRestaurant)]);
+      setCursor(json.next_cursor);
+    } catch (err) {
+      console.error(err);
+      setError("Ne mogu dohvatiti restorane.");
+    }
+  };
+
+  //  FILTERI (s brojem objekata)
+  const cities = [
+    { value: ALL_CITIES, label: ALL_CITIES },
+    ...facets.quarter.map((f) => ({ value: f.value, label: `${f.value} (${f.count})` })),
+  ];
+
+  const types = [
+    { value: ALL_TYPES, label: ALL_TYPES },
+    ...facets.type.map((f) => ({ value: f.value, label: `${f.value} (${f.count})` })),
+  ];
 
   // STATES
   if (loading) return <p>Učitavanje restorana...</p>;
@@ -105,8 +129,8 @@ function Restaurants() {
           <label>Grad</label>
           <select value={city} onChange={(e) => setCity(e.target.value)}>
             {cities.map((c) => (
-              <option key={c} value={c}>
-                {c}
+              <option key={c.value} value={c.value}>
+                {c.label}
               </option>
             ))}
           </select>
@@ -116,8 +140,8 @@ function Restaurants() {
           <label>Vrsta</label>
           <select value={type} onChange={(e) => setType(e.target.value)}>
             {types.map((t) => (
-              <option key={t} value={t}>
-                {t}
+              <option key={t.value} value={t.value}>
+                {t.label}
               </option>
             ))}
           </select>
@@ -125,14 +149,20 @@ function Restaurants() {
       </div>
 
       <div className="count">
-        Prikazano {filtered.length} od {data.length} objekata
+        Prikazano {data.length} od {total} objekata
       </div>
 
       <div className="cards-grid">
-        {filtered.map((r) => (
+        {data.map((r) => (
           <RestaurantCard key={r.id} restaurant={r} />
         ))}
       </div>
+
+      {cursor && (
+        <button className="load-more-btn" onClick={loadMore}>
+          Učitaj još
+        </button>
+      )}
     </div>
   );
 }